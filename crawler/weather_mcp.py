@@ -23,6 +23,13 @@ if not AMAP_API_KEY:
     print("请设置环境变量 AMAP_API_KEY", file=sys.stderr)
     sys.exit(1)
 
+# Ensure repo root is on sys.path (supports `python crawler/weather_mcp.py`)
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _REPO_ROOT not in sys.path:
+    sys.path.insert(0, _REPO_ROOT)
+
+from middleware.json_utils import amap_json
+
 # 天气类型枚举
 class WeatherType(str, Enum):
     BASE = "base"  # 实况天气
@@ -145,7 +152,7 @@ class WeatherMCP:
             }
             
             response = await self.client.get(f"{AMAP_BASE_URL}/v3/geocode/geo", params=geocode_params)
-            data = response.json()
+            data = amap_json(response)
             
             if data.get("status") == "1" and data.get("geocodes"):
                 geo = data["geocodes"][0]
@@ -162,7 +169,7 @@ class WeatherMCP:
             }
             
             response = await self.client.get(f"{AMAP_BASE_URL}/v3/place/text", params=poi_params)
-            data = response.json()
+            data = amap_json(response)
             
             if data.get("status") == "1" and data.get("pois"):
                 poi = data["pois"][0]
@@ -179,7 +186,7 @@ class WeatherMCP:
             }
             
             response = await self.client.get(f"{AMAP_BASE_URL}/v3/config/district", params=district_params)
-            data = response.json()
+            data = amap_json(response)
             
             if data.get("status") == "1" and data.get("districts"):
                 district = data["districts"][0]
@@ -216,9 +223,9 @@ class WeatherMCP:
             print(f"调试: 天气查询参数: {params}", file=sys.stderr)
             
             response = await self.client.get(f"{AMAP_BASE_URL}/v3/weather/weatherInfo", params=params)
-            data = response.json()
+            data = amap_json(response)
             
-            print(f"调试: 天气API响应: {data}", file=sys.stderr)
+            print(f"调试: 天气API响应状态: {data.get('status')}, 信息: {data.get('info')}", file=sys.stderr)
             
             if data.get("status") != "1":
                 # 尝试使用直接的城市名（而不是adcode）
@@ -226,7 +233,7 @@ class WeatherMCP:
                     # 可能是adcode格式不对，尝试使用原始location
                     params["city"] = location
                     response = await self.client.get(f"{AMAP_BASE_URL}/v3/weather/weatherInfo", params=params)
-                    data = response.json()
+                    data = amap_json(response)
                     
                     if data.get("status") != "1":
                         return WeatherResult(
@@ -420,7 +427,7 @@ async def search_city_weather(
         
         async with httpx.AsyncClient() as client:
             response = await client.get(f"{AMAP_BASE_URL}/v3/place/text", params=params)
-            data = response.json()
+            data = amap_json(response)
             
             if data.get("status") == "1" and data.get("pois"):
                 pois = data["pois"][:limit]
@@ -0,0 +1,154 @@
+"""
+远程文件下载工具
+大块流式写入临时文件，完成（并校验）后原子重命名；网络中断时用 Range 请求断点续传
+"""
+
+import asyncio
+import hashlib
+import os
+import sys
+import uuid
+from typing import Any, Dict, Optional
+
+import httpx
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB，避免多 MB 图片/视频被拆成成千上万次小写入
+DOWNLOAD_MAX_RETRIES = 3
+DOWNLOAD_RETRY_BACKOFF = 1.0  # 第 n 次重试前等待 base * 2^(n-1) 秒；429/503 带 Retry-After 时以其为准
+DOWNLOAD_MAX_RETRY_AFTER = 60.0  # Retry-After 过长时最多等待这么久
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class DownloadError(Exception):
+    """下载失败（HTTP 错误、重试耗尽或校验不通过）"""
+
+
+class _RetryableStatus(Exception):
+    """服务端暂时不可用（限流或 5xx），与网络中断一样退避后重试"""
+
+    def __init__(self, status_code: int, retry_after: Optional[float]):
+        super().__init__(f"HTTP {status_code}")
+        self.retry_after = retry_after
+
+
+def _retry_after_seconds(resp: httpx.Response) -> Optional[float]:
+    """Retry-After 头（秒数形式）；缺失或为 HTTP 日期时返回 None，按指数退避处理"""
+    try:
+        return min(max(0.0, float(resp.headers.get("retry-after", ""))), DOWNLOAD_MAX_RETRY_AFTER)
+    except ValueError:
+        return None
+
+
+def _sha256_of(path: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest
+
+
+def _content_range_total(resp: httpx.Response) -> Optional[int]:
+    """Content-Range（"bytes 0-99/1234" 或 "bytes */1234"）中的文件总大小，未知时返回 None"""
+    total = resp.headers.get("content-range", "").rsplit("/", 1)[-1]
+    return int(total) if total.isdigit() else None
+
+
+async def _request_from(client: httpx.AsyncClient, url: str, offset: int):
+    """
+    以流式方式请求 url 中 offset 之后的内容，返回 (响应, 实际起始位置)
+    服务端返回 206 但 Content-Range 起点与 offset 不符时，关闭该响应并不带 Range 重新请求整个文件
+    """
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    resp = await client.send(client.build_request("GET", url, headers=headers), stream=True)
+    if resp.status_code == 206 and offset and not resp.headers.get("content-range", "").startswith(f"bytes {offset}-"):
+        await resp.aclose()
+        print(f"续传位置不符（{resp.headers.get('content-range')}），从头下载: {url}", file=sys.stderr)
+        resp = await client.send(client.build_request("GET", url), stream=True)
+        offset = 0
+    return resp, offset
+
+
+async def download_file(
+    client: httpx.AsyncClient,
+    url: str,
+    dest_path: str,
+    expected_sha256: Optional[str] = None,
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+    max_retries: int = DOWNLOAD_MAX_RETRIES,
+    keep_partial: bool = False,
+) -> Dict[str, Any]:
+    """
+    下载 url 到 dest_path
+
+    参数:
+        client: 复用的异步 HTTP 客户端
+        url: 远程地址
+        dest_path: 目标路径；下载过程中写入临时 .part 文件，成功后才重命名
+        expected_sha256: 可选，期望的 SHA-256（十六进制），不匹配时抛出 DownloadError
+        chunk_size: 读写块大小
+        max_retries: 网络中断或服务端返回 429/5xx 后的重试次数（指数退避）
+        keep_partial: 失败时是否保留 .part 文件（之后以相同 url 调用可继续续传）；
+            为 True 时临时文件固定为 dest_path + ".part"，否则每次下载使用独立的临时文件名，并发写同一目标互不干扰
+
+    返回:
+        {"path": 最终路径, "bytes": 文件大小, "sha256": 文件摘要, "resumed": 是否发生过续传}
+    """
+    os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+    part_path = dest_path + ".part" if keep_partial else f"{dest_path}.{uuid.uuid4().hex}.part"
+    resumed = False
+
+    try:
+        for attempt in range(max_retries + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+            try:
+                resp, offset = await _request_from(client, url, offset)
+                try:
+                    if resp.status_code == 416 and offset and _content_range_total(resp) == offset:
+                        # .part 已经是完整文件（上次写完后在重命名前中断）
+                        expected_total = offset
+                        resumed = True
+                        digest = _sha256_of(part_path, chunk_size)
+                    else:
+                        if resp.status_code == 200:
+                            offset = 0  # 服务端忽略了 Range，整体重下
+                        elif resp.status_code in RETRYABLE_STATUS_CODES:
+                            raise _RetryableStatus(resp.status_code, _retry_after_seconds(resp))
+                        elif not (resp.status_code == 206 and offset):
+                            raise DownloadError(f"下载失败: HTTP {resp.status_code} {url}")
+
+                        content_length = resp.headers.get("content-length")
+                        expected_total = offset + int(content_length) if content_length else None
+                        resumed = resumed or offset > 0
+
+                        digest = _sha256_of(part_path, chunk_size) if offset else hashlib.sha256()
+                        with open(part_path, "ab" if offset else "wb", buffering=chunk_size) as f:
+                            async for chunk in resp.aiter_bytes(chunk_size):
+                                f.write(chunk)
+                                digest.update(chunk)
+                finally:
+                    await resp.aclose()
+
+                size = os.path.getsize(part_path)
+                if expected_total is not None and size < expected_total:
+                    raise httpx.ReadError(f"连接提前结束: {size}/{expected_total} 字节")
+                break
+            except (httpx.TransportError, httpx.StreamError, _RetryableStatus) as e:
+                if attempt >= max_retries:
+                    raise DownloadError(f"下载失败（已重试 {max_retries} 次）: {e} {url}") from e
+                delay = getattr(e, "retry_after", None)
+                if delay is None:
+                    delay = DOWNLOAD_RETRY_BACKOFF * 2 ** attempt
+                print(f"下载中断，{delay:.1f} 秒后续传 ({attempt + 1}/{max_retries}): {e}", file=sys.stderr)
+                await asyncio.sleep(delay)
+
+        sha256 = digest.hexdigest()
+        if expected_sha256 and sha256.lower() != expected_sha256.lower():
+            raise DownloadError(f"校验失败: 期望 {expected_sha256}，实际 {sha256}")
+
+        os.replace(part_path, dest_path)
+        return {"path": dest_path, "bytes": size, "sha256": sha256, "resumed": resumed}
+    except Exception:
+        if not keep_partial and os.path.exists(part_path):
+            os.remove(part_path)
+        raise
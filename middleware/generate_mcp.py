@@ -1,15 +1,157 @@
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import FastMCP, Context
+import asyncio
+import hashlib
+import json
 import os
-import requests
+import time
+import httpx
 import uuid
 import re
-from typing import Dict, Any
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional
 
-mcp = FastMCP("Image Generator")
+try:
+    from PIL import Image
+except ImportError:  # 未安装 Pillow 时跳过海报压缩，仍返回原图
+    Image = None
+
+# Ensure repo root is on sys.path (supports `python middleware/generate_mcp.py`)
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _REPO_ROOT not in sys.path:
+    sys.path.insert(0, _REPO_ROOT)
+
+from middleware.download_utils import download_file
+from middleware.publish_queue import FAILED, NEEDS_CHECK, PENDING, UPLOADING, PublishQueue
+
+
+@asynccontextmanager
+async def _server_lifespan(server):
+    """服务启动时把上次进程遗留的海报任务重新排队，不必等到第一次调用任务接口"""
+    _recover_poster_jobs()
+    yield {}
+
+
+mcp = FastMCP("Image Generator", lifespan=_server_lifespan)
 
 # Nano Banana API Configuration
 NANO_BANANA_API_URL = "https://api.acedata.cloud/nano-banana/images"
 
+# HTTP 客户端配置：连接超时要短，生成接口本身耗时较长（常见数十秒），读取超时放宽
+HTTP_CONNECT_TIMEOUT = float(os.getenv("NANO_BANANA_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("NANO_BANANA_READ_TIMEOUT", "180"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("NANO_BANANA_MAX_CONNECTIONS", "20"))
+
+# 本地存储
+GENERATED_IMAGES_DIR = os.path.join(os.getcwd(), "generated_images")
+POSTER_JOBS_DIR = os.path.join(GENERATED_IMAGES_DIR, "jobs")
+POSTER_JOB_CONCURRENCY = int(os.getenv("POSTER_JOB_CONCURRENCY", "2"))  # 同时进行的生成任务数
+POSTER_JOB_MAX_ATTEMPTS = int(os.getenv("POSTER_JOB_MAX_ATTEMPTS", "3"))  # 重启恢复时的最多执行次数，超过标记 failed
+POSTER_JOB_TTL = float(os.getenv("POSTER_JOB_TTL_HOURS", "168")) * 3600  # 已结束任务记录的保留时长
+POSTER_BATCH_CONCURRENCY = int(os.getenv("POSTER_BATCH_CONCURRENCY", "4"))  # 批量生成的并发数
+NANO_BANANA_RATE_PER_MINUTE = float(os.getenv("NANO_BANANA_RATE_PER_MINUTE", "20"))  # 服务商调用频率上限
+POSTER_CACHE_MAX_BYTES = int(float(os.getenv("POSTER_CACHE_MAX_MB", "1024")) * 1024 * 1024)  # generated_images 容量上限
+
+# 发布前的海报压缩：按平台尺寸缩放并转码，另生成一张缩略图
+POSTER_OPTIMIZE_FORMAT = os.getenv("POSTER_OPTIMIZE_FORMAT", "jpeg").lower()  # jpeg / webp / png（调色板量化）
+POSTER_TARGET_WIDTH = int(os.getenv("POSTER_TARGET_WIDTH", "1080"))  # 小红书推荐宽度
+POSTER_OPTIMIZE_QUALITY = int(os.getenv("POSTER_OPTIMIZE_QUALITY", "88"))
+POSTER_THUMBNAIL_SIZE = int(os.getenv("POSTER_THUMBNAIL_SIZE", "320"))  # 缩略图最长边
+POSTER_OPTIMIZE_WORKERS = int(os.getenv("POSTER_OPTIMIZE_WORKERS", "2"))
+_OPTIMIZED_EXTENSIONS = {"jpeg": ".jpg", "webp": ".webp", "png": ".png"}
+
+# 近重复海报检测：64 位 dHash，汉明距离不超过阈值视为同一张图
+POSTER_HASH_INDEX_PATH = os.path.join(GENERATED_IMAGES_DIR, "phash_index.json")
+POSTER_DUPLICATE_DISTANCE = int(os.getenv("POSTER_DUPLICATE_DISTANCE", "6"))
+# 发布队列（与 web_utils.PUBLISH_QUEUE_DB 同一个文件）：回收重复海报时跳过仍待发布的图片
+PUBLISH_QUEUE_DB = os.path.join(os.getenv("ROOT_PATH", os.path.join(os.getcwd(), "data_storage")), "publish_queue.db")
+
+_http_client: Optional[httpx.AsyncClient] = None
+_image_pool: Optional[ProcessPoolExecutor] = None
+_poster_locks: Dict[str, List[Any]] = {}  # cache_key -> [asyncio.Lock, 等待/持有者数量]
+
+
+class RateLimiter:
+    """按固定间隔放行请求的限速器（所有生成调用共享，保证不超过服务商频率上限）"""
+
+    def __init__(self, rate_per_minute: float):
+        self.interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0.0
+        self._next_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self) -> None:
+        if self.interval <= 0:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+_provider_rate_limiter = RateLimiter(NANO_BANANA_RATE_PER_MINUTE)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """返回进程内共享的异步 HTTP 客户端（连接池复用，不阻塞事件循环）"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS // 2,
+            ),
+            follow_redirects=True,
+        )
+    return _http_client
+
+
+@asynccontextmanager
+async def _poster_key_lock(cache_key: str):
+    """同一 cache_key 的生成串行执行：后来者等第一个完成后直接命中缓存，不重复调用接口、不争抢同一个文件"""
+    entry = _poster_locks.setdefault(cache_key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            _poster_locks.pop(cache_key, None)
+
+
+def get_image_pool() -> ProcessPoolExecutor:
+    """返回共享的进程池：图片缩放/编码是 CPU 密集操作，放在子进程里不阻塞事件循环"""
+    global _image_pool
+    if _image_pool is None:
+        _image_pool = ProcessPoolExecutor(max_workers=POSTER_OPTIMIZE_WORKERS)
+    return _image_pool
+
+
+# 提示词校验规则（模块加载时构建一次，校验时不再重复创建列表/编译正则）
+_CJK_RE = re.compile(r"[\u4e00-\u9fff\u3400-\u4dbf\uf900-\ufaff]")
+_FORBIDDEN_PROMPT_TOKENS = ("##", "---", "第一行", "第二行", "第三行", "第四行", "第五行", "输出格式", "严禁", "示例", "执行步骤")
+# 不含汉字的 prompt 不可能命中中文禁用词，只需查剩下的这几个
+_NON_CJK_FORBIDDEN_PROMPT_TOKENS = tuple(t for t in _FORBIDDEN_PROMPT_TOKENS if not _CJK_RE.search(t))
+_LIST_PREFIXES = ("-", "•", "*", "1)", "1.", "（1）")
+_TITLE_REQUIRED_RE = re.compile(r"one day|one-day|1-day")
+_TITLE_FORBIDDEN_RE = re.compile(
+    r"morning|afternoon|evening|weather|outfit"
+    r"|8:00|11:00|12:00|15:00|16:00|19:00"
+    r"|infographic|poster|layout|module"
+)
+# 第 2–4 行: 行号 -> (模块英文名, 起止时间, 缺少模块时的错误)
+_TIME_PANELS = {
+    2: ("morning", ("8:00", "11:00"), "第 2 行必须为 MORNING（英文）模块"),
+    3: ("afternoon", ("12:00", "15:00"), "第 3 行必须为 AFTERNOON（英文）模块"),
+    4: ("evening", ("16:00", "19:00"), "第 4 行必须为 EVENING（英文）模块"),
+}
+
 
 def _validate_travel_poster_prompt(prompt: str) -> Dict[str, Any]:
     """Validate that `prompt` matches the strict 6-line format from travel_image_prompt_guide.
@@ -20,6 +162,8 @@ def _validate_travel_poster_prompt(prompt: str) -> Dict[str, Any]:
     - Final poster text must be English-only (avoid Chinese to reduce garbling)
     - Time ranges must appear in lines 2–4
     - Line 6 must include weather + outfit advice
+
+    All problems are collected in one pass and returned together.
     """
     if prompt is None:
         return {"ok": False, "errors": ["prompt 不能为空"]}
@@ -28,91 +172,55 @@ def _validate_travel_poster_prompt(prompt: str) -> Dict[str, Any]:
     if not raw:
         return {"ok": False, "errors": ["prompt 不能为空"]}
 
-    if "\n\n" in raw:
-        return {"ok": False, "errors": ["prompt 不允许包含空行；必须严格 6 行，每行一个模块"]}
-
-    lines = [line.strip() for line in raw.splitlines()]
-    if any(not line for line in lines):
-        return {"ok": False, "errors": ["prompt 不允许出现空行；必须严格 6 行"]}
+    errors: list[str] = []
+    raw_lines = raw.splitlines()
+    lines = [line for line in map(str.strip, raw_lines) if line]
+    if len(lines) != len(raw_lines):
+        errors.append("prompt 不允许包含空行；必须严格 6 行，每行一个模块")
     if len(lines) != 6:
-        return {"ok": False, "errors": [f"prompt 必须严格 6 行；当前为 {len(lines)} 行"]}
+        errors.append(f"prompt 必须严格 6 行；当前为 {len(lines)} 行")
 
-    forbidden_tokens = ["##", "---", "第一行", "第二行", "第三行", "第四行", "第五行", "输出格式", "严禁", "示例", "执行步骤"]
-    for token in forbidden_tokens:
+    # 纯 ASCII 时跳过汉字扫描；没有汉字时中文禁用词也不可能出现，不必逐个查找
+    has_cjk = not raw.isascii() and _CJK_RE.search(raw) is not None
+    for token in _FORBIDDEN_PROMPT_TOKENS if has_cjk else _NON_CJK_FORBIDDEN_PROMPT_TOKENS:
         if token in raw:
-            return {"ok": False, "errors": [f"prompt 只能是最终六行内容，不能包含说明/标题（检测到：{token}）"]}
+            errors.append(f"prompt 只能是最终六行内容，不能包含说明/标题（检测到：{token}）")
 
     # English-only: reject any CJK characters to avoid Chinese text garbling.
     # (Prompt itself must be English-only; you can still pass `city` in Chinese to the guide.)
-    if re.search(r"[\u4e00-\u9fff\u3400-\u4dbf\uf900-\ufaff]", raw):
-        return {"ok": False, "errors": ["prompt 必须为英文纯文本（不得包含中文/汉字），以降低海报文字乱码概率"]}
+    if has_cjk:
+        errors.append("prompt 必须为英文纯文本（不得包含中文/汉字），以降低海报文字乱码概率")
 
+    # 逐行只遍历一次：通用检查 + 按行号的位置检查（仅在恰好 6 行时才有意义）
+    positional = len(lines) == 6
     for idx, line in enumerate(lines, start=1):
-        if line.startswith(("-", "•", "*", "1)", "1.", "（1）")):
-            return {"ok": False, "errors": [f"第 {idx} 行疑似列表/项目符号开头；最终输出必须为纯文本六行"]}
-        if "XX" in line or "xxx" in line.lower():
-            return {"ok": False, "errors": [f"第 {idx} 行仍包含占位符（如 XX）；请用明确内容填充"]}
-
-    errors: list[str] = []
-
-    # Line 1: title only.
-    # User requirement: first line must be a pure English title like “One Day Schedule of Changsha”.
-    l1 = lines[0].strip()
-    l1_lower = l1.lower()
-    if "one day" not in l1_lower and "one-day" not in l1_lower and "1-day" not in l1_lower:
-        errors.append("第 1 行必须是英文标题，并包含 'one day/one-day/1-day'（示例：One Day Schedule of Changsha）")
-    forbidden_in_title = [
-        "morning",
-        "afternoon",
-        "evening",
-        "weather",
-        "outfit",
-        "8:00",
-        "11:00",
-        "12:00",
-        "15:00",
-        "16:00",
-        "19:00",
-        "infographic",
-        "poster",
-        "layout",
-        "module",
-    ]
-    if any(tok in l1_lower for tok in forbidden_in_title):
-        errors.append("第 1 行只能是标题本身，不要包含分栏说明/时间段/布局指令")
-
-    # Line 2–4: enforce time ranges
-    required_time_markers = [
-        (2, ["8:00", "11:00"]),
-        (3, ["12:00", "15:00"]),
-        (4, ["16:00", "19:00"]),
-    ]
-    for line_no, markers in required_time_markers:
-        line = lines[line_no - 1]
         line_lower = line.lower()
-        if line_no == 2 and "morning" not in line_lower:
-            errors.append("第 2 行必须为 MORNING（英文）模块")
-        if line_no == 3 and "afternoon" not in line_lower:
-            errors.append("第 3 行必须为 AFTERNOON（英文）模块")
-        if line_no == 4 and "evening" not in line_lower:
-            errors.append("第 4 行必须为 EVENING（英文）模块")
-        if line_no == 6 and "the picture is 5 line sturcture, the first line is title, and 2,3,4 are morning, afternoon, evening. The 5 line is the weather and the outfit suggestion." not in line_lower:
-            errors.append("第 6 行必须为 STYLE CONTROL（英文）模块, 添加提示词：‘the picture is 5 line sturcture, the first line is title, and 2,3,4 are morning, afternoon, evening. The 5 line is the weather and the outfit suggestion. Global style (apply to ALL panels): clean travel infographic poster, soft illustration / watercolor feel, subtle paper texture, generous whitespace, well-aligned grid, no handwriting, no warped letters, no garbled text.‘")
-        # if any(bad in line_lower for bad in ["noon", "night"]):
-        #     errors.append(f"第 {line_no} 行请使用 Morning/Afternoon/Evening，不要使用 noon/night")
-        for m in markers:
-            if m not in line:
-                errors.append(f"第 {line_no} 行必须包含时间 {markers[0]}–{markers[1]}")
-                break
-
-    l5 = lines[4].lower()
-    if "weather" not in l5:
-        errors.append("第 5 行必须包含 weather 信息")
-    if "outfit" not in l5 and "wear" not in l5:
-        errors.append("第 5 行必须包含 outfit/穿衣建议（用英文表达）")
-    
-    # if "morning" in l5 or "afternoon" in l5 or "evening" in l5:
-    #     errors.append("第 5 行仅写天气与穿搭建议（可带收尾建议），不要再写早上/下午/晚上分栏，同时加上图片风格和清晰字体要求")
+        if line.startswith(_LIST_PREFIXES):
+            errors.append(f"第 {idx} 行疑似列表/项目符号开头；最终输出必须为纯文本六行")
+        if "XX" in line or "xxx" in line_lower:
+            errors.append(f"第 {idx} 行仍包含占位符（如 XX）；请用明确内容填充")
+        if not positional:
+            continue
+
+        if idx == 1:
+            # Line 1: title only.
+            # User requirement: first line must be a pure English title like “One Day Schedule of Changsha”.
+            if not _TITLE_REQUIRED_RE.search(line_lower):
+                errors.append("第 1 行必须是英文标题，并包含 'one day/one-day/1-day'（示例：One Day Schedule of Changsha）")
+            if _TITLE_FORBIDDEN_RE.search(line_lower):
+                errors.append("第 1 行只能是标题本身，不要包含分栏说明/时间段/布局指令")
+        elif idx in _TIME_PANELS:
+            # Line 2–4: enforce time ranges
+            panel, (start, end), panel_error = _TIME_PANELS[idx]
+            if panel not in line_lower:
+                errors.append(panel_error)
+            if start not in line or end not in line:
+                errors.append(f"第 {idx} 行必须包含时间 {start}–{end}")
+        elif idx == 5:
+            if "weather" not in line_lower:
+                errors.append("第 5 行必须包含 weather 信息")
+            if "outfit" not in line_lower and "wear" not in line_lower:
+                errors.append("第 5 行必须包含 outfit/穿衣建议（用英文表达）")
 
     if errors:
         return {"ok": False, "errors": errors}
@@ -120,6 +228,316 @@ def _validate_travel_poster_prompt(prompt: str) -> Dict[str, Any]:
     return {"ok": True}
 
 
+def _poster_cache_key(payload: Dict[str, Any]) -> str:
+    """海报内容地址：对 (prompt, negative_prompt, width, height, model) 取 SHA-256"""
+    key_fields = [payload.get(k) for k in ("prompt", "negative_prompt", "width", "height", "model")]
+    raw = json.dumps(key_fields, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _poster_cache_path(cache_key: str) -> str:
+    return os.path.join(GENERATED_IMAGES_DIR, f"generated_{cache_key}.png")
+
+
+def _poster_variant_paths(original_path: str) -> Dict[str, str]:
+    """原图对应的压缩版与缩略图路径（与原图同名前缀，随原图一起淘汰）"""
+    stem = os.path.splitext(original_path)[0]
+    ext = _OPTIMIZED_EXTENSIONS.get(POSTER_OPTIMIZE_FORMAT, ".jpg")
+    return {
+        "optimized_path": f"{stem}.optimized{ext}",
+        "thumbnail_path": f"{stem}.thumb.jpg",
+    }
+
+
+def _save_atomic(image, path: str, **save_kwargs) -> None:
+    tmp_path = path + ".tmp"
+    image.save(tmp_path, **save_kwargs)
+    os.replace(tmp_path, path)
+
+
+def _optimize_poster_image(
+    src_path: str,
+    optimized_path: str,
+    thumbnail_path: str,
+    fmt: str,
+    target_width: int,
+    quality: int,
+    thumbnail_size: int,
+) -> Dict[str, Any]:
+    """在子进程中执行：缩放到目标宽度并转码，同时生成缩略图；压缩版不比原图小时改用原图"""
+    with Image.open(src_path) as im:
+        im.load()
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+
+        if target_width and im.width > target_width:
+            target_height = round(im.height * target_width / im.width)
+            im = im.resize((target_width, target_height), Image.Resampling.LANCZOS)
+
+        if fmt == "png":
+            # 调色板量化：海报以大色块和文字为主，256 色基本无损，体积通常缩小数倍
+            quantized = im.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+            _save_atomic(quantized, optimized_path, format="PNG", optimize=True)
+        elif fmt == "webp":
+            _save_atomic(im, optimized_path, format="WEBP", quality=quality, method=4)
+        else:
+            rgb = im.convert("RGB") if im.mode != "RGB" else im
+            _save_atomic(rgb, optimized_path, format="JPEG", quality=quality, optimize=True, progressive=True)
+
+        thumb = im.convert("RGB") if im.mode != "RGB" else im.copy()
+        thumb.thumbnail((thumbnail_size, thumbnail_size), Image.Resampling.LANCZOS)
+        _save_atomic(thumb, thumbnail_path, format="JPEG", quality=80, optimize=True)
+        size = im.size
+
+    original_bytes = os.path.getsize(src_path)
+    optimized_bytes = os.path.getsize(optimized_path)
+    if optimized_bytes >= original_bytes:
+        # 原图本身已经很小（如色块为主的 PNG），转码反而变大：删除压缩版，发布时直接用原图
+        os.remove(optimized_path)
+        optimized_path, optimized_bytes = src_path, original_bytes
+    return {
+        "optimized_path": optimized_path,
+        "width": size[0],
+        "height": size[1],
+        "original_bytes": original_bytes,
+        "optimized_bytes": optimized_bytes,
+        "thumbnail_bytes": os.path.getsize(thumbnail_path),
+    }
+
+
+async def optimize_poster(original_path: str) -> Dict[str, Any]:
+    """
+    为已保存的海报生成发布用压缩版与缩略图（已存在则直接复用）
+
+    返回:
+        {"optimized_path", "thumbnail_path", ...}；未安装 Pillow 或处理失败时返回空字典，调用方继续使用原图
+    """
+    if Image is None:
+        print("未安装 Pillow，跳过海报压缩", file=sys.stderr)
+        return {}
+
+    variants = _poster_variant_paths(original_path)
+    if os.path.exists(variants["thumbnail_path"]):
+        # 缩略图最后写入，它存在说明处理已完成；压缩版不存在表示上次判定原图更小
+        if os.path.exists(variants["optimized_path"]):
+            return dict(variants)
+        return {**variants, "optimized_path": original_path}
+
+    try:
+        loop = asyncio.get_running_loop()
+        stats = await loop.run_in_executor(
+            get_image_pool(),
+            _optimize_poster_image,
+            original_path,
+            variants["optimized_path"],
+            variants["thumbnail_path"],
+            POSTER_OPTIMIZE_FORMAT,
+            POSTER_TARGET_WIDTH,
+            POSTER_OPTIMIZE_QUALITY,
+            POSTER_THUMBNAIL_SIZE,
+        )
+    except Exception as e:
+        print(f"海报压缩失败，使用原图: {e}", file=sys.stderr)
+        return {}
+
+    print(
+        f"海报压缩: {stats['original_bytes'] / 1024:.0f}KB -> {stats['optimized_bytes'] / 1024:.0f}KB "
+        f"({stats['width']}x{stats['height']})"
+        + ("，压缩版不比原图小，使用原图" if stats["optimized_path"] == original_path else ""),
+        file=sys.stderr,
+    )
+    return {**variants, **stats}
+
+
+def _evict_generated_images(max_bytes: int = POSTER_CACHE_MAX_BYTES, keep: Optional[str] = None) -> List[str]:
+    """按最近使用时间（mtime）淘汰 generated_images 下的旧海报，使总大小不超过上限"""
+    if not os.path.isdir(GENERATED_IMAGES_DIR):
+        return []
+
+    # 按原图分组：压缩版/缩略图（generated_<key>.optimized.jpg 等）跟随原图计入容量、一起淘汰
+    groups: Dict[str, List[str]] = {}
+    for name in os.listdir(GENERATED_IMAGES_DIR):
+        if name.startswith("generated_") and not name.endswith((".part", ".tmp")):
+            groups.setdefault(name.split(".", 1)[0], []).append(os.path.join(GENERATED_IMAGES_DIR, name))
+
+    entries = []
+    total = 0
+    for stem, paths in groups.items():
+        original = os.path.join(GENERATED_IMAGES_DIR, stem + ".png")
+        try:
+            mtime = os.stat(original).st_mtime if original in paths else 0.0
+            size = sum(os.path.getsize(path) for path in paths)
+        except OSError:
+            continue
+        entries.append((mtime, size, original, paths))
+        total += size
+
+    removed = []
+    for _, size, original, paths in sorted(entries):
+        if total <= max_bytes:
+            break
+        if original == keep:
+            continue
+        try:
+            for path in paths:
+                os.remove(path)
+            total -= size
+            removed.append(original)
+        except OSError:
+            continue
+    return removed
+
+
+def _poster_group_paths(original_path: str) -> List[str]:
+    """原图及其压缩版/缩略图的全部文件路径"""
+    directory, name = os.path.split(original_path)
+    prefix = name.split(".", 1)[0] + "."
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return [os.path.join(directory, n) for n in names if n.startswith(prefix) and not n.endswith((".part", ".tmp"))]
+
+
+def _compute_dhash(path: str, hash_size: int = 8) -> str:
+    """在子进程中执行：差值哈希（缩成 (hash_size+1)×hash_size 灰度图，比较相邻像素明暗）"""
+    with Image.open(path) as im:
+        gray = im.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = gray.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def _hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class PosterHashIndex:
+    """generated_images 原图的感知哈希索引：{文件名: {"dhash", "size", "mtime"}}，单个 JSON 文件，增量维护"""
+
+    def __init__(self, path: str = POSTER_HASH_INDEX_PATH):
+        self.path = path
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self._entries = {}
+        return self._entries
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries(), f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def find_similar(self, dhash: str, max_distance: int, exclude: Optional[str] = None) -> List[Dict[str, Any]]:
+        """按汉明距离从小到大返回索引中的近重复海报"""
+        target = int(dhash, 16)
+        matches = []
+        for name, entry in self.entries().items():
+            if name == exclude:
+                continue
+            distance = _hamming_distance(target, int(entry["dhash"], 16))
+            if distance <= max_distance:
+                matches.append({"name": name, "distance": distance})
+        matches.sort(key=lambda m: m["distance"])
+        return matches
+
+    def discard(self, names: List[str]) -> None:
+        """移除已删除海报的条目（只在有变化时写盘）"""
+        entries = self.entries()
+        removed = [name for name in names if entries.pop(name, None) is not None]
+        if removed:
+            self.save()
+
+
+_hash_index = PosterHashIndex()
+
+
+async def _hash_image(path: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_image_pool(), _compute_dhash, path)
+
+
+async def _refresh_hash_index() -> Dict[str, Dict[str, Any]]:
+    """增量同步索引：移除已删除（含被淘汰）的海报，只为新增或内容变化的原图计算哈希"""
+    entries = _hash_index.entries()
+    on_disk: Dict[str, int] = {}
+    if os.path.isdir(GENERATED_IMAGES_DIR):
+        for name in os.listdir(GENERATED_IMAGES_DIR):
+            # 只索引原图（generated_<key>.png），压缩版/缩略图跟随原图
+            if name.startswith("generated_") and name.endswith(".png") and name.count(".") == 1:
+                try:
+                    on_disk[name] = os.path.getsize(os.path.join(GENERATED_IMAGES_DIR, name))
+                except OSError:
+                    continue
+
+    changed = False
+    for name in [n for n in entries if n not in on_disk]:
+        del entries[name]
+        changed = True
+
+    pending = [name for name, size in on_disk.items() if entries.get(name, {}).get("size") != size]
+    if pending:
+        hashes = await asyncio.gather(
+            *(_hash_image(os.path.join(GENERATED_IMAGES_DIR, name)) for name in pending),
+            return_exceptions=True,
+        )
+        for name, dhash in zip(pending, hashes):
+            if isinstance(dhash, Exception):
+                print(f"计算感知哈希失败 {name}: {dhash}", file=sys.stderr)
+                continue
+            path = os.path.join(GENERATED_IMAGES_DIR, name)
+            entries[name] = {"dhash": dhash, "size": on_disk[name], "mtime": os.path.getmtime(path)}
+            changed = True
+
+    if changed:
+        _hash_index.save()
+    return entries
+
+
+async def index_poster(local_path: str, max_distance: int = POSTER_DUPLICATE_DISTANCE) -> List[Dict[str, Any]]:
+    """
+    把新保存的海报加入哈希索引，并返回已有的近重复海报（不含自身）
+
+    返回:
+        [{"local_path", "distance"}]；未安装 Pillow 或计算失败时返回空列表
+    """
+    if Image is None:
+        return []
+    name = os.path.basename(local_path)
+    try:
+        # 只更新刚写入（或命中缓存）的这一张，不重新扫描整个目录；大小未变时沿用已有哈希
+        entries = _hash_index.entries()
+        size = os.path.getsize(local_path)
+        entry = entries.get(name)
+        if entry and entry.get("size") == size:
+            dhash = entry["dhash"]
+        else:
+            dhash = await _hash_image(local_path)
+            entries[name] = {"dhash": dhash, "size": size, "mtime": os.path.getmtime(local_path)}
+            _hash_index.save()
+    except Exception as e:
+        print(f"更新感知哈希索引失败: {e}", file=sys.stderr)
+        return []
+
+    similar = []
+    for m in _hash_index.find_similar(dhash, max_distance, exclude=name):
+        path = os.path.join(GENERATED_IMAGES_DIR, m["name"])
+        if os.path.exists(path):  # 索引中可能残留被手动删除的海报，下次全量同步时清理
+            similar.append({"local_path": path, "distance": m["distance"]})
+    return similar
+
+
 @mcp.prompt(
     name='travel_image_prompt_guide',
     description='旅游攻略长图的提示词生成框架（严格六行结构；不要求预算）'
@@ -167,9 +585,9 @@ Global style (apply to ALL panels): clean travel infographic poster, soft illust
 
 @mcp.tool(
     name='generate_image_nano_banana',
-    description='使用 Nano Banana API 生成图片（强制：prompt 必须为 travel_image_prompt_guide 的最终六行格式；不要求门票/预算）。若 prompt 不合格，可传 city/weather 获取框架并按其重写后再调用。'
+    description='使用 Nano Banana API 生成图片（强制：prompt 必须为 travel_image_prompt_guide 的最终六行格式；不要求门票/预算）。若 prompt 不合格，可传 city/weather 获取框架并按其重写后再调用。发布到小红书时优先使用返回的 optimized_path（已压缩到平台尺寸）。'
 )
-def generate_image_nano_banana(
+async def generate_image_nano_banana(
     prompt: str = "",
     city: str = "",
     weather: str = "Sunny 20°C",
@@ -191,7 +609,7 @@ def generate_image_nano_banana(
         height: 图片高度 (默认 1024)
     
     返回:
-        API 响应结果，包含图片 URL 或任务信息
+        API 响应结果，包含图片 URL、原图 local_path、发布用压缩图 optimized_path 与缩略图 thumbnail_path
     """
     validation = _validate_travel_poster_prompt(prompt)
     if not validation.get("ok"):
@@ -243,9 +661,34 @@ def generate_image_nano_banana(
     
     if negative_prompt:
         payload["negative_prompt"] = negative_prompt
+
+    cache_key = _poster_cache_key(payload)
+    async with _poster_key_lock(cache_key):
+        return await _generate_poster(payload, headers, cache_key)
+
+
+async def _generate_poster(payload: Dict[str, Any], headers: Dict[str, str], cache_key: str) -> Dict[str, Any]:
+    """调用接口生成海报并保存（调用方已持有该 cache_key 的锁）"""
+    # 相同参数的海报直接复用已保存的图片，不再调用付费接口
+    cached_path = _poster_cache_path(cache_key)
+    if os.path.exists(cached_path):
+        os.utime(cached_path)  # 刷新最近使用时间，用于 LRU 淘汰
+        optimized = await optimize_poster(cached_path)
+        return {
+            "success": True,
+            "cached": True,
+            "image_url": None,
+            "local_path": cached_path,
+            "optimized_path": optimized.get("optimized_path"),
+            "thumbnail_path": optimized.get("thumbnail_path"),
+            "similar_posters": await index_poster(cached_path),
+            "message": f"命中缓存，已保存至 {cached_path}"
+        }
         
     try:
-        response = requests.post(NANO_BANANA_API_URL, headers=headers, json=payload)
+        client = get_http_client()
+        await _provider_rate_limiter.acquire()
+        response = await client.post(NANO_BANANA_API_URL, headers=headers, json=payload)
         
         if response.status_code == 200:
             result = response.json()
@@ -253,6 +696,9 @@ def generate_image_nano_banana(
             
             # Check for image URL
             image_url = None
+            local_path = None
+            optimized = {}
+            similar = []
             
             if "image_urls" in result and result["image_urls"]:
                 image_url = result["image_urls"][0]
@@ -264,23 +710,22 @@ def generate_image_nano_banana(
             if image_url:
                 try:
                     # Create directory if not exists
-                    save_dir = os.path.join(os.getcwd(), "generated_images")
+                    save_dir = GENERATED_IMAGES_DIR
                     os.makedirs(save_dir, exist_ok=True)
                     
-                    # Generate filename
-                    filename = f"generated_{uuid.uuid4()}.png"
-                    local_path = os.path.join(save_dir, filename)
+                    # Content-addressed filename
+                    local_path = _poster_cache_path(cache_key)
                     
-                    # Download image
-                    img_resp = requests.get(image_url, stream=True)
-                    if img_resp.status_code == 200:
-                        with open(local_path, 'wb') as f:
-                            for chunk in img_resp.iter_content(1024):
-                                f.write(chunk)
-                    else:
-                        local_path = None
+                    # Download image (temp file + atomic rename, so no truncated file is left behind)
+                    await download_file(client, image_url, local_path)
+                    # 发布用压缩版 + 缩略图（子进程处理，上传时优先使用 optimized_path）
+                    optimized = await optimize_poster(local_path)
+                    evicted = _evict_generated_images(keep=local_path)
+                    _hash_index.discard([os.path.basename(path) for path in evicted])
+                    # 与已有海报比对，提示近重复（避免重复发布同一张图）
+                    similar = await index_poster(local_path)
                 except Exception as save_err:
-                    print(f"Failed to save image: {save_err}")
+                    print(f"Failed to save image: {save_err}", file=sys.stderr)
                     local_path = None
 
             return {
@@ -289,7 +734,11 @@ def generate_image_nano_banana(
                 "trace_id": trace_id,
                 "image_url": image_url,
                 "local_path": local_path,
+                "optimized_path": optimized.get("optimized_path"),
+                "thumbnail_path": optimized.get("thumbnail_path"),
+                "similar_posters": similar,
                 "message": "图片生成成功" + (f"，已保存至 {local_path}" if local_path else "")
+                + (f"；与 {len(similar)} 张已有海报高度相似，发布前请确认未重复" if similar else "")
             }
         else:
             return {
@@ -305,13 +754,516 @@ def generate_image_nano_banana(
         }
 
 
-if __name__ == "__main__":
-    import sys
+class PosterJobStore:
+    """海报生成任务的持久化存储：每个任务一个 JSON 文件，重启后可恢复"""
+
+    def __init__(self, root: str = POSTER_JOBS_DIR):
+        self.root = root
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.root, f"{job_id}.json")
+
+    def save(self, job: Dict[str, Any]) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        job["updated_at"] = time.time()
+        tmp_path = self._path(job["job_id"]) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(job["job_id"]))
+
+    def load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not re.fullmatch(r"[0-9a-f]{32}", job_id or ""):
+            return None
+        try:
+            with open(self._path(job_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def all(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.root):
+            return []
+        jobs = []
+        for name in os.listdir(self.root):
+            if name.endswith(".json"):
+                job = self.load(name[:-len(".json")])
+                if job:
+                    jobs.append(job)
+        return jobs
+
+    def prune(self, ttl: float = POSTER_JOB_TTL) -> int:
+        """删除结束（succeeded/partial/failed）超过 ttl 秒的任务记录，返回删除数量"""
+        cutoff = time.time() - ttl
+        removed = 0
+        for job in self.all():
+            if job.get("status") in ("succeeded", "partial", "failed") and job.get("updated_at", 0) < cutoff:
+                try:
+                    os.remove(self._path(job["job_id"]))
+                    removed += 1
+                except OSError:
+                    continue
+        return removed
+
+
+_job_store = PosterJobStore()
+_job_semaphore: Optional[asyncio.Semaphore] = None
+_job_tasks: Dict[str, asyncio.Task] = {}
+_jobs_recovered = False
+_jobs_pruned_at = 0.0
+
+
+async def _run_poster_job(job_id: str) -> None:
+    """在并发上限内执行一个生成任务，并把每次状态变化写回磁盘"""
+    global _job_semaphore
+    if _job_semaphore is None:
+        _job_semaphore = asyncio.Semaphore(POSTER_JOB_CONCURRENCY)
+
+    try:
+        async with _job_semaphore:
+            job = _job_store.load(job_id)
+            if not job or job["status"] not in ("queued", "running"):
+                return
+            job["status"] = "running"
+            job["attempts"] = job.get("attempts", 0) + 1
+            _job_store.save(job)
+
+            try:
+                result = await generate_image_nano_banana(
+                    prompt=job["prompt"],
+                    negative_prompt=job.get("negative_prompt", ""),
+                    width=job["width"],
+                    height=job["height"],
+                )
+            except Exception as e:
+                result = {"success": False, "message": f"任务执行异常: {e}"}
+
+            if not result.get("success"):
+                job["status"] = "failed"
+                job["message"] = result.get("message")
+            elif not result.get("local_path"):
+                # 图片已生成但没能保存到本地：只有远程 image_url，调用方需要自行下载或重新提交
+                job["status"] = "partial"
+                job["message"] = "图片已生成，但保存到本地失败，仅返回 image_url"
+            else:
+                job["status"] = "succeeded"
+                job["message"] = result.get("message")
+            job["local_path"] = result.get("local_path")
+            job["optimized_path"] = result.get("optimized_path")
+            job["thumbnail_path"] = result.get("thumbnail_path")
+            job["image_url"] = result.get("image_url")
+            job["trace_id"] = result.get("trace_id")
+            if not result.get("success"):
+                job["error"] = result.get("error") or result.get("errors")
+            _job_store.save(job)
+    finally:
+        _job_tasks.pop(job_id, None)
+
+
+def _schedule_poster_job(job_id: str) -> None:
+    if job_id not in _job_tasks:
+        _job_tasks[job_id] = asyncio.get_running_loop().create_task(_run_poster_job(job_id))
+
+
+def _prune_poster_jobs() -> None:
+    """清理过期的任务记录（每小时最多一次）"""
+    global _jobs_pruned_at
+    now = time.time()
+    if now - _jobs_pruned_at < 3600:
+        return
+    _jobs_pruned_at = now
+    removed = _job_store.prune()
+    if removed:
+        print(f"已清理 {removed} 条过期的海报任务记录", file=sys.stderr)
+
+
+def _recover_poster_jobs() -> None:
+    """服务启动时把上次进程遗留的 queued/running 任务重新排队（只执行一次）；已执行满次数的直接标记失败"""
+    global _jobs_recovered
+    if _jobs_recovered:
+        return
+    _jobs_recovered = True
+    _prune_poster_jobs()
+    pending = [job for job in _job_store.all() if job.get("status") in ("queued", "running")]
+    for job in sorted(pending, key=lambda j: j.get("created_at", 0)):
+        if job.get("attempts", 0) >= POSTER_JOB_MAX_ATTEMPTS:
+            # 每次执行都在中途被进程退出打断（例如该 prompt 导致崩溃），不再无限重试
+            job["status"] = "failed"
+            job["message"] = f"任务已执行 {job['attempts']} 次均未完成，超过重试上限"
+            _job_store.save(job)
+            continue
+        _schedule_poster_job(job["job_id"])
+
+
+@mcp.tool(
+    name='submit_poster_job',
+    description='提交海报生成任务（异步队列，立即返回 job_id；prompt 要求同 generate_image_nano_banana）。之后用 get_poster_job 查询状态和本地路径。'
+)
+async def submit_poster_job(
+    prompt: str,
+    negative_prompt: str = "",
+    width: int = 1024,
+    height: int = 1024
+) -> Dict[str, Any]:
+    """
+    提交海报生成任务
+    
+    参数:
+        prompt: 图片描述 prompt（必须为 travel_image_prompt_guide 的最终六行格式）
+        negative_prompt: 负向提示词
+        width: 图片宽度 (默认 1024)
+        height: 图片高度 (默认 1024)
     
-    if "--sse" in sys.argv or os.getenv("MCP_TRANSPORT") == "sse":
+    返回:
+        job_id 与初始状态
+    """
+    validation = _validate_travel_poster_prompt(prompt)
+    if not validation.get("ok"):
+        return {
+            "success": False,
+            "message": "prompt 未通过强制校验：必须使用 travel_image_prompt_guide 的最终六行格式。",
+            "errors": validation.get("errors", []),
+        }
+
+    now = time.time()
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "status": "queued",
+        "prompt": prompt,
+        "negative_prompt": negative_prompt,
+        "width": width,
+        "height": height,
+        "attempts": 0,
+        "created_at": now,
+    }
+    _job_store.save(job)
+    _schedule_poster_job(job["job_id"])
+    _prune_poster_jobs()
+
+    return {
+        "success": True,
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "message": "任务已提交，请用 get_poster_job 查询进度",
+    }
+
+
+@mcp.tool(
+    name='get_poster_job',
+    description='查询海报生成任务状态（queued/running/succeeded/partial/failed），完成后返回本地图片路径；partial 表示图片已生成但未能保存到本地，只有 image_url'
+)
+async def get_poster_job(job_id: str) -> Dict[str, Any]:
+    """
+    查询海报生成任务
+    
+    参数:
+        job_id: submit_poster_job 返回的任务 ID
+    
+    返回:
+        任务状态、本地路径和错误信息
+    """
+    job = _job_store.load(job_id)
+    if not job:
+        return {"success": False, "message": f"任务不存在: {job_id}"}
+
+    return {
+        "success": True,
+        "job_id": job_id,
+        "status": job["status"],
+        "local_path": job.get("local_path"),
+        "optimized_path": job.get("optimized_path"),
+        "thumbnail_path": job.get("thumbnail_path"),
+        "image_url": job.get("image_url"),
+        "message": job.get("message"),
+        "error": job.get("error"),
+        "attempts": job.get("attempts", 0),
+        "created_at": job.get("created_at"),
+        "updated_at": job.get("updated_at"),
+    }
+
+
+@mcp.tool(
+    name='generate_posters_batch',
+    description='批量生成多个城市的一日游海报：items 为 [{"city": 城市, "prompt": 最终六行prompt}]。先统一校验全部 prompt，再在服务商限速内并发生成，每完成一项即推送进度。'
+)
+async def generate_posters_batch(
+    items: List[Dict[str, str]],
+    negative_prompt: str = "",
+    width: int = 1024,
+    height: int = 1024,
+    skip_invalid: bool = False,
+    ctx: Context = None
+) -> Dict[str, Any]:
+    """
+    批量生成海报
+    
+    参数:
+        items: 城市与六行 prompt 列表，如 [{"city": "三亚", "prompt": "..."}]
+        negative_prompt: 负向提示词（所有城市共用）
+        width: 图片宽度 (默认 1024)
+        height: 图片高度 (默认 1024)
+        skip_invalid: 有 prompt 未通过校验时，是否跳过它们继续生成其余城市（默认整批拒绝）
+    
+    返回:
+        按完成顺序排列的每个城市的生成结果
+    """
+    invalid = []
+    valid_items = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            invalid.append({"index": index, "city": "", "errors": ["每一项必须是 {\"city\": ..., \"prompt\": ...} 对象"]})
+            continue
+        city = str(item.get("city", "")).strip()
+        validation = _validate_travel_poster_prompt(item.get("prompt"))
+        if validation.get("ok"):
+            valid_items.append((index, city, item["prompt"]))
+        else:
+            invalid.append({"index": index, "city": city, "errors": validation.get("errors", [])})
+
+    if invalid and not skip_invalid:
+        return {
+            "success": False,
+            "message": f"{len(invalid)} 个 prompt 未通过校验，整批未生成；请按 travel_image_prompt_guide 重写后重试",
+            "invalid": invalid,
+        }
+
+    semaphore = asyncio.Semaphore(POSTER_BATCH_CONCURRENCY)
+
+    async def run_item(index: int, city: str, prompt: str) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                result = await generate_image_nano_banana(
+                    prompt=prompt,
+                    negative_prompt=negative_prompt,
+                    width=width,
+                    height=height,
+                )
+            except Exception as e:
+                result = {"success": False, "message": f"请求异常: {e}"}
+        return {
+            "index": index,
+            "city": city,
+            "success": bool(result.get("success")),
+            "cached": bool(result.get("cached")),
+            "local_path": result.get("local_path"),
+            "optimized_path": result.get("optimized_path"),
+            "thumbnail_path": result.get("thumbnail_path"),
+            "image_url": result.get("image_url"),
+            "message": result.get("message"),
+        }
+
+    tasks = [asyncio.create_task(run_item(*item)) for item in valid_items]
+    results = []
+    # 谁先完成先返回，单个慢城市不会阻塞其余城市
+    for finished in asyncio.as_completed(tasks):
+        item_result = await finished
+        results.append(item_result)
+        if ctx is not None:
+            try:
+                await ctx.report_progress(len(results), len(tasks))
+                status = "完成" if item_result["success"] else "失败"
+                await ctx.info(f"[{len(results)}/{len(tasks)}] {item_result['city']} {status}: {item_result['local_path'] or item_result['message']}")
+            except Exception as e:
+                print(f"推送进度失败: {e}", file=sys.stderr)
+
+    success_count = sum(1 for r in results if r["success"])
+    return {
+        "success": True,
+        "total": len(items),
+        "success_count": success_count,
+        "failed_count": len(results) - success_count,
+        "skipped_invalid": invalid,
+        "results": results,
+    }
+
+
+@mcp.tool(
+    name='find_duplicate_posters',
+    description='在 generated_images 中查找与指定图片近似重复的海报（感知哈希 dHash，汉明距离越小越相似）。发布前可用于确认没有发过同一张图。'
+)
+async def find_duplicate_posters(image_path: str, max_distance: int = POSTER_DUPLICATE_DISTANCE) -> Dict[str, Any]:
+    """
+    查找近重复海报
+
+    参数:
+        image_path: 待比对的图片路径（可以是 generated_images 之外的图片）
+        max_distance: 64 位哈希的汉明距离阈值（默认 6；0 表示几乎完全相同）
+
+    返回:
+        按相似度排序的近重复海报列表
+    """
+    if Image is None:
+        return {"success": False, "message": "未安装 Pillow，无法计算感知哈希（pip install pillow）"}
+    if not os.path.isfile(image_path):
+        return {"success": False, "message": f"图片不存在: {image_path}"}
+
+    try:
+        entries = await _refresh_hash_index()
+        name = os.path.basename(image_path)
+        in_index = os.path.dirname(os.path.abspath(image_path)) == os.path.abspath(GENERATED_IMAGES_DIR) and name in entries
+        dhash = entries[name]["dhash"] if in_index else await _hash_image(image_path)
+    except Exception as e:
+        return {"success": False, "message": f"计算感知哈希失败: {e}"}
+
+    matches = _hash_index.find_similar(dhash, max_distance, exclude=name if in_index else None)
+    duplicates = [
+        {"local_path": os.path.join(GENERATED_IMAGES_DIR, m["name"]), "distance": m["distance"]}
+        for m in matches
+    ]
+    return {
+        "success": True,
+        "dhash": dhash,
+        "indexed_count": len(entries),
+        "duplicates": duplicates,
+        "message": f"找到 {len(duplicates)} 张近似重复的海报" if duplicates else "没有近似重复的海报",
+    }
+
+
+def _referenced_poster_paths() -> set:
+    """仍被引用的海报文件（绝对路径）：海报任务记录中的图片，以及发布队列里尚未发出的条目的图片"""
+    paths = set()
+    for job in _job_store.all():
+        paths.update(job.get(field) for field in ("local_path", "optimized_path", "thumbnail_path"))
+
+    if os.path.exists(PUBLISH_QUEUE_DB):  # 不存在时不创建队列文件
+        queue = PublishQueue(PUBLISH_QUEUE_DB)
+        try:
+            for state in (PENDING, UPLOADING, NEEDS_CHECK, FAILED):
+                for item in queue.items(state):
+                    paths.add(item.file_path)
+                    paths.update(item.payload.get("image_paths") or [])
+        finally:
+            queue.close()
+
+    paths.discard(None)
+    return {os.path.abspath(path) for path in paths}
+
+
+@mcp.tool(
+    name='gc_duplicate_posters',
+    description='清理 generated_images 中的近重复海报：每组相似海报只保留最近使用的一张（连同其压缩版与缩略图），仍被海报任务或发布队列引用的不删除。默认 dry_run 仅列出将删除的文件。'
+)
+async def gc_duplicate_posters(max_distance: int = POSTER_DUPLICATE_DISTANCE, dry_run: bool = True) -> Dict[str, Any]:
+    """
+    回收近重复海报
+
+    参数:
+        max_distance: 视为重复的汉明距离阈值（默认 6）
+        dry_run: 为 True 时只返回计划删除的文件，不实际删除
+
+    返回:
+        保留数量、删除（或将删除）的海报、因仍被引用而跳过的海报及释放的空间
+    """
+    if Image is None:
+        return {"success": False, "message": "未安装 Pillow，无法计算感知哈希（pip install pillow）"}
+
+    try:
+        entries = await _refresh_hash_index()
+        referenced = _referenced_poster_paths()
+    except Exception as e:
+        return {"success": False, "message": f"读取哈希索引或海报引用失败: {e}"}
+
+    def last_used(name: str) -> float:
+        try:
+            return os.path.getmtime(os.path.join(GENERATED_IMAGES_DIR, name))  # 命中缓存时会刷新 mtime
+        except OSError:
+            return entries[name].get("mtime", 0.0)
+
+    # 最近使用的优先保留；其余与任一保留海报足够相似的视为重复
+    kept: List[tuple] = []
+    duplicates = []
+    for name in sorted(entries, key=last_used, reverse=True):
+        entry = entries[name]
+        value = int(entry["dhash"], 16)
+        original = next((k for k, v in kept if _hamming_distance(value, v) <= max_distance), None)
+        if original is None:
+            kept.append((name, value))
+        else:
+            duplicates.append({"name": name, "duplicate_of": original})
+
+    removed = []
+    skipped = []
+    freed_bytes = 0
+    for dup in duplicates:
+        paths = _poster_group_paths(os.path.join(GENERATED_IMAGES_DIR, dup["name"]))
+        if any(os.path.abspath(path) in referenced for path in paths):
+            # 待发布或任务记录仍指向这组文件，删除会导致发布失败
+            skipped.append(os.path.join(GENERATED_IMAGES_DIR, dup["name"]))
+            continue
+        size = sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+        if not dry_run:
+            try:
+                for path in paths:
+                    os.remove(path)
+            except OSError as e:
+                print(f"删除重复海报失败 {dup['name']}: {e}", file=sys.stderr)
+                continue
+            entries.pop(dup["name"], None)
+        freed_bytes += size
+        removed.append({
+            "local_path": os.path.join(GENERATED_IMAGES_DIR, dup["name"]),
+            "duplicate_of": os.path.join(GENERATED_IMAGES_DIR, dup["duplicate_of"]),
+            "files": len(paths),
+        })
+
+    if removed and not dry_run:
+        _hash_index.save()
+
+    action = "将删除" if dry_run else "已删除"
+    return {
+        "success": True,
+        "dry_run": dry_run,
+        "kept_count": len(kept),
+        "removed": removed,
+        "skipped_referenced": skipped,
+        "freed_bytes": freed_bytes,
+        "message": f"{action} {len(removed)} 张重复海报，释放 {freed_bytes / 1024 / 1024:.1f} MB"
+        + (f"；{len(skipped)} 张仍被引用，已跳过" if skipped else ""),
+    }
+
+
+def benchmark_prompt_validation(batch_size: int = 20000, rounds: int = 3) -> Dict[str, float]:
+    """微基准：对一大批候选 prompt（合法 + 常见错误变体）做校验，返回平均耗时"""
+    valid = "\n".join([
+        "One Day Schedule of Sanya",
+        "MORNING 8:00-11:00: Yalong Bay beach walk, coral snorkeling, coconut breakfast",
+        "AFTERNOON 12:00-15:00: Seafood lunch at Dadonghai, Nanshan Temple visit",
+        "EVENING 16:00-19:00: Sunset at Tianya Haijiao, night market street food",
+        "Weather: sunny 28C, light breeze; outfit: linen shirt, shorts, sunglasses, wear sunscreen",
+        "Clean travel infographic poster, soft watercolor illustration, well-aligned grid, no garbled text",
+    ])
+    variants = [
+        valid,
+        "## " + valid,
+        valid.replace("Sanya", "三亚"),
+        valid.replace("Yalong", "XX"),
+        valid.replace("8:00", "9:00").replace("Weather", "Sky"),
+        valid + "\n\nextra",
+    ]
+    batch = [variants[i % len(variants)] for i in range(batch_size)]
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for candidate in batch:
+            _validate_travel_poster_prompt(candidate)
+    elapsed = (time.perf_counter() - start) / rounds
+
+    return {
+        "prompts": batch_size,
+        "seconds": elapsed,
+        "microseconds_per_prompt": elapsed / batch_size * 1e6,
+    }
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        result = benchmark_prompt_validation()
+        print(f"候选 prompt 数: {result['prompts']}")
+        print(f"批量校验耗时: {result['seconds'] * 1000:.1f} ms")
+        print(f"平均每条: {result['microseconds_per_prompt']:.2f} µs")
+    elif "--sse" in sys.argv or os.getenv("MCP_TRANSPORT") == "sse":
         print("🚀 启动 Image Generator MCP 服务器 (SSE模式)")
         print("   服务名称: Image Generator")
-        print("   工具数量: 2")
+        print("   工具数量: 7")
         print("   传输协议: Server-Sent Events (SSE)")
         mcp.run(transport="sse")
     else:
@@ -0,0 +1,24 @@
+"""
+JSON 解析工具
+可选的高速 JSON 解析（orjson / msgspec），均未安装时退回标准库 json；各 MCP 共用
+"""
+
+import json
+from typing import Any, Dict
+
+import httpx
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    try:
+        import msgspec
+        json_loads = msgspec.json.decode
+    except ImportError:
+        json_loads = json.loads
+
+
+def amap_json(response: httpx.Response) -> Dict[str, Any]:
+    """解析高德API响应体（直接解析原始字节，避免先解码成str）"""
+    return json_loads(response.content)
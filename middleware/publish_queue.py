@@ -0,0 +1,336 @@
+"""
+持久化发布队列（SQLite）
+每个待发布文件一行记录：状态 pending → uploading → scheduled/published，失败按指数退避重试，
+超过次数标记 failed；以 平台 + 文件内容哈希 作为幂等键，同一文件不会重复入队或重复发布。
+进程崩溃后重启，发布途中中断的条目标记为 needs_check，人工确认后再 mark_done 或 requeue。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+PENDING = "pending"
+UPLOADING = "uploading"
+SCHEDULED = "scheduled"
+PUBLISHED = "published"
+FAILED = "failed"
+NEEDS_CHECK = "needs_check"  # 发布途中进程退出，无法确定是否已经发出
+
+DEFAULT_MAX_ATTEMPTS = int(os.getenv("PUBLISH_MAX_ATTEMPTS", "3"))
+DEFAULT_BACKOFF_SECONDS = float(os.getenv("PUBLISH_BACKOFF_SECONDS", "30"))  # 第 n 次失败后等待 base * 2^(n-1)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@dataclass
+class QueueItem:
+    key: str
+    platform: str
+    file_path: str
+    payload: Dict[str, Any]
+    state: str
+    attempts: int
+    last_error: Optional[str] = None
+
+
+class PublishQueue:
+    """单文件 SQLite 队列；每次状态变化立即提交，崩溃后最多丢失正在进行的那一条的进度"""
+
+    def __init__(
+        self,
+        db_path: str,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        backoff_seconds: float = DEFAULT_BACKOFF_SECONDS,
+    ):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.conn = sqlite3.connect(db_path, timeout=30)  # 多个发布进程共用同一个库
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS publish_items (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL UNIQUE,
+                platform TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                payload TEXT NOT NULL DEFAULT '{}',
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_publish_due ON publish_items (state, next_attempt_at)")
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def enqueue(
+        self,
+        platform: str,
+        file_path: str,
+        payload: Optional[Dict[str, Any]] = None,
+        image_paths: Optional[List[str]] = None,
+        retry_failed: bool = False,
+    ) -> str:
+        """
+        入队（幂等）：同一平台下内容相同的文件只会有一条记录，返回幂等键
+
+        参数:
+            file_path: 记录在队列中的文件路径（原样保存，不做拆分）
+            image_paths: 多图笔记的全部图片，按顺序合并各文件的哈希作为幂等键；不传时只对 file_path 求哈希
+            retry_failed: 已有记录处于 failed 状态时重新排队（重置尝试次数并更新 payload）
+        """
+        if image_paths and len(image_paths) > 1:
+            digest = hashlib.sha256("".join(file_sha256(p) for p in image_paths).encode()).hexdigest()
+        else:
+            digest = file_sha256(image_paths[0] if image_paths else file_path)
+        key = f"{platform}:{digest}"
+        now = time.time()
+        payload_json = json.dumps(payload or {}, ensure_ascii=False)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO publish_items (key, platform, file_path, payload, state, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, platform, file_path, payload_json, PENDING, now, now),
+            )
+            if retry_failed:
+                self.conn.execute(
+                    "UPDATE publish_items SET state = ?, attempts = 0, next_attempt_at = 0, file_path = ?, payload = ?, "
+                    "updated_at = ? WHERE key = ? AND state = ?",
+                    (PENDING, file_path, payload_json, now, key, FAILED),
+                )
+        return key
+
+    def recover(self, platform: Optional[str] = None) -> int:
+        """
+        启动时调用：上次进程在发布途中退出，uploading 状态的条目标记为 needs_check
+        中断时可能已经点了发布，自动重发会产生重复笔记；在创作者中心确认后，
+        已发出的调用 mark_done，未发出的调用 requeue 重新排队
+        """
+        query = "UPDATE publish_items SET state = ?, last_error = ?, updated_at = ? WHERE state = ?"
+        params = [NEEDS_CHECK, "上次运行在发布途中中断，请确认是否已发出", time.time(), UPLOADING]
+        if platform:
+            query += " AND platform = ?"
+            params.append(platform)
+        with self.conn:
+            cur = self.conn.execute(query, params)
+        if cur.rowcount:
+            print(f"{cur.rowcount} 条发布任务上次在发布途中中断，已标记为 {NEEDS_CHECK}，请确认后处理", file=sys.stderr)
+        return cur.rowcount
+
+    def requeue(self, key: str) -> bool:
+        """把 failed 或 needs_check 的条目重新排队（重置尝试次数）；返回是否有条目被重置"""
+        with self.conn:
+            cur = self.conn.execute(
+                "UPDATE publish_items SET state = ?, attempts = 0, next_attempt_at = 0, updated_at = ? "
+                "WHERE key = ? AND state IN (?, ?)",
+                (PENDING, time.time(), key, FAILED, NEEDS_CHECK),
+            )
+        return cur.rowcount > 0
+
+    def claim_next(self, platform: Optional[str] = None) -> Optional[QueueItem]:
+        """
+        取出最早入队、已到重试时间的 pending 条目，并原子地标记为 uploading
+        多个进程同时认领时，以 UPDATE 是否命中为准：没抢到的进程换下一条，同一条目不会被发布两次
+        """
+        query = "SELECT * FROM publish_items WHERE state = ? AND next_attempt_at <= ?"
+        params = [PENDING, time.time()]
+        if platform:
+            query += " AND platform = ?"
+            params.append(platform)
+        query += " ORDER BY seq LIMIT 1"
+        while True:
+            params[1] = time.time()
+            with self.conn:
+                row = self.conn.execute(query, params).fetchone()
+                if row is None:
+                    return None
+                cur = self.conn.execute(
+                    "UPDATE publish_items SET state = ?, attempts = attempts + 1, updated_at = ? WHERE key = ? AND state = ?",
+                    (UPLOADING, time.time(), row["key"], PENDING),
+                )
+            if cur.rowcount == 1:
+                break
+        return QueueItem(
+            key=row["key"],
+            platform=row["platform"],
+            file_path=row["file_path"],
+            payload=json.loads(row["payload"]),
+            state=UPLOADING,
+            attempts=row["attempts"] + 1,
+            last_error=row["last_error"],
+        )
+
+    def mark_done(self, key: str, scheduled: bool = False) -> None:
+        """发布成功：定时发布记为 scheduled，立即发布记为 published"""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE publish_items SET state = ?, last_error = NULL, updated_at = ? WHERE key = ?",
+                (SCHEDULED if scheduled else PUBLISHED, time.time(), key),
+            )
+
+    def mark_failed(self, key: str, error: str) -> str:
+        """记录失败：未超过次数则按指数退避重新排队，否则标记 failed；返回新状态"""
+        row = self.conn.execute("SELECT attempts FROM publish_items WHERE key = ?", (key,)).fetchone()
+        attempts = row["attempts"] if row else self.max_attempts
+        if attempts >= self.max_attempts:
+            state, next_attempt_at = FAILED, 0.0
+        else:
+            state, next_attempt_at = PENDING, time.time() + self.backoff_seconds * 2 ** (attempts - 1)
+        with self.conn:
+            self.conn.execute(
+                "UPDATE publish_items SET state = ?, next_attempt_at = ?, last_error = ?, updated_at = ? WHERE key = ?",
+                (state, next_attempt_at, error, time.time(), key),
+            )
+        return state
+
+    def next_retry_at(self, platform: Optional[str] = None) -> Optional[float]:
+        query = "SELECT MIN(next_attempt_at) FROM publish_items WHERE state = ?"
+        params = [PENDING]
+        if platform:
+            query += " AND platform = ?"
+            params.append(platform)
+        return self.conn.execute(query, params).fetchone()[0]
+
+    def items(self, state: str, platform: Optional[str] = None) -> List[QueueItem]:
+        """某状态的全部条目（按入队顺序），例如列出待人工确认的 needs_check 条目"""
+        query = "SELECT * FROM publish_items WHERE state = ?"
+        params = [state]
+        if platform:
+            query += " AND platform = ?"
+            params.append(platform)
+        rows = self.conn.execute(query + " ORDER BY seq", params).fetchall()
+        return [
+            QueueItem(
+                key=row["key"],
+                platform=row["platform"],
+                file_path=row["file_path"],
+                payload=json.loads(row["payload"]),
+                state=row["state"],
+                attempts=row["attempts"],
+                last_error=row["last_error"],
+            )
+            for row in rows
+        ]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT state, attempts, last_error FROM publish_items WHERE key = ?", (key,)).fetchone()
+        return dict(row) if row else None
+
+    def done_times_since(self, platform: str, since: float) -> list:
+        """某平台（账号）在 since 之后成功发布的时间点，用于按小时限速（跨进程、跨重启有效）"""
+        rows = self.conn.execute(
+            "SELECT updated_at FROM publish_items WHERE platform = ? AND state IN (?, ?) AND updated_at > ? ORDER BY updated_at",
+            (platform, SCHEDULED, PUBLISHED, since),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def scheduled_times(self, platform: str) -> List[float]:
+        """该平台已占用的定时发布时间：待发布、发布中、待确认、已定时条目 payload 中的 publish_at"""
+        rows = self.conn.execute(
+            "SELECT payload FROM publish_items WHERE platform = ? AND state IN (?, ?, ?, ?)",
+            (platform, PENDING, UPLOADING, NEEDS_CHECK, SCHEDULED),
+        ).fetchall()
+        times = []
+        for row in rows:
+            publish_at = json.loads(row["payload"]).get("publish_at")
+            if publish_at:
+                times.append(publish_at)
+        return times
+
+    def unscheduled(self, platform: str, not_before: float) -> List[str]:
+        """待发布且还没有排期（或排期早于 not_before、已来不及）的条目，按入队顺序返回幂等键"""
+        rows = self.conn.execute(
+            "SELECT key, payload FROM publish_items WHERE platform = ? AND state = ? ORDER BY seq",
+            (platform, PENDING),
+        ).fetchall()
+        return [row["key"] for row in rows if (json.loads(row["payload"]).get("publish_at") or 0) < not_before]
+
+    def set_publish_times(self, publish_times: Dict[str, float]) -> None:
+        """在一个事务里把排期写入各条目的 payload["publish_at"]"""
+        with self.conn:
+            for key, publish_at in publish_times.items():
+                row = self.conn.execute("SELECT payload FROM publish_items WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    continue
+                payload = json.loads(row["payload"])
+                payload["publish_at"] = publish_at
+                self.conn.execute(
+                    "UPDATE publish_items SET payload = ?, updated_at = ? WHERE key = ?",
+                    (json.dumps(payload, ensure_ascii=False), time.time(), key),
+                )
+
+    def stats(self, platform: Optional[str] = None) -> Dict[str, int]:
+        query = "SELECT state, COUNT(*) AS n FROM publish_items"
+        params = []
+        if platform:
+            query += " WHERE platform = ?"
+            params.append(platform)
+        query += " GROUP BY state"
+        return {row["state"]: row["n"] for row in self.conn.execute(query, params)}
+
+    def drain(
+        self,
+        platform: str,
+        handler: Callable[[QueueItem], bool],
+        pace_seconds: float = 0.0,
+        max_per_hour: int = 0,
+    ) -> Dict[str, int]:
+        """
+        依次处理该平台所有待发布条目，直到队列中没有 pending（含等待重试的）条目
+
+        参数:
+            handler: 发布一条；返回 True 表示定时发布（scheduled），False 表示立即发布；抛异常视为失败
+            pace_seconds: 两次发布之间的间隔，避免触发平台频率限制
+            max_per_hour: 每小时最多成功发布的条数（0 表示不限），超出时等待最早一条滑出窗口
+        """
+        while True:
+            if max_per_hour:
+                recent = self.done_times_since(platform, time.time() - 3600)
+                if len(recent) >= max_per_hour:
+                    wait = recent[-max_per_hour] + 3600 - time.time()
+                    print(f"{platform} 已达每小时 {max_per_hour} 条上限，等待 {wait:.0f} 秒", file=sys.stderr)
+                    time.sleep(max(0.0, wait))
+                    continue
+
+            item = self.claim_next(platform)
+            if item is None:
+                retry_at = self.next_retry_at(platform)
+                if retry_at is None:
+                    break
+                time.sleep(max(0.0, retry_at - time.time()))
+                continue
+
+            print(f"发布 {item.file_path}（第 {item.attempts} 次尝试）", file=sys.stderr)
+            try:
+                scheduled = handler(item)
+                self.mark_done(item.key, scheduled=bool(scheduled))
+            except Exception as e:
+                traceback.print_exc()
+                state = self.mark_failed(item.key, str(e))
+                print(f"发布失败，{'放弃' if state == FAILED else '稍后重试'}: {e}", file=sys.stderr)
+            if pace_seconds:
+                time.sleep(pace_seconds)
+        return self.stats(platform)
@@ -0,0 +1,172 @@
+"""
+定时发布排期
+每个账号（平台）有一组每日允许发布的时间窗口，例如 "08:00-09:00,12:00-13:00,18:00-20:00"；
+已占用的发布时间来自发布队列。调度器按时间顺序一次扫描，用有序数组 + 二分查找判断冲突，
+把 N 篇笔记放进最早的、与已有发布至少间隔 min_gap 的时刻，复杂度 O((N + M) log M)。
+"""
+
+import datetime
+import json
+import os
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_WINDOWS = os.getenv("PUBLISH_WINDOWS", "08:00-09:00,12:00-13:00,18:00-20:00")
+DEFAULT_MIN_GAP_MINUTES = float(os.getenv("PUBLISH_MIN_GAP_MINUTES", "60"))  # 同一账号两次发布的最小间隔
+DEFAULT_LEAD_MINUTES = float(os.getenv("PUBLISH_LEAD_MINUTES", "60"))        # 定时时间至少在当前时间之后多久
+PUBLISH_CALENDAR_PATH = os.getenv(
+    "PUBLISH_CALENDAR_PATH",
+    os.path.join(os.getenv("ROOT_PATH", os.path.join(os.getcwd(), "data_storage")), "publish_calendar.json"),
+)
+
+Window = Tuple[int, int]  # 当天的 [开始分钟, 结束分钟]，结束时刻本身也可以发布
+
+
+def _parse_clock(text: str) -> int:
+    hour, minute = text.strip().split(":")
+    value = int(hour) * 60 + int(minute)
+    if not 0 <= value < 24 * 60:
+        raise ValueError(f"无效的时间: {text}")
+    return value
+
+
+def parse_windows(spec) -> List[Window]:
+    """"08:00-09:00,18:00-20:00" 或 ["08:00-09:00", ...] → 按开始时间排序并合并重叠的窗口"""
+    parts = spec.split(",") if isinstance(spec, str) else spec
+    windows = []
+    for part in parts:
+        if not part.strip():
+            continue
+        start, end = (_parse_clock(t) for t in part.split("-"))
+        if end < start:
+            raise ValueError(f"发布窗口不能跨天: {part}")
+        windows.append((start, end))
+    if not windows:
+        raise ValueError("至少需要一个发布窗口")
+    windows.sort()
+    merged = [windows[0]]
+    for start, end in windows[1:]:
+        if start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def load_calendar(path: str = PUBLISH_CALENDAR_PATH) -> Dict[str, List[Window]]:
+    """
+    读取各账号的发布窗口：{"账号或平台名": "08:00-09:00,...", "*": 其余账号的默认窗口}
+    文件不存在时所有账号使用 PUBLISH_WINDOWS
+    """
+    calendar = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for key, spec in json.load(f).items():
+                calendar[key] = parse_windows(spec)
+    return calendar
+
+
+def windows_for(key: str, calendar: Optional[Dict[str, List[Window]]] = None) -> List[Window]:
+    """key 为账号名或平台名；平台名形如 "xiaohongshu:账号" 时也按其中的账号名查找"""
+    calendar = load_calendar() if calendar is None else calendar
+    for candidate in (key, key.rsplit(":", 1)[-1], "*"):
+        if calendar.get(candidate):
+            return calendar[candidate]
+    return parse_windows(DEFAULT_WINDOWS)
+
+
+class SlotScheduler:
+    """在每日发布窗口内为一批笔记分配互不冲突的发布时间"""
+
+    def __init__(
+        self,
+        windows=DEFAULT_WINDOWS,
+        min_gap_minutes: float = DEFAULT_MIN_GAP_MINUTES,
+        lead_minutes: float = DEFAULT_LEAD_MINUTES,
+    ):
+        self.windows = parse_windows(windows) if isinstance(windows, str) else sorted(windows)
+        if not self.windows:
+            raise ValueError("至少需要一个发布窗口")
+        self.gap = datetime.timedelta(minutes=max(0.0, min_gap_minutes))
+        self.lead = datetime.timedelta(minutes=max(0.0, lead_minutes))
+
+    def assign(
+        self,
+        n: int,
+        busy: Iterable[datetime.datetime] = (),
+        start: Optional[datetime.datetime] = None,
+    ) -> List[datetime.datetime]:
+        """
+        按时间顺序返回 n 个发布时间：落在发布窗口内、不早于 start + lead，
+        与 busy 中的已有发布及彼此之间都至少间隔 min_gap；贪心取最早可用时刻，同样时长内放下的篇数最多
+        """
+        busy = sorted(busy)
+        now = datetime.datetime.now()
+        cursor = _ceil_minute(max(start or now, now) + self.lead)  # 发布时间精确到分钟
+
+        slots = []
+        day = cursor.date()
+        while len(slots) < n:
+            midnight = datetime.datetime.combine(day, datetime.time())
+            for window_start, window_end in self.windows:
+                t = max(cursor, midnight + datetime.timedelta(minutes=window_start))
+                end = midnight + datetime.timedelta(minutes=window_end)
+                while t <= end and len(slots) < n:
+                    # busy 中第一个晚于 t - gap 的发布；若它早于 t + gap 则冲突，直接跳到它之后 gap 处
+                    i = bisect_right(busy, t - self.gap)
+                    if i < len(busy) and busy[i] < t + self.gap:
+                        t = _ceil_minute(busy[i] + self.gap)
+                        continue
+                    slots.append(t)
+                    t = t + self.gap if self.gap else t + datetime.timedelta(minutes=1)
+                cursor = max(cursor, t)
+                if len(slots) >= n:
+                    break
+            day += datetime.timedelta(days=1)
+        return slots
+
+
+def _ceil_minute(t: datetime.datetime) -> datetime.datetime:
+    if t.second or t.microsecond:
+        return t.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+    return t
+
+
+def queue_busy_times(queue, platform: str) -> List[datetime.datetime]:
+    """发布队列中该平台（账号）已占用的发布时间"""
+    return [datetime.datetime.fromtimestamp(ts) for ts in queue.scheduled_times(platform)]
+
+
+def schedule_queue(queue, platform: str, scheduler: Optional[SlotScheduler] = None) -> int:
+    """
+    为队列中该平台尚未排期（或排期时间已过）的待发布条目一次性分配发布时间，
+    写入 payload["publish_at"]（时间戳）；返回本次分配的条数
+    """
+    scheduler = scheduler or SlotScheduler(windows_for(platform))
+    not_before = datetime.datetime.now() + scheduler.lead
+    keys = queue.unscheduled(platform, not_before.timestamp())
+    if not keys:
+        return 0
+    slots = scheduler.assign(len(keys), busy=queue_busy_times(queue, platform))
+    queue.set_publish_times({key: slot.timestamp() for key, slot in zip(keys, slots)})
+    return len(keys)
+
+
+def ensure_publish_at(queue, item, platform: Optional[str] = None, scheduler: Optional[SlotScheduler] = None) -> float:
+    """
+    发布前确认队列条目的排期仍然有效（不早于当前时间 + lead），返回发布时间戳
+    排期已过（例如前面的条目重试、限速耽误了时间）时，按该平台的发布窗口、避开队列已占用的时间
+    为它重新取最早的空闲时刻，再一次性为其余过期的待发布条目重新排期，之后的条目不必再逐条补排
+    """
+    platform = platform or item.platform
+    scheduler = scheduler or SlotScheduler(windows_for(platform))
+    not_before = (datetime.datetime.now() + scheduler.lead).timestamp()
+    publish_at = item.payload.get("publish_at")
+    if publish_at and publish_at >= not_before:
+        return publish_at
+
+    publish_at = scheduler.assign(1, busy=queue_busy_times(queue, platform))[0].timestamp()
+    queue.set_publish_times({item.key: publish_at})
+    item.payload["publish_at"] = publish_at
+    schedule_queue(queue, platform, scheduler)
+    return publish_at
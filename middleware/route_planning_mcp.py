@@ -5,10 +5,15 @@
 """
 
 import asyncio
-import json
 import os
+import pickle
 import sys
-from typing import Dict, Any, List, Optional
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
 import httpx
 from mcp import types
 from mcp.types import Tool, TextContent
@@ -25,6 +30,30 @@ if not AMAP_API_KEY:
     print("请设置环境变量 AMAP_API_KEY", file=sys.stderr)
     sys.exit(1)
 
+# Ensure repo root is on sys.path (supports `python middleware/route_planning_mcp.py`)
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _REPO_ROOT not in sys.path:
+    sys.path.insert(0, _REPO_ROOT)
+
+from middleware.json_utils import amap_json
+
+# 调试输出（请求参数、逐条路径/分段的解析过程），默认关闭，设置 ROUTE_DEBUG=1 开启
+ROUTE_DEBUG = os.environ.get("ROUTE_DEBUG", "0") == "1"
+
+def _debug(message: str) -> None:
+    if ROUTE_DEBUG:
+        print(f"调试: {message}", file=sys.stderr)
+
+# 缓存配置
+ROUTE_CACHE_PRECISION = int(os.environ.get("ROUTE_CACHE_PRECISION", "4"))  # 坐标量化的小数位数，4位约11米
+ROUTE_CACHE_MAX_ENTRIES = int(os.environ.get("ROUTE_CACHE_MAX_ENTRIES", "2048"))
+LOCATION_CACHE_TTL = 7 * 24 * 3600  # 地名 -> 坐标/位置信息，基本不变
+
+# 路线几何: 只在需要时携带 show_fields 请求 polyline（解析不使用 cost/tmcs 等扩展字段，不需要几何时不传）；
+# polyline 以 Google polyline 算法编码（精度1e-6，即 polyline6）
+SHOW_FIELDS_GEOMETRY = "cost,polyline"
+POLYLINE_PRECISION = 6
+
 # 路径规划类型枚举
 class RouteType(str, Enum):
     DRIVING = "driving"
@@ -86,152 +115,371 @@ class LocationInfo(BaseModel):
     adcode: Optional[str] = None
     formatted_address: Optional[str] = None
 
-class RouteStep(BaseModel):
-    """路径步骤"""
+@dataclass(slots=True)
+class RouteStepData:
+    """路径步骤（内部轻量表示，解析和缓存时使用，避免逐步骤的pydantic校验）"""
     instruction: str
-    road_name: Optional[str] = None
     distance: float  # 米
     duration: float  # 秒
-    polyline: Optional[str] = None
-    action: Optional[str] = None
-    assistant_action: Optional[str] = None
+    road_name: Optional[str] = None
 
-class RoutePlan(BaseModel):
-    """路径规划结果"""
+@dataclass(slots=True)
+class RoutePlanData:
+    """路径规划结果（内部轻量表示），MCP 工具直接由它生成文本输出"""
     route_type: str
     origin: LocationInfo
     destination: LocationInfo
-    waypoints: List[LocationInfo] = []
     total_distance: float  # 米
     total_duration: float  # 秒
-    total_taxi_fare: Optional[float] = None  # 出租车费用，元
-    total_tolls: Optional[float] = None  # 过路费，元
-    traffic_lights: Optional[int] = None  # 红绿灯数量
-    steps: List[RouteStep] = []
+    waypoints: List[LocationInfo] = field(default_factory=list)
+    total_taxi_fare: Optional[float] = None
+    total_tolls: Optional[float] = None
+    traffic_lights: Optional[int] = None
+    steps: List[RouteStepData] = field(default_factory=list)
     polyline: Optional[str] = None
-    restrictions: Optional[bool] = None  # 是否有限行路段
-    alternative_plans: List["RoutePlan"] = []  # 备选方案
-    
+    restrictions: Optional[bool] = None
+    alternative_plans: List["RoutePlanData"] = field(default_factory=list)
+
     def to_text_summary(self) -> str:
         """转换为文本摘要"""
-        # 计算总时间（小时、分钟、秒）
-        total_seconds = int(self.total_duration)
-        hours = total_seconds // 3600
-        minutes = (total_seconds % 3600) // 60
-        seconds = total_seconds % 60
-        
-        distance_km = self.total_distance / 1000
-        
-        summary = [
-            f"🚗 路径规划结果 ({self.route_type})",
-            f"起点: {self.origin.formatted_address or self.origin.name or self.origin.address}",
-            f"终点: {self.destination.formatted_address or self.destination.name or self.destination.address}",
-            f"总距离: {distance_km:.1f}公里"
-        ]
-        
-        # 时间显示逻辑
-        if hours > 0:
-            if minutes > 0:
-                summary.append(f"预计时间: {hours}小时{minutes}分钟")
-            else:
-                summary.append(f"预计时间: {hours}小时")
-        elif minutes > 0:
-            summary.append(f"预计时间: {minutes}分钟")
-        elif seconds > 0:
-            summary.append(f"预计时间: {seconds}秒")
+        return format_route_summary(self)
+
+def format_route_summary(plan: RoutePlanData) -> str:
+    """生成路线文本摘要"""
+    # 计算总时间（小时、分钟、秒）
+    total_seconds = int(plan.total_duration)
+    hours = total_seconds // 3600
+    minutes = (total_seconds % 3600) // 60
+    seconds = total_seconds % 60
+    
+    distance_km = plan.total_distance / 1000
+    
+    summary = [
+        f"🚗 路径规划结果 ({plan.route_type})",
+        f"起点: {plan.origin.formatted_address or plan.origin.name or plan.origin.address}",
+        f"终点: {plan.destination.formatted_address or plan.destination.name or plan.destination.address}",
+        f"总距离: {distance_km:.1f}公里"
+    ]
+    
+    # 时间显示逻辑
+    if hours > 0:
+        if minutes > 0:
+            summary.append(f"预计时间: {hours}小时{minutes}分钟")
         else:
-            # 如果时间为0，根据距离估算
-            if distance_km > 0:
-                if self.route_type == "公交":
-                    # 公交平均速度15km/h
-                    estimated_hours = distance_km / 15
-                    if estimated_hours >= 1:
-                        hours = int(estimated_hours)
-                        minutes = int((estimated_hours - hours) * 60)
-                        summary.append(f"预计时间: 约{hours}小时{minutes}分钟")
-                    else:
-                        minutes = int(estimated_hours * 60)
-                        summary.append(f"预计时间: 约{minutes}分钟")
-                elif self.route_type == "驾车":
-                    # 驾车平均速度30km/h
-                    estimated_hours = distance_km / 30
-                    if estimated_hours >= 1:
-                        hours = int(estimated_hours)
-                        minutes = int((estimated_hours - hours) * 60)
-                        summary.append(f"预计时间: 约{hours}小时{minutes}分钟")
-                    else:
-                        minutes = int(estimated_hours * 60)
-                        summary.append(f"预计时间: 约{minutes}分钟")
-                elif self.route_type == "骑行":
-                    # 骑行平均速度15km/h
-                    estimated_hours = distance_km / 15
-                    if estimated_hours >= 1:
-                        hours = int(estimated_hours)
-                        minutes = int((estimated_hours - hours) * 60)
-                        summary.append(f"预计时间: 约{hours}小时{minutes}分钟")
-                    else:
-                        minutes = int(estimated_hours * 60)
-                        summary.append(f"预计时间: 约{minutes}分钟")
-                elif self.route_type == "步行":
-                    # 步行平均速度5km/h
-                    estimated_hours = distance_km / 5
-                    if estimated_hours >= 1:
-                        hours = int(estimated_hours)
-                        minutes = int((estimated_hours - hours) * 60)
-                        summary.append(f"预计时间: 约{hours}小时{minutes}分钟")
-                    else:
-                        minutes = int(estimated_hours * 60)
-                        summary.append(f"预计时间: 约{minutes}分钟")
-            else:
-                summary.append("预计时间: 未知")
-        
-        if self.total_taxi_fare:
-            if self.route_type == "公交":
-                summary.append(f"公交费用: {self.total_taxi_fare:.2f}元")
-            else:
-                summary.append(f"出租车费用: {self.total_taxi_fare:.2f}元")
-        
-        if self.total_tolls:
-            summary.append(f"过路费: {self.total_tolls:.2f}元")
-        
-        if self.traffic_lights:
-            summary.append(f"红绿灯数量: {self.traffic_lights}个")
-        
-        if self.restrictions is not None:
-            summary.append(f"限行路段: {'是' if self.restrictions else '否'}")
-        
-        if self.steps:
-            summary.append("\n详细路线:")
-            for i, step in enumerate(self.steps):
-                # 构建步骤描述
-                step_desc = step.instruction
-                
-                # 如果有道路名称，添加到描述中
-                if step.road_name and step.road_name.strip():
-                    step_desc = f"沿{step.road_name}{step.instruction}"
-                
-                # 显示步骤距离和时间
-                if step.distance > 0:
-                    step_desc += f" ({step.distance:.0f}米"
-                    if step.duration > 0:
-                        # 转换秒为分钟
-                        step_minutes = step.duration / 60
-                        step_desc += f"，约{step_minutes:.0f}分钟"
-                    step_desc += ")"
-                
-                summary.append(f"{i+1}. {step_desc}")
-        
-        if self.alternative_plans:
-            summary.append(f"\n🔄 共有{len(self.alternative_plans)}个备选方案")
-        
-        return "\n".join(summary)
+            summary.append(f"预计时间: {hours}小时")
+    elif minutes > 0:
+        summary.append(f"预计时间: {minutes}分钟")
+    elif seconds > 0:
+        summary.append(f"预计时间: {seconds}秒")
+    else:
+        # 如果时间为0，根据距离估算
+        if distance_km > 0:
+            if plan.route_type == "公交":
+                # 公交平均速度15km/h
+                estimated_hours = distance_km / 15
+                if estimated_hours >= 1:
+                    hours = int(estimated_hours)
+                    minutes = int((estimated_hours - hours) * 60)
+                    summary.append(f"预计时间: 约{hours}小时{minutes}分钟")
+                else:
+                    minutes = int(estimated_hours * 60)
+                    summary.append(f"预计时间: 约{minutes}分钟")
+            elif plan.route_type == "驾车":
+                # 驾车平均速度30km/h
+                estimated_hours = distance_km / 30
+                if estimated_hours >= 1:
+                    hours = int(estimated_hours)
+                    minutes = int((estimated_hours - hours) * 60)
+                    summary.append(f"预计时间: 约{hours}小时{minutes}分钟")
+                else:
+                    minutes = int(estimated_hours * 60)
+                    summary.append(f"预计时间: 约{minutes}分钟")
+            elif plan.route_type == "骑行":
+                # 骑行平均速度15km/h
+                estimated_hours = distance_km / 15
+                if estimated_hours >= 1:
+                    hours = int(estimated_hours)
+                    minutes = int((estimated_hours - hours) * 60)
+                    summary.append(f"预计时间: 约{hours}小时{minutes}分钟")
+                else:
+                    minutes = int(estimated_hours * 60)
+                    summary.append(f"预计时间: 约{minutes}分钟")
+            elif plan.route_type == "步行":
+                # 步行平均速度5km/h
+                estimated_hours = distance_km / 5
+                if estimated_hours >= 1:
+                    hours = int(estimated_hours)
+                    minutes = int((estimated_hours - hours) * 60)
+                    summary.append(f"预计时间: 约{hours}小时{minutes}分钟")
+                else:
+                    minutes = int(estimated_hours * 60)
+                    summary.append(f"预计时间: 约{minutes}分钟")
+        else:
+            summary.append("预计时间: 未知")
+    
+    if plan.total_taxi_fare:
+        if plan.route_type == "公交":
+            summary.append(f"公交费用: {plan.total_taxi_fare:.2f}元")
+        else:
+            summary.append(f"出租车费用: {plan.total_taxi_fare:.2f}元")
+    
+    if plan.total_tolls:
+        summary.append(f"过路费: {plan.total_tolls:.2f}元")
+    
+    if plan.traffic_lights:
+        summary.append(f"红绿灯数量: {plan.traffic_lights}个")
+    
+    if plan.restrictions is not None:
+        summary.append(f"限行路段: {'是' if plan.restrictions else '否'}")
+    
+    if plan.steps:
+        summary.append("\n详细路线:")
+        for i, step in enumerate(plan.steps):
+            # 构建步骤描述
+            step_desc = step.instruction
+            
+            # 如果有道路名称，添加到描述中
+            if step.road_name and step.road_name.strip():
+                step_desc = f"沿{step.road_name}{step.instruction}"
+            
+            # 显示步骤距离和时间
+            if step.distance > 0:
+                step_desc += f" ({step.distance:.0f}米"
+                if step.duration > 0:
+                    # 转换秒为分钟
+                    step_minutes = step.duration / 60
+                    step_desc += f"，约{step_minutes:.0f}分钟"
+                step_desc += ")"
+            
+            summary.append(f"{i+1}. {step_desc}")
+    
+    if plan.alternative_plans:
+        summary.append(f"\n🔄 共有{len(plan.alternative_plans)}个备选方案")
+    
+    if plan.polyline:
+        summary.append(f"\n路线几何(polyline6, 纬度在前): {plan.polyline}")
+    
+    return "\n".join(summary)
+
+class TTLCache:
+    """带过期时间的LRU缓存（进程内共享）"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Any, value: Any, ttl: float) -> None:
+        if ttl <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+# 驾车路况分时段: (开始小时, 结束小时, TTL秒)。高峰期路况变化快，缓存时间短
+DRIVING_TTL_PERIODS = [
+    (0, 6, 2 * 3600),    # 夜间
+    (6, 7, 30 * 60),
+    (7, 10, 5 * 60),     # 早高峰
+    (10, 17, 30 * 60),
+    (17, 20, 5 * 60),    # 晚高峰
+    (20, 22, 30 * 60),
+    (22, 24, 2 * 3600),  # 夜间
+]
+ROUTE_TTL_BY_TYPE = {
+    RouteType.WALKING.value: 7 * 24 * 3600,    # 步行/骑行路线几乎不受路况影响
+    RouteType.BICYCLING.value: 7 * 24 * 3600,
+    RouteType.TRANSIT.value: 3600,             # 公交受班次影响
+}
+
+def quantize_coords(coords: str, precision: int = ROUTE_CACHE_PRECISION) -> str:
+    """将"经度,纬度"量化到固定小数位，使相邻的坐标落在同一个缓存键上"""
+    lon, lat = coords.split(",")
+    return f"{float(lon):.{precision}f},{float(lat):.{precision}f}"
+
+def parse_amap_polyline(polyline: Optional[str]) -> List[Tuple[float, float]]:
+    """解析高德 "经度,纬度;经度,纬度" 格式的坐标串"""
+    points = []
+    for pair in (polyline or "").split(";"):
+        if "," not in pair:
+            continue
+        lon, lat = pair.split(",", 1)
+        try:
+            points.append((float(lon), float(lat)))
+        except ValueError:
+            continue
+    return points
+
+def encode_polyline(points: List[Tuple[float, float]], precision: int = POLYLINE_PRECISION) -> str:
+    """按 Google polyline 算法对 (经度, 纬度) 序列做差分编码，输出顺序为纬度在前"""
+    factor = 10 ** precision
+    result = []
+    prev_lat = prev_lon = 0
+    for lon, lat in points:
+        lat_i = int(round(lat * factor))
+        lon_i = int(round(lon * factor))
+        for delta in (lat_i - prev_lat, lon_i - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                result.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            result.append(chr(value + 63))
+        prev_lat, prev_lon = lat_i, lon_i
+    return "".join(result)
+
+def decode_polyline(encoded: str, precision: int = POLYLINE_PRECISION) -> List[Tuple[float, float]]:
+    """encode_polyline 的逆过程，返回 (经度, 纬度) 序列"""
+    factor = 10 ** precision
+    points = []
+    index = lat = lon = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = value = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                value |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(value >> 1) if value & 1 else value >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lon / factor, lat / factor))
+    return points
+
+def merge_step_polylines(step_points: List[List[Tuple[float, float]]]) -> List[Tuple[float, float]]:
+    """拼接各步骤的坐标，去掉相邻步骤首尾重复的点"""
+    merged: List[Tuple[float, float]] = []
+    for points in step_points:
+        if merged and points and merged[-1] == points[0]:
+            merged.extend(points[1:])
+        else:
+            merged.extend(points)
+    return merged
+
+def route_cache_ttl(route_type: str, now: Optional[datetime] = None) -> float:
+    """计算路线缓存的有效期（秒）；驾车按时段取值，且不跨越下一个时段"""
+    if route_type != RouteType.DRIVING.value:
+        return ROUTE_TTL_BY_TYPE.get(route_type, 0)
+
+    now = now or datetime.now()
+    for start, end, ttl in DRIVING_TTL_PERIODS:
+        if start <= now.hour < end:
+            period_end = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(hours=end)
+            return min(ttl, (period_end - now).total_seconds())
+    return 0
+
+def pack_route_plans(plans: List[RoutePlanData]) -> bytes:
+    """压缩存储路线结果（pickle + zlib，仅用于进程内缓存）"""
+    return zlib.compress(pickle.dumps(plans, protocol=pickle.HIGHEST_PROTOCOL))
+
+def unpack_route_plans(blob: bytes) -> List[RoutePlanData]:
+    return pickle.loads(zlib.decompress(blob))
+
+def _strip_endpoints(plan: RoutePlanData) -> RoutePlanData:
+    """去掉与本次请求相关的起终点/途经点（地名与精确坐标），量化坐标相同的其他请求也能复用缓存"""
+    return replace(
+        plan,
+        origin=None,
+        destination=None,
+        waypoints=[],
+        alternative_plans=[_strip_endpoints(alt) for alt in plan.alternative_plans]
+    )
+
+def _fill_endpoints(
+    plan: RoutePlanData,
+    origin_info: LocationInfo,
+    dest_info: LocationInfo,
+    waypoint_infos: List[LocationInfo]
+) -> None:
+    plan.origin = origin_info
+    plan.destination = dest_info
+    plan.waypoints = list(waypoint_infos)
+    for alt in plan.alternative_plans:
+        _fill_endpoints(alt, origin_info, dest_info, waypoint_infos)
+
+# 全局缓存：RoutePlanningMCP 每次工具调用都会重新创建，缓存需要跨实例共享
+_ROUTE_CACHE = TTLCache(max_entries=ROUTE_CACHE_MAX_ENTRIES)
+_LOCATION_CACHE = TTLCache(max_entries=ROUTE_CACHE_MAX_ENTRIES)
 
 class RoutePlanningMCP:
     """路径规划MCP服务"""
-    
+
     def __init__(self):
         self.client = httpx.AsyncClient(timeout=30.0)
-        
+        self.route_cache = _ROUTE_CACHE
+        self.location_cache = _LOCATION_CACHE
+
+    def _route_cache_key(
+        self,
+        route_type: RouteType,
+        origin_coords: str,
+        dest_coords: str,
+        waypoint_coords: Optional[List[str]] = None,
+        strategy: Optional[str] = None,
+        include_geometry: bool = False
+    ) -> tuple:
+        """路线缓存键: (出行方式, 策略, 量化后的起终点, 途经点, 是否带几何)"""
+        return (
+            route_type.value,
+            strategy or "",
+            quantize_coords(origin_coords),
+            quantize_coords(dest_coords),
+            tuple(quantize_coords(c) for c in waypoint_coords or []),
+            include_geometry,
+        )
+
+    def _encode_route_geometry(self, step_list: List[dict]) -> Optional[str]:
+        """把各步骤的高德坐标串合并为整条路线的 polyline6 编码"""
+        points = merge_step_polylines([parse_amap_polyline(step.get("polyline")) for step in step_list])
+        return encode_polyline(points) if points else None
+
+    def _get_cached_routes(
+        self,
+        key: tuple,
+        origin_info: LocationInfo,
+        dest_info: LocationInfo,
+        waypoint_infos: Optional[List[LocationInfo]] = None
+    ) -> Optional[List[RoutePlanData]]:
+        """缓存命中时用本次请求的起终点/途经点信息填回（缓存中不保存这些字段）"""
+        blob = self.route_cache.get(key)
+        if blob is None:
+            return None
+        _debug(f"路线缓存命中 {key}")
+        plans = unpack_route_plans(blob)
+        for plan in plans:
+            _fill_endpoints(plan, origin_info, dest_info, waypoint_infos or [])
+        return plans
+
+    def _set_cached_routes(self, key: tuple, plans: List[RoutePlanData]) -> None:
+        if plans:
+            stripped = [_strip_endpoints(plan) for plan in plans]
+            self.route_cache.set(key, pack_route_plans(stripped), route_cache_ttl(key[0]))
+
     async def geocode(self, address: str, city: Optional[str] = None) -> Optional[LocationInfo]:
         """地理编码：将地址转换为坐标"""
         try:
@@ -244,7 +492,7 @@ class RoutePlanningMCP:
                 params["city"] = city
                 
             response = await self.client.get(f"{AMAP_BASE_URL}/v3/geocode/geo", params=params)
-            data = response.json()
+            data = amap_json(response)
             
             if data.get("status") == "1" and data.get("geocodes"):
                 geo = data["geocodes"][0]
@@ -285,9 +533,15 @@ class RoutePlanningMCP:
         if coords:
             return coords
         
+        cache_key = ("coords", location.strip(), city or "")
+        cached = self.location_cache.get(cache_key)
+        if cached:
+            return cached
+        
         # 尝试地理编码
         location_info = await self.geocode(location, city)
         if location_info and location_info.location:
+            self.location_cache.set(cache_key, location_info.location, LOCATION_CACHE_TTL)
             return location_info.location
         
         # 尝试搜索POI
@@ -302,11 +556,12 @@ class RoutePlanningMCP:
                 params["city"] = city
                 
             response = await self.client.get(f"{AMAP_BASE_URL}/v3/place/text", params=params)
-            data = response.json()
+            data = amap_json(response)
             
             if data.get("status") == "1" and data.get("pois"):
                 poi = data["pois"][0]
                 if poi.get("location"):
+                    self.location_cache.set(cache_key, poi["location"], LOCATION_CACHE_TTL)
                     return poi["location"]
         except Exception as e:
             print(f"POI搜索错误 {location}: {e}", file=sys.stderr)
@@ -316,9 +571,15 @@ class RoutePlanningMCP:
     
     async def get_location_info(self, location: str, city: Optional[str] = None) -> LocationInfo:
         """获取位置信息"""
+        cache_key = ("info", location.strip(), city or "")
+        cached = self.location_cache.get(cache_key)
+        if cached:
+            return cached
+        
         # 先尝试地理编码
         location_info = await self.geocode(location, city)
         if location_info:
+            self.location_cache.set(cache_key, location_info, LOCATION_CACHE_TTL)
             return location_info
         
         # 如果地理编码失败，尝试搜索POI
@@ -333,11 +594,11 @@ class RoutePlanningMCP:
                 params["city"] = city
                 
             response = await self.client.get(f"{AMAP_BASE_URL}/v3/place/text", params=params)
-            data = response.json()
+            data = amap_json(response)
             
             if data.get("status") == "1" and data.get("pois"):
                 poi = data["pois"][0]
-                return LocationInfo(
+                location_info = LocationInfo(
                     name=poi.get("name", location),
                     location=poi.get("location"),
                     address=poi.get("address"),
@@ -345,20 +606,78 @@ class RoutePlanningMCP:
                     adcode=poi.get("adcode"),
                     formatted_address=poi.get("address", location)
                 )
+                self.location_cache.set(cache_key, location_info, LOCATION_CACHE_TTL)
+                return location_info
         except Exception as e:
             print(f"获取位置信息错误 {location}: {e}", file=sys.stderr)
         
         # 如果都失败，返回基本信息
         return LocationInfo(name=location)
     
+    async def get_city_code(self, city: str) -> Optional[str]:
+        """通过地理编码获取城市编码（citycode，缺失时用adcode），按城市名缓存"""
+        cache_key = ("citycode", city.strip())
+        cached = self.location_cache.get(cache_key)
+        if cached:
+            return cached
+        
+        try:
+            geo_params = {
+                "key": AMAP_API_KEY,
+                "address": city,
+                "output": "json"
+            }
+            response = await self.client.get(f"{AMAP_BASE_URL}/v3/geocode/geo", params=geo_params)
+            geo_data = amap_json(response)
+            
+            if geo_data.get("status") == "1" and geo_data.get("geocodes"):
+                geo = geo_data["geocodes"][0]
+                # 如果没有citycode，使用adcode（通常是相同的）
+                city_code = geo.get("citycode") or geo.get("adcode")
+                if city_code:
+                    self.location_cache.set(cache_key, city_code, LOCATION_CACHE_TTL)
+                    return city_code
+        except Exception as e:
+            print(f"获取城市编码错误: {e}", file=sys.stderr)
+        
+        return None
+    
+    async def get_district_adcode(self, name: str) -> Optional[str]:
+        """通过行政区划查询接口获取adcode，按名称缓存"""
+        cache_key = ("adcode", name.strip())
+        cached = self.location_cache.get(cache_key)
+        if cached:
+            return cached
+        
+        try:
+            district_params = {
+                "key": AMAP_API_KEY,
+                "keywords": name,
+                "subdistrict": "0",  # 不返回下级行政区
+                "output": "json"
+            }
+            response = await self.client.get(f"{AMAP_BASE_URL}/v3/config/district", params=district_params)
+            district_data = amap_json(response)
+            
+            if district_data.get("status") == "1" and district_data.get("districts"):
+                adcode = district_data["districts"][0].get("adcode")
+                if adcode:
+                    self.location_cache.set(cache_key, adcode, LOCATION_CACHE_TTL)
+                    return adcode
+        except Exception as e:
+            print(f"查询行政区划错误: {e}", file=sys.stderr)
+        
+        return None
+    
     async def plan_driving_route(
         self, 
         origin: str, 
         destination: str, 
         waypoints: Optional[List[str]] = None,
         strategy: Optional[str] = None,
-        city: Optional[str] = None
-    ) -> List[RoutePlan]:
+        city: Optional[str] = None,
+        include_geometry: bool = False
+    ) -> List[RoutePlanData]:
         """规划驾车路线"""
         origin_coords = await self.get_coordinates(origin, city)
         dest_coords = await self.get_coordinates(destination, city)
@@ -368,138 +687,163 @@ class RoutePlanningMCP:
         if not dest_coords:
             raise ValueError(f"无法解析终点坐标: {destination}")
         
-        print(f"调试: 起点坐标: {origin_coords}, 终点坐标: {dest_coords}", file=sys.stderr)
+        _debug(f"起点坐标: {origin_coords}, 终点坐标: {dest_coords}")
+        
+        waypoint_coords = []
+        waypoint_names = []
+        for wp in waypoints or []:
+            wp_coords = await self.get_coordinates(wp, city)
+            if wp_coords:
+                waypoint_coords.append(wp_coords)
+                waypoint_names.append(wp)
         
+        cache_key = self._route_cache_key(
+            RouteType.DRIVING, origin_coords, dest_coords, waypoint_coords, strategy, include_geometry
+        )
         # 获取位置详细信息
         origin_info = await self.get_location_info(origin, city)
         dest_info = await self.get_location_info(destination, city)
+        waypoint_infos = []
+        for wp in waypoint_names:
+            waypoint_infos.append(await self.get_location_info(wp, city))
+        cached_plans = self._get_cached_routes(cache_key, origin_info, dest_info, waypoint_infos)
+        if cached_plans is not None:
+            return cached_plans
         
         params = {
             "key": AMAP_API_KEY,
             "origin": origin_coords,
             "destination": dest_coords,
             "output": "json",
-            "extensions": "all",
-            "show_fields": "cost,tmcs"
+            "extensions": "all"
         }
+        if include_geometry:
+            params["show_fields"] = SHOW_FIELDS_GEOMETRY
         
-        waypoint_infos = []
-        
-        if waypoints:
-            waypoint_coords = []
-            for wp in waypoints:
-                wp_coords = await self.get_coordinates(wp, city)
-                if wp_coords:
-                    waypoint_coords.append(wp_coords)
-                    waypoint_infos.append(await self.get_location_info(wp, city))
-            if waypoint_coords:
-                params["waypoints"] = ";".join(waypoint_coords)
+        if waypoint_coords:
+            params["waypoints"] = ";".join(waypoint_coords)
         
         if strategy:
             params["strategy"] = strategy
         
         try:
             response = await self.client.get(f"{AMAP_BASE_URL}/v5/direction/driving", params=params)
-            data = response.json()
+            data = amap_json(response)
             
-            print(f"调试: API响应状态: {data.get('status')}, 信息: {data.get('info')}", file=sys.stderr)
+            _debug(f"API响应状态: {data.get('status')}, 信息: {data.get('info')}")
             
             if data.get("status") != "1":
                 error_msg = data.get("info", "未知错误")
                 raise Exception(f"API错误: {error_msg}")
             
-            plans = []
-            route_data = data.get("route", {})
-            paths = route_data.get("paths", [])
+            plans = self._parse_driving_response(data, origin_info, dest_info, waypoint_infos, include_geometry)
             
-            print(f"调试: 找到 {len(paths)} 条路径", file=sys.stderr)
+            self._set_cached_routes(cache_key, plans)
+            return plans
             
-            for path_idx, path in enumerate(paths):
-                # 尝试不同字段名获取距离和时间
-                distance = 0
-                if "distance" in path:
+        except Exception as e:
+            print(f"API请求错误: {e}", file=sys.stderr)
+            raise
+    
+    def _parse_driving_response(
+        self,
+        data: dict,
+        origin_info: LocationInfo,
+        dest_info: LocationInfo,
+        waypoint_infos: List[LocationInfo],
+        include_geometry: bool = False
+    ) -> List[RoutePlanData]:
+        """解析驾车响应数据（v5接口）"""
+        plans = []
+        route_data = data.get("route", {})
+        paths = route_data.get("paths", [])
+        
+        _debug(f"找到 {len(paths)} 条路径")
+        
+        for path_idx, path in enumerate(paths):
+            # 尝试不同字段名获取距离和时间
+            distance = 0
+            if "distance" in path:
+                try:
+                    distance = float(path.get("distance", 0))
+                except (ValueError, TypeError):
+                    pass
+            
+            duration = 0
+            # 尝试不同可能的duration字段
+            for duration_key in ["duration", "time", "total_time"]:
+                if duration_key in path and path[duration_key]:
                     try:
-                        distance = float(path.get("distance", 0))
+                        duration = float(path.get(duration_key, 0))
+                        break
+                    except (ValueError, TypeError):
+                        continue
+            
+            # 如果还是没有获取到duration，根据距离估算
+            if duration <= 0 and distance > 0:
+                # 假设平均车速60km/h
+                duration = (distance / 1000) / 60 * 3600  # 转换为秒
+            
+            taxi_cost = path.get("taxi_cost")
+            tolls = path.get("tolls")
+            
+            # 解析步骤
+            steps = []
+            step_list = path.get("steps", [])
+            _debug(f"路径 {path_idx+1} 有 {len(step_list)} 个步骤")
+            
+            for step_idx, step in enumerate(step_list):
+                instruction = step.get("instruction", "")
+                road_name = step.get("road", "")
+                
+                # 获取步骤距离
+                step_distance = 0
+                if "distance" in step:
+                    try:
+                        step_distance = float(step.get("distance", 0))
                     except (ValueError, TypeError):
                         pass
                 
-                duration = 0
-                # 尝试不同可能的duration字段
-                for duration_key in ["duration", "time", "total_time"]:
-                    if duration_key in path and path[duration_key]:
+                # 获取步骤时间
+                step_duration = 0
+                for duration_key in ["duration", "time", "step_time"]:
+                    if duration_key in step and step[duration_key]:
                         try:
-                            duration = float(path.get(duration_key, 0))
+                            step_duration = float(step.get(duration_key, 0))
                             break
                         except (ValueError, TypeError):
                             continue
                 
-                # 如果还是没有获取到duration，根据距离估算
-                if duration <= 0 and distance > 0:
-                    # 假设平均车速60km/h
-                    duration = (distance / 1000) / 60 * 3600  # 转换为秒
-                
-                taxi_cost = path.get("taxi_cost")
-                tolls = path.get("tolls")
-                
-                # 解析步骤
-                steps = []
-                step_list = path.get("steps", [])
-                print(f"调试: 路径 {path_idx+1} 有 {len(step_list)} 个步骤", file=sys.stderr)
-                
-                for step_idx, step in enumerate(step_list):
-                    instruction = step.get("instruction", "")
-                    road_name = step.get("road", "")
-                    
-                    # 获取步骤距离
-                    step_distance = 0
-                    if "distance" in step:
-                        try:
-                            step_distance = float(step.get("distance", 0))
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    # 获取步骤时间
-                    step_duration = 0
-                    for duration_key in ["duration", "time", "step_time"]:
-                        if duration_key in step and step[duration_key]:
-                            try:
-                                step_duration = float(step.get(duration_key, 0))
-                                break
-                            except (ValueError, TypeError):
-                                continue
-                    
-                    steps.append(RouteStep(
-                        instruction=instruction,
-                        road_name=road_name,
-                        distance=step_distance,
-                        duration=step_duration
-                    ))
-                
-                plan = RoutePlan(
-                    route_type="驾车",
-                    origin=origin_info,
-                    destination=dest_info,
-                    waypoints=waypoint_infos,
-                    total_distance=distance,
-                    total_duration=duration,
-                    total_taxi_fare=float(taxi_cost) if taxi_cost else None,
-                    total_tolls=float(tolls) if tolls else None,
-                    steps=steps
-                )
-                plans.append(plan)
-            
-            return plans
+                steps.append(RouteStepData(
+                    instruction=instruction,
+                    road_name=road_name,
+                    distance=step_distance,
+                    duration=step_duration
+                ))
             
-        except Exception as e:
-            print(f"API请求错误: {e}", file=sys.stderr)
-            raise
+            plan = RoutePlanData(
+                route_type="驾车",
+                origin=origin_info,
+                destination=dest_info,
+                waypoints=waypoint_infos,
+                total_distance=distance,
+                total_duration=duration,
+                total_taxi_fare=float(taxi_cost) if taxi_cost else None,
+                total_tolls=float(tolls) if tolls else None,
+                steps=steps,
+                polyline=self._encode_route_geometry(step_list) if include_geometry else None
+            )
+            plans.append(plan)
+        
+        return plans
     
     async def plan_walking_route(
         self, 
         origin: str, 
         destination: str,
-        city: Optional[str] = None
-    ) -> List[RoutePlan]:
+        city: Optional[str] = None,
+        include_geometry: bool = False
+    ) -> List[RoutePlanData]:
         """规划步行路线"""
         origin_coords = await self.get_coordinates(origin, city)
         dest_coords = await self.get_coordinates(destination, city)
@@ -507,8 +851,14 @@ class RoutePlanningMCP:
         if not origin_coords or not dest_coords:
             raise ValueError("无法解析起点或终点坐标")
         
+        cache_key = self._route_cache_key(
+            RouteType.WALKING, origin_coords, dest_coords, include_geometry=include_geometry
+        )
         origin_info = await self.get_location_info(origin, city)
         dest_info = await self.get_location_info(destination, city)
+        cached_plans = self._get_cached_routes(cache_key, origin_info, dest_info)
+        if cached_plans is not None:
+            return cached_plans
         
         params = {
             "key": AMAP_API_KEY,
@@ -516,9 +866,11 @@ class RoutePlanningMCP:
             "destination": dest_coords,
             "output": "json"
         }
+        if include_geometry:
+            params["show_fields"] = SHOW_FIELDS_GEOMETRY
         
         response = await self.client.get(f"{AMAP_BASE_URL}/v5/direction/walking", params=params)
-        data = response.json()
+        data = amap_json(response)
         
         if data.get("status") != "1":
             error_msg = data.get("info", "未知错误")
@@ -543,30 +895,33 @@ class RoutePlanningMCP:
                 step_distance = float(step.get("distance", 0))
                 step_duration = float(step.get("duration", 0))
                 
-                steps.append(RouteStep(
+                steps.append(RouteStepData(
                     instruction=instruction,
                     distance=step_distance,
                     duration=step_duration
                 ))
             
-            plan = RoutePlan(
+            plan = RoutePlanData(
                 route_type="步行",
                 origin=origin_info,
                 destination=dest_info,
                 total_distance=distance,
                 total_duration=duration,
-                steps=steps
+                steps=steps,
+                polyline=self._encode_route_geometry(path.get("steps", [])) if include_geometry else None
             )
             plans.append(plan)
         
+        self._set_cached_routes(cache_key, plans)
         return plans
     
     async def plan_cycling_route(
         self, 
         origin: str, 
         destination: str,
-        city: Optional[str] = None
-    ) -> List[RoutePlan]:
+        city: Optional[str] = None,
+        include_geometry: bool = False
+    ) -> List[RoutePlanData]:
         """规划骑行路线（包括自行车和电动车）"""
         origin_coords = await self.get_coordinates(origin, city)
         dest_coords = await self.get_coordinates(destination, city)
@@ -574,8 +929,14 @@ class RoutePlanningMCP:
         if not origin_coords or not dest_coords:
             raise ValueError("无法解析起点或终点坐标")
         
+        cache_key = self._route_cache_key(
+            RouteType.BICYCLING, origin_coords, dest_coords, include_geometry=include_geometry
+        )
         origin_info = await self.get_location_info(origin, city)
         dest_info = await self.get_location_info(destination, city)
+        cached_plans = self._get_cached_routes(cache_key, origin_info, dest_info)
+        if cached_plans is not None:
+            return cached_plans
         
         # 使用骑行API
         params = {
@@ -584,9 +945,11 @@ class RoutePlanningMCP:
             "destination": dest_coords,
             "output": "json"
         }
+        if include_geometry:
+            params["show_fields"] = SHOW_FIELDS_GEOMETRY
         
         response = await self.client.get(f"{AMAP_BASE_URL}/v5/direction/bicycling", params=params)
-        data = response.json()
+        data = amap_json(response)
         
         if data.get("status") != "1":
             error_msg = data.get("info", "未知错误")
@@ -611,22 +974,24 @@ class RoutePlanningMCP:
                 step_distance = float(step.get("distance", 0))
                 step_duration = float(step.get("duration", 0))
                 
-                steps.append(RouteStep(
+                steps.append(RouteStepData(
                     instruction=instruction,
                     distance=step_distance,
                     duration=step_duration
                 ))
             
-            plan = RoutePlan(
+            plan = RoutePlanData(
                 route_type="骑行",
                 origin=origin_info,
                 destination=dest_info,
                 total_distance=distance,
                 total_duration=duration,
-                steps=steps
+                steps=steps,
+                polyline=self._encode_route_geometry(path.get("steps", [])) if include_geometry else None
             )
             plans.append(plan)
         
+        self._set_cached_routes(cache_key, plans)
         return plans
     
     async def plan_transit_route(
@@ -634,7 +999,7 @@ class RoutePlanningMCP:
         origin: str, 
         destination: str,
         city: Optional[str] = None
-    ) -> List[RoutePlan]:
+    ) -> List[RoutePlanData]:
         """规划公交路线"""
         try:
             origin_coords = await self.get_coordinates(origin, city)
@@ -645,9 +1010,14 @@ class RoutePlanningMCP:
             if not dest_coords:
                 raise ValueError(f"无法解析终点坐标: {destination}")
             
+            cache_key = self._route_cache_key(RouteType.TRANSIT, origin_coords, dest_coords)
+            
             # 获取位置详细信息
             origin_info = await self.get_location_info(origin, city)
             dest_info = await self.get_location_info(destination, city)
+            cached_plans = self._get_cached_routes(cache_key, origin_info, dest_info)
+            if cached_plans is not None:
+                return cached_plans
             
             # 构建参数 - 使用v5接口的正确参数
             params = {
@@ -658,104 +1028,68 @@ class RoutePlanningMCP:
                 "extensions": "all"
             }
             
-            # 尝试获取城市编码（citycode）
+            # 获取城市编码（citycode），结果按城市缓存
             city_code = None
             if city:
-                # 使用地理编码获取城市编码
-                try:
-                    geo_params = {
-                        "key": AMAP_API_KEY,
-                        "address": city,
-                        "output": "json"
-                    }
-                    response = await self.client.get(f"{AMAP_BASE_URL}/v3/geocode/geo", params=geo_params)
-                    geo_data = response.json()
-                    
-                    if geo_data.get("status") == "1" and geo_data.get("geocodes"):
-                        geo = geo_data["geocodes"][0]
-                        city_code = geo.get("citycode")
-                        if not city_code and geo.get("adcode"):
-                            # 如果没有citycode，使用adcode（通常是相同的）
-                            city_code = geo.get("adcode")
-                except Exception as e:
-                    print(f"获取城市编码错误: {e}", file=sys.stderr)
-            
-            # 设置城市参数（使用citycode格式）
-            if city_code:
-                params["city1"] = city_code  # 起点城市编码
-                params["city2"] = city_code  # 终点城市编码，假设同城
-            else:
+                city_code = await self.get_city_code(city)
+            if not city_code:
                 # 如果没有获取到城市编码，但用户提供了城市名，尝试使用adcode
                 if city and origin_info.adcode:
-                    params["city1"] = origin_info.adcode
-                    params["city2"] = origin_info.adcode
+                    city_code = origin_info.adcode
                 elif origin_info.city:
-                    # 尝试从城市名获取adcode
-                    try:
-                        # 调用行政区划查询接口
-                        district_params = {
-                            "key": AMAP_API_KEY,
-                            "keywords": origin_info.city,
-                            "subdistrict": "0",  # 不返回下级行政区
-                            "output": "json"
-                        }
-                        response = await self.client.get(f"{AMAP_BASE_URL}/v3/config/district", params=district_params)
-                        district_data = response.json()
-                        
-                        if district_data.get("status") == "1" and district_data.get("districts"):
-                            adcode = district_data["districts"][0].get("adcode")
-                            if adcode:
-                                params["city1"] = adcode
-                                params["city2"] = adcode
-                    except Exception as e:
-                        print(f"查询行政区划错误: {e}", file=sys.stderr)
-            
-            print(f"调试: 公交规划参数: {params}", file=sys.stderr)
+                    city_code = await self.get_district_adcode(origin_info.city)
             
             # 使用正确的v5接口
             url = f"{AMAP_BASE_URL}/v5/direction/transit/integrated"
-            print(f"调试: 请求URL: {url}", file=sys.stderr)
+            _debug(f"请求URL: {url}")
             
-            response = await self.client.get(url, params=params)
-            data = response.json()
+            # 参数方案依次为: 城市编码(city1/city2，假设同城) -> 不带城市参数 -> 行政区划编码(ad1/ad2)
+            # 仅在 MISSING_REQUIRED_PARAMS 时换下一种；成功过的方案按城市对记住，下次直接使用
+            variants = []
+            if city_code:
+                variants.append(("citycode", {"city1": city_code, "city2": city_code}))
+            variants.append(("plain", {}))
+            variants.append(("adcode", {"ad1": origin_info.adcode or "", "ad2": dest_info.adcode or ""}))
             
-            print(f"调试: 公交API响应: {data}", file=sys.stderr)
+            variant_key = ("transit_variant", city_code or "", origin_info.adcode or "", dest_info.adcode or "")
+            preferred = self.location_cache.get(variant_key)
+            if preferred:
+                variants.sort(key=lambda v: v[0] != preferred)
             
-            if data.get("status") != "1":
-                error_msg = data.get("info", "未知错误")
-                if error_msg == "MISSING_REQUIRED_PARAMS":
-                    # 可能是城市参数问题，尝试不带城市参数
-                    print("调试: 尝试不带城市参数...", file=sys.stderr)
-                    params.pop("city1", None)
-                    params.pop("city2", None)
-                    response = await self.client.get(url, params=params)
-                    data = response.json()
-                    
-                    if data.get("status") != "1":
-                        # 尝试使用ad1和ad2参数（行政区划编码）
-                        params["ad1"] = origin_info.adcode or ""
-                        params["ad2"] = dest_info.adcode or ""
-                        response = await self.client.get(url, params=params)
-                        data = response.json()
-                        
-                        if data.get("status") != "1":
-                            raise Exception(f"公交路径规划失败: {data.get('info', '未知错误')}")
+            for variant_name, variant_params in variants:
+                request_params = {**params, **variant_params}
+                _debug(f"公交规划参数({variant_name}): {request_params}")
+                response = await self.client.get(url, params=request_params)
+                data = amap_json(response)
                 
-            return self._parse_transit_response_v5(data, origin_info, dest_info)
+                _debug(f"公交API响应状态: {data.get('status')}, 信息: {data.get('info')}")
+                
+                if data.get("status") == "1":
+                    self.location_cache.set(variant_key, variant_name, LOCATION_CACHE_TTL)
+                    break
+                if data.get("info") != "MISSING_REQUIRED_PARAMS":
+                    break
+                _debug("缺少必要参数，尝试下一种城市参数...")
+            else:
+                raise Exception(f"公交路径规划失败: {data.get('info', '未知错误')}")
+                
+            plans = self._parse_transit_response_v5(data, origin_info, dest_info)
+            self._set_cached_routes(cache_key, plans)
+            return plans
                 
         except Exception as e:
             print(f"公交API请求错误: {e}", file=sys.stderr)
             raise
 
     def _parse_transit_response_v5(self, data: dict, origin_info: LocationInfo, 
-                                dest_info: LocationInfo) -> List[RoutePlan]:
+                                dest_info: LocationInfo) -> List[RoutePlanData]:
         """解析公交响应数据（v5接口）"""
         plans = []
         
         route_data = data.get("route", {})
         transits = route_data.get("transits", [])
         
-        print(f"调试: 找到 {len(transits)} 个公交方案", file=sys.stderr)
+        _debug(f"找到 {len(transits)} 个公交方案")
         
         for transit_idx, transit in enumerate(transits[:3]):  # 只取前3个方案
             # 获取基本信息
@@ -784,25 +1118,22 @@ class RoutePlanningMCP:
                 print(f"警告: 无法解析费用 '{cost_str}'", file=sys.stderr)
                 cost = 0
             
-            print(f"调试: 方案 {transit_idx+1}: 距离={distance}米, 时间={duration}秒, 费用={cost}元", file=sys.stderr)
+            _debug(f"方案 {transit_idx+1}: 距离={distance}米, 时间={duration}秒, 费用={cost}元")
             
             # 解析步骤
             steps = []
             segments = transit.get("segments", [])
             
             if segments:
-                print(f"调试: 有 {len(segments)} 个segments", file=sys.stderr)
+                _debug(f"有 {len(segments)} 个segments")
             
             segment_total_duration = 0  # 用于从segments中累加时间
             segment_total_distance = 0  # 用于从segments中累加距离
             
             for segment_idx, segment in enumerate(segments):
-                print(f"调试: 解析segment {segment_idx+1}: {segment.keys()}", file=sys.stderr)
-                
                 # 步行段
                 if "walking" in segment:
                     walking = segment.get("walking", {})
-                    print(f"调试: walking字段类型: {type(walking)}", file=sys.stderr)
                     
                     if walking:
                         if isinstance(walking, dict):
@@ -827,7 +1158,7 @@ class RoutePlanningMCP:
                             # 获取道路名称
                             walk_road = walking.get("road", "")
                             
-                            step = RouteStep(
+                            step = RouteStepData(
                                 instruction=walk_instruction,
                                 road_name=walk_road,
                                 distance=walk_distance,
@@ -838,11 +1169,11 @@ class RoutePlanningMCP:
                             segment_total_duration += walk_duration
                             segment_total_distance += walk_distance
                             
-                            print(f"调试: 步行段 - 距离={walk_distance}米, 时间={walk_duration}秒", file=sys.stderr)
+                            _debug(f"步行段 - 距离={walk_distance}米, 时间={walk_duration}秒")
                             
                         elif isinstance(walking, str):
                             # 尝试从字符串中提取信息
-                            step = RouteStep(
+                            step = RouteStepData(
                                 instruction="步行一段距离",
                                 distance=0,
                                 duration=0
@@ -852,11 +1183,9 @@ class RoutePlanningMCP:
                 # 公交/地铁段
                 bus_data = segment.get("bus", {})
                 if bus_data:
-                    print(f"调试: bus_data字段类型: {type(bus_data)}", file=sys.stderr)
-                    
                     if isinstance(bus_data, dict):
                         buslines = bus_data.get("buslines", [])
-                        print(f"调试: 有 {len(buslines)} 个buslines", file=sys.stderr)
+                        _debug(f"有 {len(buslines)} 个buslines")
                         
                         for busline in buslines:
                             bus_name = busline.get("name", "公交车")
@@ -886,7 +1215,7 @@ class RoutePlanningMCP:
                             if via_stops:
                                 instruction += f"，经过{len(via_stops)}站"
                             
-                            step = RouteStep(
+                            step = RouteStepData(
                                 instruction=instruction,
                                 distance=bus_distance,
                                 duration=bus_duration
@@ -896,7 +1225,7 @@ class RoutePlanningMCP:
                             segment_total_duration += bus_duration
                             segment_total_distance += bus_distance
                             
-                            print(f"调试: 公交段 - 距离={bus_distance}米, 时间={bus_duration}秒, 线路={bus_name}", file=sys.stderr)
+                            _debug(f"公交段 - 距离={bus_distance}米, 时间={bus_duration}秒, 线路={bus_name}")
                 
                 # 地铁段
                 railway_data = segment.get("railway", {})
@@ -928,7 +1257,7 @@ class RoutePlanningMCP:
                     if via_stops:
                         instruction += f"，经过{len(via_stops)}站"
                     
-                    step = RouteStep(
+                    step = RouteStepData(
                         instruction=instruction,
                         distance=railway_distance,
                         duration=railway_duration
@@ -938,20 +1267,20 @@ class RoutePlanningMCP:
                     segment_total_duration += railway_duration
                     segment_total_distance += railway_distance
                     
-                    print(f"调试: 地铁段 - 距离={railway_distance}米, 时间={railway_duration}秒, 线路={railway_name}", file=sys.stderr)
+                    _debug(f"地铁段 - 距离={railway_distance}米, 时间={railway_duration}秒, 线路={railway_name}")
             
             # 如果transit的总时间为0，但segments有时间，使用segments的总时间
             if duration <= 0 and segment_total_duration > 0:
                 duration = segment_total_duration
-                print(f"调试: 使用segments累加时间: {duration}秒", file=sys.stderr)
+                _debug(f"使用segments累加时间: {duration}秒")
             
             # 如果transit的总距离为0，但segments有距离，使用segments的总距离
             if distance <= 0 and segment_total_distance > 0:
                 distance = segment_total_distance
-                print(f"调试: 使用segments累加距离: {distance}米", file=sys.stderr)
+                _debug(f"使用segments累加距离: {distance}米")
             
             # 创建计划
-            plan = RoutePlan(
+            plan = RoutePlanData(
                 route_type="公交",
                 origin=origin_info,
                 destination=dest_info,
@@ -962,7 +1291,7 @@ class RoutePlanningMCP:
             )
             plans.append(plan)
             
-            print(f"调试: 公交方案 {transit_idx+1} 完成: 总距离={distance}米, 总时间={duration}秒, 步骤数={len(steps)}", file=sys.stderr)
+            _debug(f"公交方案 {transit_idx+1} 完成: 总距离={distance}米, 总时间={duration}秒, 步骤数={len(steps)}")
         
         return plans
 
@@ -977,7 +1306,8 @@ async def route_planning(
     waypoints: Optional[List[str]] = None,
     city: Optional[str] = None,
     strategy: Optional[str] = None,
-    alternative_routes: int = 1
+    alternative_routes: int = 1,
+    include_geometry: bool = False
 ) -> str:
     """
     路径规划工具，支持驾车、步行、骑行、电动车、公交五种出行方式
@@ -990,20 +1320,21 @@ async def route_planning(
         city: 城市名称，用于地址解析，如'北京市'
         strategy: 驾车策略: 0(推荐), 1(躲避拥堵), 2(高速优先), 3(不走高速), 4(少收费), 5(大路优先), 6(速度最快)
         alternative_routes: 备选路线数量(1-3)
+        include_geometry: 是否输出路线几何(polyline6编码，驾车/步行/骑行有效)，默认不输出以减少响应体积
     """
     try:
-        print(f"调试: 开始路径规划 - 类型: {route_type}, 起点: {origin}, 终点: {destination}", file=sys.stderr)
+        _debug(f"开始路径规划 - 类型: {route_type}, 起点: {origin}, 终点: {destination}")
         
         planner = RoutePlanningMCP()
         
         if route_type == RouteType.DRIVING:
             plans = await planner.plan_driving_route(
-                origin, destination, waypoints, strategy, city
+                origin, destination, waypoints, strategy, city, include_geometry
             )
         elif route_type == RouteType.WALKING:
-            plans = await planner.plan_walking_route(origin, destination, city)
+            plans = await planner.plan_walking_route(origin, destination, city, include_geometry)
         elif route_type in [RouteType.BICYCLING, RouteType.ELECTROBIKE]:
-            plans = await planner.plan_cycling_route(origin, destination, city)
+            plans = await planner.plan_cycling_route(origin, destination, city, include_geometry)
         elif route_type == RouteType.TRANSIT:
             plans = await planner.plan_transit_route(origin, destination, city)
         else:
@@ -1059,7 +1390,7 @@ async def search_places(
             
         async with httpx.AsyncClient() as client:
             response = await client.get(f"{AMAP_BASE_URL}/v3/place/text", params=params)
-            data = response.json()
+            data = amap_json(response)
             
             if data.get("status") == "1" and data.get("pois"):
                 pois = data["pois"][:limit]
@@ -1165,6 +1496,80 @@ async def multi_point_route(
     except Exception as e:
         return f"多点路径规划失败: {str(e)}"
 
+def benchmark_route_parsing(num_steps: int = 300, num_paths: int = 3, rounds: int = 50) -> Dict[str, float]:
+    """微基准：对比驾车响应解析为轻量结构与逐步骤构建 pydantic 模型（原实现）的耗时（秒/轮）"""
+    step = {"instruction": "沿榆亚路向东行驶", "road": "榆亚路", "distance": "120", "duration": "15"}
+    data = {"status": "1", "route": {"paths": [
+        {"distance": "36000", "duration": "2700", "steps": [dict(step) for _ in range(num_steps)]}
+        for _ in range(num_paths)
+    ]}}
+    planner = RoutePlanningMCP()
+    origin_info = LocationInfo(name="亚龙湾", location="109.6246,18.2310")
+    dest_info = LocationInfo(name="蜈支洲岛", location="109.7585,18.3120")
+    
+    # 基线：原实现每个步骤、每条路径都构建一个 pydantic 模型
+    class BaselineStep(BaseModel):
+        instruction: str
+        road_name: Optional[str] = None
+        distance: float
+        duration: float
+
+    class BaselinePlan(BaseModel):
+        route_type: str
+        origin: LocationInfo
+        destination: LocationInfo
+        waypoints: List[LocationInfo] = []
+        total_distance: float
+        total_duration: float
+        steps: List[BaselineStep] = []
+
+    def parse_baseline() -> List[BaselinePlan]:
+        return [
+            BaselinePlan(
+                route_type="驾车",
+                origin=origin_info,
+                destination=dest_info,
+                total_distance=float(path["distance"]),
+                total_duration=float(path["duration"]),
+                steps=[
+                    BaselineStep(
+                        instruction=s.get("instruction", ""),
+                        road_name=s.get("road", ""),
+                        distance=float(s.get("distance", 0)),
+                        duration=float(s.get("duration", 0))
+                    )
+                    for s in path.get("steps", [])
+                ]
+            )
+            for path in data["route"]["paths"]
+        ]
+    
+    # 调试输出由 ROUTE_DEBUG 控制，默认关闭，不计入耗时
+    start = time.perf_counter()
+    for _ in range(rounds):
+        plans = planner._parse_driving_response(data, origin_info, dest_info, [])
+    lightweight = (time.perf_counter() - start) / rounds
+    
+    start = time.perf_counter()
+    for _ in range(rounds):
+        parse_baseline()
+    pydantic_seconds = (time.perf_counter() - start) / rounds
+    
+    return {
+        "steps": num_steps * num_paths,
+        "plans": len(plans),
+        "lightweight_seconds": lightweight,
+        "pydantic_seconds": pydantic_seconds,
+        "speedup": pydantic_seconds / lightweight if lightweight else 0.0,
+    }
+
 # FastMCP会自动处理服务器运行
 if __name__ == "__main__":
-    mcp.run()
\ No newline at end of file
+    if "--bench" in sys.argv:
+        result = benchmark_route_parsing()
+        print(f"步骤数: {result['steps']}")
+        print(f"轻量结构解析: {result['lightweight_seconds'] * 1000:.2f} ms/轮")
+        print(f"pydantic 模型解析（基线）: {result['pydantic_seconds'] * 1000:.2f} ms/轮")
+        print(f"加速比: {result['speedup']:.1f}x")
+    else:
+        mcp.run()
\ No newline at end of file
@@ -1,372 +1,1014 @@
 import os
 import time
 import json
+import re
+import atexit
+import threading
 import traceback
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from selenium.webdriver.common.keys import Keys
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import (
+    ElementClickInterceptedException,
+    StaleElementReferenceException,
+    TimeoutException,
+)
 
-from .web_utils import COOKING_PATH, get_driver, get_map4, get_publish_date
+from .video_transcode import VIDEO_TRANSCODE, prepare_video, submit_transcode
+from .web_utils import (
+    CHROME_HEADLESS, COOKING_PATH, PROFILES_PATH, PUBLISH_QUEUE_DB, ROOT_PATH, block_resources, check_cookie_session,
+    enqueue_map4, get_driver, get_publish_date, inject_cookies, load_cookies, save_cookie_meta, save_cookies,
+)
 
 
 XIAOHONGSHU_COOKING = os.path.join(COOKING_PATH, "xiaohongshu.json")
+XIAOHONGSHU_PUBLISH_URL = "https://creator.xiaohongshu.com/publish/publish"
+XIAOHONGSHU_ORIGIN = "https://creator.xiaohongshu.com"
+# 需要登录的轻量接口：未登录时返回 success=false，用于不开浏览器判断 cookie 是否有效
+XIAOHONGSHU_SESSION_PROBE_URL = os.getenv("XHS_SESSION_PROBE_URL", "https://creator.xiaohongshu.com/api/galaxy/user/info")
+
+# 多账号：每个账号一个 cookie 文件 + 一个独立的 Chrome 配置目录，按账号并行发布
+XIAOHONGSHU_ACCOUNTS_PATH = os.path.join(COOKING_PATH, "xiaohongshu_accounts")
+DEFAULT_ACCOUNT = "default"  # 对应原来的单账号 cookie 文件 XIAOHONGSHU_COOKING
+ACCOUNT_MAX_PER_HOUR = int(os.getenv("XHS_ACCOUNT_MAX_PER_HOUR", "6"))       # 单账号每小时最多发布条数
+ACCOUNT_MIN_INTERVAL = float(os.getenv("XHS_ACCOUNT_MIN_INTERVAL", "60"))   # 单账号两次发布的最小间隔（秒）
+
+# 浏览器会话池：连续发布时复用已登录的 Chrome，省去每次启动浏览器和登录
+SESSION_POOL_SIZE = int(os.getenv("XHS_SESSION_POOL_SIZE", "1"))          # 最多同时存在的会话数
+SESSION_IDLE_TIMEOUT = float(os.getenv("XHS_SESSION_IDLE_TIMEOUT", "600"))  # 空闲多久后关闭（秒）
+SESSION_MAX_USES = int(os.getenv("XHS_SESSION_MAX_USES", "50"))           # 单个浏览器最多复用次数，防止内存膨胀
+
+# 基于条件的等待：短间隔轮询页面状态，条件满足立即继续，超时才报错
+POLL_INTERVAL = 0.1                                                   # 轮询间隔（秒）
+WAIT_TIMEOUT = float(os.getenv("XHS_WAIT_TIMEOUT", "15"))            # 元素出现/可点击
+SCHEDULE_TIMEOUT = float(os.getenv("XHS_SCHEDULE_TIMEOUT", "3"))     # 定时发布选项（可能不存在）
+TOPIC_TIMEOUT = float(os.getenv("XHS_TOPIC_TIMEOUT", "3"))           # 话题联想列表
+UPLOAD_TIMEOUT = float(os.getenv("XHS_UPLOAD_TIMEOUT", "600"))       # 视频上传完成
+SUBMIT_TIMEOUT = float(os.getenv("XHS_SUBMIT_TIMEOUT", "10"))        # 点击发布后的确认
+LOGIN_TIMEOUT = float(os.getenv("XHS_LOGIN_TIMEOUT", "100"))         # 首次手动扫码登录
+
+TITLE_SELECTORS = [
+    '//*[@placeholder="填写标题，可能会有更多赞哦～"]',
+    '//input[contains(@placeholder, "标题")]',
+    '//div[contains(@class, "title")]//input',
+]
+UPLOAD_DONE_XPATH = '//*[@id="publish-container"]//*[contains(text(),"重新上传")]'
+UPLOAD_FAILED_XPATH = '//*[@id="publish-container"]//*[contains(text(),"上传失败")]'
+
+# 图文笔记多图上传：一次 send_keys 选中全部图片，由页面并发上传，再在一次脚本调用里统计所有缩略图的状态
+IMAGE_MAX_COUNT = 18                                                  # 平台单篇图文的图片上限
+IMAGE_UPLOAD_TIMEOUT = float(os.getenv("XHS_IMAGE_UPLOAD_TIMEOUT", "120"))
+IMAGE_THUMB_CSS = os.getenv("XHS_IMAGE_THUMB_CSS", '#publish-container [class*="img-container"]')
+IMAGE_PROGRESS_CSS = '[class*="progress"], [class*="loading"], [class*="uploading"]'
+# 网络层上传跟踪：从 chromedriver 的 performance 日志（CDP Network 事件）识别上传请求
+UPLOAD_URL_RE = re.compile(os.getenv("XHS_UPLOAD_URL_PATTERN", r"upload|ros-|\.cos\.|partNumber"), re.I)
+UPLOAD_METRICS_PATH = os.path.join(ROOT_PATH, "upload_metrics.jsonl")  # 每篇笔记一行上传吞吐记录
+_IMAGE_UPLOAD_STATE_JS = """
+const items = document.querySelectorAll(arguments[0]);
+let done = 0, uploading = 0, failed = 0;
+for (const item of items) {
+    const text = item.innerText || '';
+    const img = item.querySelector('img');
+    if (text.includes('上传失败')) failed++;
+    else if (item.querySelector(arguments[1]) || /\\d+%/.test(text)) uploading++;
+    else if (img && img.complete && img.naturalWidth > 0) done++;
+    else uploading++;
+}
+return [items.length, done, uploading, failed];
+"""
+
+
+def _wait(driver, timeout=WAIT_TIMEOUT):
+    return WebDriverWait(driver, timeout, poll_frequency=POLL_INTERVAL)
+
+
+def wait_page_ready(driver, timeout=WAIT_TIMEOUT):
+    """等待 document.readyState == complete"""
+    _wait(driver, timeout).until(lambda d: d.execute_script("return document.readyState") == "complete")
+
+
+def wait_for_xpath(driver, xpath, timeout=WAIT_TIMEOUT, clickable=False):
+    condition = EC.element_to_be_clickable if clickable else EC.presence_of_element_located
+    return _wait(driver, timeout).until(condition((By.XPATH, xpath)), f"等待元素超时: {xpath}")
+
+
+def click_xpath(driver, xpath, timeout=WAIT_TIMEOUT):
+    """元素可点击后立即点击；被浮层遮挡时退回 JS 点击"""
+    element = wait_for_xpath(driver, xpath, timeout, clickable=True)
+    try:
+        element.click()
+    except ElementClickInterceptedException:
+        driver.execute_script("arguments[0].click();", element)
+    return element
 
-# 速度优化：减少等待时间
-FAST_WAIT = 0.3      # 快速操作间隔
-MEDIUM_WAIT = 0.8    # 中等等待
-SLOW_WAIT = 2        # 需要加载的等待
-
-
-def xiaohongshu_login(driver):
-    if (os.path.exists(XIAOHONGSHU_COOKING)):
-        print("cookies存在")
-        with open(XIAOHONGSHU_COOKING) as f:
-            cookies = json.loads(f.read())
-            driver.get("https://creator.xiaohongshu.com/creator/post")
-            driver.implicitly_wait(5)
-            driver.delete_all_cookies()
-            time.sleep(SLOW_WAIT)
-            # 遍历cookie
-            print("加载cookie")
-            for cookie in cookies:
-                if 'expiry' in cookie:
-                    del cookie["expiry"]
-                # 添加cookie
-                driver.add_cookie(cookie)
-            time.sleep(FAST_WAIT)
-            # 刷新
-            print("开始刷新")
-            driver.refresh()
-            driver.get("https://creator.xiaohongshu.com/publish/publish")
-            time.sleep(SLOW_WAIT)
-    else:
-        print("cookies不存在")
-        driver.get('https://creator.xiaohongshu.com/creator/post')
-        print("等待登录")
-        time.sleep(100)  # 登录需要用户手动操作，保留
-        print("登录完毕")
-        cookies = driver.get_cookies()
-        with open(XIAOHONGSHU_COOKING, 'w') as f:
-            f.write(json.dumps(cookies))
-        print(cookies)
-        time.sleep(FAST_WAIT)
-
-
-def publish_xiaohongshu(driver, mp4, index):
-    time.sleep(MEDIUM_WAIT)
-    driver.find_element("xpath", '//*[text()="发布笔记"]').click()
+
+def find_any(driver, xpaths, timeout=WAIT_TIMEOUT):
+    """在同一个等待里轮询多个候选选择器，返回最先出现的元素；超时返回 None"""
+    def first_present(d):
+        for xpath in xpaths:
+            found = d.find_elements(By.XPATH, xpath)
+            if found:
+                return found[0]
+        return False
+
+    try:
+        return _wait(driver, timeout).until(first_present)
+    except TimeoutException:
+        return None
+
+
+def select_topic(driver, content_input, label, timeout=TOPIC_TIMEOUT):
+    """输入话题后等待联想列表出现对应项并点击；没有联想时保留为普通文本"""
+    content_input.send_keys(label)
+
+    def matching_item(d):
+        for item in d.find_elements(By.CLASS_NAME, "publish-topic-item"):
+            try:
+                if label in item.text:
+                    return item
+            except StaleElementReferenceException:
+                return False  # 列表正在刷新，下一轮再找
+        return False
+
+    try:
+        _wait(driver, timeout).until(matching_item).click()
+        print("点击标签", label)
+    except TimeoutException:
+        print("未出现话题联想", label)
+
+
+def set_schedule(driver, publish_time, timeout=SCHEDULE_TIMEOUT, required=False):
+    """打开定时发布并填入时间；选项不存在时返回 False（required=True 时抛出异常）"""
+    def schedule_options(d):
+        options = d.find_elements("xpath", '//*[@class="css-1v54vzp"]')
+        return options if len(options) > 3 else False
+
+    try:
+        options = _wait(driver, timeout).until(schedule_options)
+    except TimeoutException:
+        if required:
+            raise
+        return False
+
+    print("点击定时发布")
+    options[3].click()
+    input_data = wait_for_xpath(driver, '//*[@placeholder="请选择日期"]', clickable=True)
+    input_data.send_keys(Keys.CONTROL, 'a')
+    input_data.send_keys(publish_time)
+    return True
+
+
+class UploadTracker:
+    """
+    跟踪一个 WebDriver 会话里的上传请求（get_driver 已开启 performance 日志）
+
+    日志读取后即从 chromedriver 中清空，因此每个会话只有一个 tracker，按标签页（CDP target）区分请求；
+    匹配 UPLOAD_URL_RE 的 PUT/POST 视为上传（分片上传时每个分片是一个请求），
+    请求体大小取自请求头 Content-Length，开始/结束时间取自 CDP 事件的时间戳
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.enabled = True
+        self.requests = {}       # requestId -> {"target", "url", "bytes", "start", "end", "status", "failed"}
+        self._lengths = {}       # requestWillBeSentExtraInfo 可能先于 requestWillBeSent 到达
+        self._watches = {}       # target -> 当前笔记的上传记录
+
+    def poll(self):
+        if not self.enabled:
+            return
+        try:
+            entries = self.driver.get_log("performance")
+        except Exception:
+            self.enabled = False  # 未开启 performance 日志（例如远程浏览器），只能依赖页面状态
+            return
+        for entry in entries:
+            try:
+                message = json.loads(entry["message"])
+            except (KeyError, ValueError):
+                continue
+            self._handle(message.get("webview"), message.get("message", {}))
+
+    def _handle(self, target, event):
+        method = event.get("method")
+        params = event.get("params", {})
+        request_id = params.get("requestId")
+        if method == "Network.requestWillBeSent":
+            request = params.get("request", {})
+            if request.get("method") not in ("PUT", "POST") or not UPLOAD_URL_RE.search(request.get("url", "")):
+                return
+            extra_size = self._lengths.pop(request_id, 0)
+            size = _content_length(request.get("headers")) or len(request.get("postData", "") or "") or extra_size
+            self.requests[request_id] = {
+                "target": target,
+                "url": request["url"],
+                "bytes": size,
+                "start": params.get("timestamp"),
+                "end": None,
+                "status": None,
+                "failed": False,
+            }
+        elif method == "Network.requestWillBeSentExtraInfo":
+            size = _content_length(params.get("headers"))
+            if request_id in self.requests:
+                self.requests[request_id]["bytes"] = self.requests[request_id]["bytes"] or size
+            elif size:
+                self._lengths[request_id] = size
+        elif request_id in self.requests:
+            request = self.requests[request_id]
+            if method == "Network.responseReceived":
+                request["status"] = params.get("response", {}).get("status")
+            elif method == "Network.loadingFinished":
+                request["end"] = params.get("timestamp")
+            elif method == "Network.loadingFailed":
+                request["end"] = params.get("timestamp")
+                request["failed"] = True
+
+    def begin(self, paths):
+        """在选择文件之前调用：记下当前标签页已有的请求，之后新出现的上传请求都属于这篇笔记"""
+        self.poll()
+        target = _target_id(self.driver.current_window_handle)
+        # 该标签页上一篇笔记遗留的请求（例如发布失败未调用 finish）不再需要
+        self.requests = {rid: r for rid, r in self.requests.items() if r["target"] != target}
+        self._watches[target] = {
+            "target": target,
+            "files": len(paths),
+            "expected_bytes": sum(os.path.getsize(p) for p in paths if os.path.exists(p)),
+            "baseline": set(self.requests),
+            "started": time.time(),
+        }
+
+    def _own_requests(self, watch):
+        return [
+            r for rid, r in self.requests.items()
+            if rid not in watch["baseline"] and (r["target"] is None or r["target"] == watch["target"])
+        ]
+
+    def finished(self):
+        """当前标签页的上传在网络层是否已完成：没有进行中的上传请求，且成功发送的字节数不少于文件大小"""
+        watch = self._watches.get(_target_id(self.driver.current_window_handle))
+        if not watch or not self.enabled:
+            return False
+        self.poll()
+        requests = self._own_requests(watch)
+        if not requests or any(r["end"] is None for r in requests):
+            return False
+        sent = sum(r["bytes"] for r in requests if not r["failed"] and (r["status"] or 0) < 400)
+        return sent >= watch["expected_bytes"] > 0
+
+    def finish(self, source):
+        """结束当前标签页的跟踪，返回并记录这篇笔记的上传吞吐"""
+        watch = self._watches.pop(_target_id(self.driver.current_window_handle), None)
+        if not watch:
+            return None
+        self.poll()
+        requests = [r for r in self._own_requests(watch) if r["end"] is not None]
+        ok = [r for r in requests if not r["failed"] and (r["status"] or 0) < 400]
+        if ok:
+            seconds = max(r["end"] for r in ok) - min(r["start"] for r in ok)
+        else:
+            seconds = time.time() - watch["started"]
+        sent = sum(r["bytes"] for r in ok)
+        metrics = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "files": watch["files"],
+            "bytes": sent or watch["expected_bytes"],
+            "seconds": round(seconds, 3),
+            "mbps": round((sent or watch["expected_bytes"]) / 1024 / 1024 / seconds, 3) if seconds > 0 else None,
+            "requests": len(requests),
+            "failed_requests": len(requests) - len(ok),
+            "detected_by": source,  # network：由网络事件判定完成；page：由页面提示判定
+        }
+        for rid in [rid for rid, r in self.requests.items() if r in requests]:
+            del self.requests[rid]
+        record_upload_metrics(metrics)
+        return metrics
+
+
+_upload_trackers = weakref.WeakKeyDictionary()
+
+
+def get_upload_tracker(driver):
+    tracker = _upload_trackers.get(driver)
+    if tracker is None:
+        tracker = _upload_trackers[driver] = UploadTracker(driver)
+    return tracker
+
+
+def _target_id(window_handle):
+    # 旧版 chromedriver 的窗口句柄带 "CDwindow-" 前缀，其余部分即 CDP target id
+    return window_handle.replace("CDwindow-", "") if window_handle else None
+
+
+def _content_length(headers):
+    for name, value in (headers or {}).items():
+        if name.lower() == "content-length":
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return 0
+    return 0
+
+
+def record_upload_metrics(metrics):
+    print(f"上传完成: {metrics['bytes'] / 1024 / 1024:.1f}MB / {metrics['seconds']}s"
+          f"（{metrics['mbps']} MB/s，{metrics['requests']} 个请求，判定来源 {metrics['detected_by']}）")
+    try:
+        os.makedirs(os.path.dirname(UPLOAD_METRICS_PATH), exist_ok=True)
+        with open(UPLOAD_METRICS_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(metrics, ensure_ascii=False) + "\n")
+    except OSError:
+        traceback.print_exc()
+
+
+def wait_upload_complete(driver, timeout=UPLOAD_TIMEOUT):
+    """
+    等待视频上传完成：网络层上传请求全部结束（字节数达到文件大小）即刻继续，
+    否则以上传区域出现“重新上传”为准；出现“上传失败”立即报错。返回上传吞吐记录
+    """
+    tracker = get_upload_tracker(driver)
+    source = []
+
+    def upload_finished(d):
+        if tracker.finished():
+            source.append("network")
+            return True
+        if d.find_elements(By.XPATH, UPLOAD_DONE_XPATH):
+            source.append("page")
+            return True
+        if d.find_elements(By.XPATH, UPLOAD_FAILED_XPATH):
+            raise Exception("文件上传失败")
+        return False
+
+    _wait(driver, timeout).until(upload_finished, "等待上传完成超时")
+    return tracker.finish(source[-1])
+
+
+def split_image_paths(file_path):
+    """图文笔记的图片路径：列表，或用逗号分隔的字符串"""
+    if isinstance(file_path, (list, tuple)):
+        return [p for p in file_path if p]
+    return [p.strip() for p in file_path.split(",") if p.strip()]
+
+
+def wait_images_uploaded(driver, count, timeout=IMAGE_UPLOAD_TIMEOUT):
+    """
+    等待 count 张图片全部上传完成：每轮轮询用一次脚本统计全部缩略图（完成/上传中/失败），
+    所有图片同时上传，总耗时约等于最慢的一张；任一张失败立即报错。
+    网络层已确认全部上传请求完成时不再等待缩略图渲染。返回上传吞吐记录
+    """
+    tracker = get_upload_tracker(driver)
+    last = [None]
+    source = []
+
+    def all_uploaded(d):
+        if tracker.finished():
+            source.append("network")
+            return True
+        total, done, uploading, failed = d.execute_script(_IMAGE_UPLOAD_STATE_JS, IMAGE_THUMB_CSS, IMAGE_PROGRESS_CSS)
+        if failed:
+            raise Exception(f"{failed} 张图片上传失败")
+        if (done, uploading) != last[0]:
+            last[0] = (done, uploading)
+            print(f"图片上传进度: {done}/{count}（上传中 {uploading}）")
+        if total >= count and done >= count and not uploading:
+            source.append("page")
+            return True
+        return False
+
+    _wait(driver, timeout).until(all_uploaded, f"等待 {count} 张图片上传完成超时")
+    return tracker.finish(source[-1])
+
+
+def submit_post(driver, timeout=SUBMIT_TIMEOUT):
+    """
+    点击发布，并等待页面跳转或出现“发布成功”提示
+    超时未确认时抛出 TimeoutException，由调用方按发布失败处理（发布队列会稍后重试）
+    """
+    url = driver.current_url
+    click_xpath(driver, '//*[text()="发布"]')
+    try:
+        _wait(driver, timeout).until(EC.any_of(
+            EC.url_changes(url),
+            EC.presence_of_element_located((By.XPATH, '//*[contains(text(),"发布成功")]')),
+        ))
+    except TimeoutException:
+        raise TimeoutException(f"{timeout} 秒内未检测到发布成功提示，请在创作者中心确认")
+
+
+def xiaohongshu_login(driver, cookie_path=XIAOHONGSHU_COOKING, interactive=True):
+    """
+    登录创作者中心
+    先用 HTTP 探测保存的 cookie（结果记录在 cookie 旁的 .meta.json 中），有效时直接写入浏览器再打开发布页，
+    不再先打开页面、清空、逐个添加再刷新；cookie 不存在或已失效时才进入手动扫码登录，
+    interactive=False（无头工作进程）时改为抛出异常
+    """
+    # 不使用隐式等待：它会让每次 find_elements 落空时都阻塞数秒，拖慢条件轮询
+    driver.implicitly_wait(0)
+    valid = check_cookie_session(cookie_path, XIAOHONGSHU_SESSION_PROBE_URL)
+    if valid is not False:
+        print("cookies有效" if valid else "cookies存在，未能探测，以浏览器结果为准")
+        inject_cookies(driver, load_cookies(cookie_path), XIAOHONGSHU_ORIGIN)
+        driver.get(XIAOHONGSHU_PUBLISH_URL)
+        wait_page_ready(driver)
+        if "login" not in driver.current_url:
+            if valid is None:
+                save_cookie_meta(cookie_path, validated_at=time.time(), valid=True)
+            return
+        save_cookie_meta(cookie_path, validated_at=time.time(), valid=False)
+    print("cookies不存在或已失效")
+    if not interactive:
+        raise RuntimeError(f"小红书登录已失效，请先重新扫码登录: {cookie_path}")
+    driver.get('https://creator.xiaohongshu.com/creator/post')
+    print("等待登录")
+    # 登录需要用户手动操作：出现创作者中心的“发布笔记”入口即视为登录完成（最多 LOGIN_TIMEOUT 秒）
+    def logged_in(d):
+        return "login" not in d.current_url and d.find_elements(By.XPATH, '//*[text()="发布笔记"]')
+
+    try:
+        WebDriverWait(driver, LOGIN_TIMEOUT, poll_frequency=1).until(logged_in)
+    except TimeoutException:
+        print("等待登录超时，按当前状态保存cookie")
+    print("登录完毕")
+    cookies = driver.get_cookies()
+    save_cookies(cookie_path, cookies)
+    print(cookies)
+
+
+class XiaohongshuSessionPool:
+    """
+    已登录小红书创作者中心的 WebDriver 会话池
+
+    acquire() 借出一个会话（优先复用空闲会话，借出前做健康检查并回到发布页），
+    release() 归还；空闲超时或复用次数过多的会话由后台线程关闭。
+    """
+
+    def __init__(self, max_size=SESSION_POOL_SIZE, idle_timeout=SESSION_IDLE_TIMEOUT, max_uses=SESSION_MAX_USES):
+        self.max_size = max(1, max_size)
+        self.idle_timeout = idle_timeout
+        self.max_uses = max_uses
+        self._idle = []        # [(driver, 归还时间)]
+        self._uses = {}        # id(driver) -> 已使用次数
+        self._size = 0         # 已创建且未关闭的会话数（含借出中的）
+        self._cond = threading.Condition()
+        self._reaper = None
+
+    def _create(self):
+        driver = get_driver()
+        try:
+            xiaohongshu_login(driver, interactive=not CHROME_HEADLESS)
+        except Exception:
+            self._quit(driver)
+            raise
+        return driver
+
+    def _quit(self, driver):
+        self._uses.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            traceback.print_exc()
+
+    def _is_healthy(self, driver):
+        """浏览器仍可响应，且回到发布页后没有被重定向到登录页（cookie 未失效）"""
+        try:
+            driver.get(XIAOHONGSHU_PUBLISH_URL)
+            return "login" not in driver.current_url
+        except Exception as e:
+            print(f"会话不可用，将重新创建: {e}")
+            return False
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("等待可用的浏览器会话超时")
+                    self._cond.wait(remaining)
+                if self._idle:
+                    driver, _ = self._idle.pop()  # 最近归还的会话最“热”
+                else:
+                    driver = None
+                    self._size += 1
+
+            if driver is None:
+                try:
+                    driver = self._create()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                print("新建浏览器会话")
+            elif not self._is_healthy(driver):
+                self._discard(driver)
+                continue
+
+            self._uses[id(driver)] = self._uses.get(id(driver), 0) + 1
+            self._start_reaper()
+            return driver
+
+    def release(self, driver):
+        if self._uses.get(id(driver), 0) >= self.max_uses:
+            self._discard(driver)
+            return
+        with self._cond:
+            self._idle.append((driver, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, driver):
+        self._quit(driver)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def session(self, timeout=None):
+        """with pool.session() as driver: ...  用完自动归还"""
+        driver = self.acquire(timeout)
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def evict_idle(self):
+        """关闭空闲超时的会话，返回关闭数量"""
+        now = time.monotonic()
+        with self._cond:
+            expired = [item for item in self._idle if now - item[1] >= self.idle_timeout]
+            self._idle = [item for item in self._idle if now - item[1] < self.idle_timeout]
+        for driver, _ in expired:
+            self._discard(driver)
+        return len(expired)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for driver, _ in idle:
+            self._discard(driver)
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle), "max_size": self.max_size}
+
+    def _start_reaper(self):
+        if self._reaper is not None or self.idle_timeout <= 0:
+            return
+
+        def reap():
+            while True:
+                time.sleep(max(1.0, self.idle_timeout / 4))
+                try:
+                    self.evict_idle()
+                except Exception:
+                    traceback.print_exc()
+
+        self._reaper = threading.Thread(target=reap, name="xhs-session-reaper", daemon=True)
+        self._reaper.start()
+
+
+_session_pool = None
+_session_pool_lock = threading.Lock()
+
+
+def get_session_pool():
+    """进程内共享的小红书会话池（进程退出时关闭所有浏览器）"""
+    global _session_pool
+    with _session_pool_lock:
+        if _session_pool is None:
+            _session_pool = XiaohongshuSessionPool()
+            atexit.register(_session_pool.close_all)
+    return _session_pool
+
+
+def publish_xiaohongshu(driver, mp4, index, publish_at=None):
+    click_xpath(driver, '//*[text()="发布笔记"]')
     print("开始上传文件", mp4[0])
-    time.sleep(MEDIUM_WAIT)
     # ### 上传视频
-    vidoe = driver.find_element("xpath", '//input[@type="file"]')
+    vidoe = wait_for_xpath(driver, '//input[@type="file"]')
+    get_upload_tracker(driver).begin([mp4[0]])
     vidoe.send_keys(mp4[0])
 
     # 填写标题
     content = mp4[1].replace('.mp4', '')
-    driver.find_element(
-        "xpath", '//*[@placeholder="填写标题，可能会有更多赞哦～"]').send_keys(content)
+    wait_for_xpath(driver, '//*[@placeholder="填写标题，可能会有更多赞哦～"]').send_keys(content)
 
-    time.sleep(FAST_WAIT)
     # 填写描述
-    content_clink = driver.find_element(
-        "xpath", '//*[@placeholder="填写更全面的描述信息，让更多的人看到你吧！"]')
+    content_clink = wait_for_xpath(driver, '//*[@placeholder="填写更全面的描述信息，让更多的人看到你吧！"]')
     content_clink.send_keys(content)
 
-    time.sleep(MEDIUM_WAIT)
     # #虐文推荐 #知乎小说 #知乎文
     for label in ["#虐文","#知乎文","#小说推荐","#知乎小说","#爽文"]:
-        content_clink.send_keys(label)
-        time.sleep(FAST_WAIT)
-        data_indexs = driver.find_elements(
-            "class name", "publish-topic-item")
-        try:
-            for data_index in data_indexs:
-                if(label in data_index.text):
-                    print("点击标签",label)
-                    data_index.click()
-                    break
-        except Exception:
-            traceback.print_exc()
-        time.sleep(FAST_WAIT)
+        select_topic(driver, content_clink, label)
 
     # 定时发布
-    dingshi = driver.find_elements(
-        "xpath", '//*[@class="css-1v54vzp"]')
-    time.sleep(MEDIUM_WAIT)
-    print("点击定时发布")
-    dingshi[3].click()
-    time.sleep(MEDIUM_WAIT)
-    input_data = driver.find_element("xpath", '//*[@placeholder="请选择日期"]')
-    input_data.send_keys(Keys.CONTROL,'a')     #全选
-    input_data.send_keys(get_publish_date(content,index))    
-    time.sleep(MEDIUM_WAIT)
-
-    # 等待视频上传完成 - 使用更快的轮询
-    while True:
-        time.sleep(SLOW_WAIT)
-        try:
-            driver.find_element("xpath",'//*[@id="publish-container"]/div/div[2]/div[2]/div[6]/div/div/div[1]//*[contains(text(),"重新上传")]')
-            break
-        except Exception as e:
-            print("视频还在上传中···")
-    
+    set_schedule(driver, get_publish_date(content, index, publish_at), timeout=WAIT_TIMEOUT, required=True)
+
+    # 等待视频上传完成（表单已在上传期间填好）
+    print("等待视频上传完成···")
+    wait_upload_complete(driver)
     print("视频已上传完成！")
-    time.sleep(MEDIUM_WAIT)
     # 发布
-    driver.find_element("xpath", '//*[text()="发布"]').click()
+    submit_post(driver)
     print("视频发布完成！")
-    time.sleep(SLOW_WAIT)
 
 
-def publish_single_post(driver, file_path, title, content, topics=None, date_offset_hours=24):
+VIDEO_CONTENT_SELECTORS = [
+    '//*[@placeholder="输入正文描述，真诚有价值的分享予人温暖"]',
+    '//div[@class="post-content"]//div[@contenteditable="true"]',
+    '//div[contains(@class, "content")]//textarea',
+]
+IMAGE_CONTENT_SELECTORS = [
+    '//*[@placeholder="输入正文描述，真诚有价值的分享予人温暖"]',
+    '//*[@placeholder="填写更全面的描述信息，让更多的人看到你吧！"]',
+    '//*[@id="post-textarea"]',
+    '//div[@contenteditable="true"]',
+]
+
+
+def remove_non_bmp(text):
+    """Strip non-BMP characters (emojis) that ChromeDriver cannot type."""
+    return ''.join(c for c in text if c <= '\uFFFF')
+
+
+def start_upload(driver, file_path, is_video=True):
     """
-    Refactored function to publish a single post with explicit parameters.
+    打开发布表单并选择文件；上传在页面后台进行，调用方可以先去处理其他笔记
+    图文笔记的多张图片（列表或逗号分隔）通过一次多文件 send_keys 同时选中，返回文件数
     """
-    if topics is None:
-        topics = ["#旅游", "#攻略"]
-
-    time.sleep(MEDIUM_WAIT)
-    driver.find_element("xpath", '//*[text()="发布笔记"]').click()
-    print("开始上传文件", file_path)
-    time.sleep(MEDIUM_WAIT)
-    
-    file_input = driver.find_element("xpath", '//input[@type="file"]')
-    file_input.send_keys(file_path)
-    
-    # Wait for title input field
-    print("Waiting for title input field...")
-    title_selectors = [
-        '//*[@placeholder="填写标题，可能会有更多赞哦～"]',
-        '//input[contains(@placeholder, "标题")]',
-        '//div[contains(@class, "title")]//input'
-    ]
-    
-    title_input = None
-    for xpath in title_selectors:
+    paths = [file_path] if is_video else split_image_paths(file_path)
+    if not paths:
+        raise ValueError("没有可上传的文件")
+    if len(paths) > IMAGE_MAX_COUNT:
+        raise ValueError(f"图文笔记最多 {IMAGE_MAX_COUNT} 张图片，当前 {len(paths)} 张")
+    click_xpath(driver, '//*[text()="发布笔记"]')
+    if not is_video:
+        # Switch to Image Upload tab
         try:
-            title_input = WebDriverWait(driver, 5).until(
-                EC.presence_of_element_located((By.XPATH, xpath))
-            )
-            break
-        except:
-            continue
-            
-    if title_input:
-        title_input.send_keys(title)
-    else:
+            click_xpath(driver, '//*[text()="上传图文"]', timeout=5)
+        except TimeoutException:
+            pass
+    print("开始上传文件", paths)
+    file_input = wait_for_xpath(driver, '//input[@type="file"]')
+    get_upload_tracker(driver).begin(paths)
+    # 多个文件以换行分隔，浏览器一次性选中并并发上传
+    file_input.send_keys("\n".join(paths))
+    return len(paths)
+
+
+def fill_and_submit(driver, title, content, topics=None, date_offset_hours=24, is_video=True, image_count=0):
+    """
+    为已开始上传的笔记填写标题、正文、话题和定时，等待上传完成后发布；image_count 为图文笔记的图片数
+    返回上传吞吐记录（见 UploadTracker.finish）
+    """
+    if not is_video:
+        title = remove_non_bmp(title)
+        content = remove_non_bmp(content)
+
+    # Title input appears once the file is accepted
+    title_input = find_any(driver, TITLE_SELECTORS)
+    if not title_input:
         raise Exception("Could not find title input.")
+    if not is_video:
+        title_input.send_keys(Keys.CONTROL, "a")
+        title_input.send_keys(Keys.DELETE)
+    title_input.send_keys(title)
 
-    time.sleep(FAST_WAIT)
     # Content
-    content_selectors = [
-        '//*[@placeholder="输入正文描述，真诚有价值的分享予人温暖"]',
-        '//div[@class="post-content"]//div[@contenteditable="true"]',
-        '//div[contains(@class, "content")]//textarea'
-    ]
-    
-    content_input = None
-    for xpath in content_selectors:
-        try:
-            content_input = WebDriverWait(driver, 3).until(
-                EC.presence_of_element_located((By.XPATH, xpath))
-            )
-            break
-        except:
-             continue
-    
+    content_selectors = VIDEO_CONTENT_SELECTORS if is_video else IMAGE_CONTENT_SELECTORS
+    content_input = find_any(driver, content_selectors, timeout=10)
     if content_input:
         content_input.send_keys(content)
 
-    time.sleep(MEDIUM_WAIT)
-    
-    # Topics
-    if content_input and topics:
+    # Topics（图文笔记暂不选择话题联想）
+    if is_video and content_input and topics:
         for label in topics:
-            content_input.send_keys(label)
-            time.sleep(FAST_WAIT)
-            try:
-                data_indexs = driver.find_elements("class name", "publish-topic-item")
-                for data_index in data_indexs:
-                    if label in data_index.text:
-                        data_index.click()
-                        break
-            except:
-                pass
-            time.sleep(FAST_WAIT)
+            select_topic(driver, content_input, label)
 
     # Schedule publish
-    dingshi = driver.find_elements("xpath", '//*[@class="css-1v54vzp"]')
-    
-    if len(dingshi) > 3:
-        time.sleep(MEDIUM_WAIT)
-        print("点击定时发布")
-        dingshi[3].click()
-        time.sleep(MEDIUM_WAIT)
-        input_data = driver.find_element("xpath", '//*[@placeholder="请选择日期"]')
-        input_data.send_keys(Keys.CONTROL,'a')
-        
-        from datetime import datetime, timedelta
-        publish_time = (datetime.now() + timedelta(hours=date_offset_hours)).strftime("%Y-%m-%d %H:%M")
-        input_data.send_keys(publish_time)    
-        time.sleep(MEDIUM_WAIT)
-
-    # Wait for upload - faster polling
-    while True:
-        time.sleep(SLOW_WAIT)
-        try:
-            driver.find_element("xpath",'//*[@id="publish-container"]/div/div[2]/div[2]/div[6]/div/div/div[1]//*[contains(text(),"重新上传")]')
-            break
-        except:
-            print("上传中...")
-    
+    from datetime import datetime, timedelta
+    publish_time = (datetime.now() + timedelta(hours=date_offset_hours)).strftime("%Y-%m-%d %H:%M")
+    set_schedule(driver, publish_time)
+
+    # Wait for upload (form was filled while the file uploads)
+    upload_metrics = None
+    if is_video:
+        print("上传中...")
+        upload_metrics = wait_upload_complete(driver)
+    elif image_count:
+        upload_metrics = wait_images_uploaded(driver, image_count)
     print("上传完成！")
-    time.sleep(MEDIUM_WAIT)
-    driver.find_element("xpath", '//*[text()="发布"]').click()
+    submit_post(driver)
+    return upload_metrics
+
+
+def publish_single_post(driver, file_path, title, content, topics=None, date_offset_hours=24):
+    """
+    Refactored function to publish a single post with explicit parameters.
+    """
+    if topics is None:
+        topics = ["#旅游", "#攻略"]
+
+    start_upload(driver, file_path, is_video=True)
+    upload_metrics = fill_and_submit(driver, title, content, topics, date_offset_hours, is_video=True)
     print("发布完成！")
-    time.sleep(SLOW_WAIT)
+    return upload_metrics
 
 
 def publish_image_post(driver, file_path, title, content, topics=None, date_offset_hours=24):
     """
     Publishes an image (or multiple images) as a 'Image/Text' note.
+    file_path: 单张图片路径，或多张图片（列表 / 逗号分隔），全部上传完成后才发布
     """
     if topics is None:
         topics = ["#旅游", "#攻略"]
 
-    time.sleep(MEDIUM_WAIT)
-    driver.find_element("xpath", '//*[text()="发布笔记"]').click()
-    print("开始上传图片")
-    time.sleep(MEDIUM_WAIT)
-    
-    # Switch to Image Upload tab
+    image_count = start_upload(driver, file_path, is_video=False)
+    upload_metrics = fill_and_submit(driver, title, content, topics, date_offset_hours, is_video=False, image_count=image_count)
+    print("图文发布完成！")
+    return upload_metrics
+
+
+def post_offset_hours(post):
+    """
+    笔记距定时发布的小时数：有排期（publish_at，绝对时间）时按填写表单的当前时刻换算，
+    前面笔记的上传、限速等待不会把它推迟；否则使用 date_offset_hours
+    """
+    if post.get("publish_at"):
+        return max(0.0, (post["publish_at"] - time.time()) / 3600)
+    return post.get("date_offset_hours", 24)
+
+
+def publish_posts_pipelined(driver, posts, transcode=None):
+    """
+    在同一个已登录会话中连续发布多篇笔记
+
+    使用两个标签页交替：当前笔记填写表单、等待上传和发布的同时，
+    下一篇笔记已在另一个标签页开始上传。
+    开启视频预处理时，所有视频一开始就按顺序提交到转码进程池，下一条视频的转码与当前视频的上传重叠。
+
+    参数:
+        posts: [{"file_path", "image_paths", "title", "content", "topics", "date_offset_hours", "is_video"}]
+        transcode: 是否先用 ffmpeg 预处理视频（默认取 VIDEO_TRANSCODE）
+
+    返回:
+        与 posts 一一对应的 [{"success": bool, "message": str}]
+    """
+    results = [None] * len(posts)
+    if not posts:
+        return results
+
+    tabs = [driver.current_window_handle]
+    if len(posts) > 1:
+        driver.switch_to.new_window("tab")
+        block_resources(driver)
+        tabs.append(driver.current_window_handle)
+    fresh_tabs = {tabs[0]}  # 会话池借出时已位于发布页，首篇无需再加载
+    upload_counts = {}
+    transcodes = {}
+    if VIDEO_TRANSCODE if transcode is None else transcode:
+        transcodes = {i: submit_transcode(post["file_path"]) for i, post in enumerate(posts) if post.get("is_video")}
+
+    def start(index):
+        handle = tabs[index % len(tabs)]
+        driver.switch_to.window(handle)
+        if handle not in fresh_tabs:
+            driver.get(XIAOHONGSHU_PUBLISH_URL)  # 上一篇发布后页面已跳走，重新打开干净的表单
+            wait_page_ready(driver)
+        fresh_tabs.discard(handle)
+        post = posts[index]
+        file_path = transcodes[index].result() if index in transcodes else post.get("image_paths") or post["file_path"]
+        upload_counts[index] = start_upload(driver, file_path, is_video=post.get("is_video", False))
+
     try:
-        image_tab = WebDriverWait(driver, 5).until(
-            EC.element_to_be_clickable((By.XPATH, '//*[text()="上传图文"]'))
-        )
-        image_tab.click()
-        time.sleep(FAST_WAIT)
-    except:
-        try:
-             driver.execute_script("arguments[0].click();", driver.find_element(By.XPATH, '//*[text()="上传图文"]'))
-        except:
-             pass
-
-    # Upload
-    file_input = driver.find_element("xpath", '//input[@type="file"]')
-    file_input.send_keys(file_path)
-    
-    # Helper to strip non-BMP characters (emojis)
-    def remove_non_bmp(text):
-        return ''.join(c for c in text if c <= '\uFFFF')
-
-    title = remove_non_bmp(title)
-    content = remove_non_bmp(content)
-
-    # Wait for title input
-    title_selectors = [
-        '//*[@placeholder="填写标题，可能会有更多赞哦～"]',
-        '//input[contains(@placeholder, "标题")]',
-        '//div[contains(@class, "title")]//input'
-    ]
-    
-    title_input = None
-    for xpath in title_selectors:
+        start_errors = {}
         try:
-            title_input = WebDriverWait(driver, 5).until(
-                EC.presence_of_element_located((By.XPATH, xpath))
-            )
-            break
-        except:
+            start(0)
+        except Exception as e:
+            start_errors[0] = e
+
+        for index, post in enumerate(posts):
+            # 先让下一篇在另一个标签页开始上传，再回来完成当前这篇
+            if index + 1 < len(posts):
+                try:
+                    start(index + 1)
+                except Exception as e:
+                    traceback.print_exc()
+                    start_errors[index + 1] = e
+
+            if index in start_errors:
+                results[index] = {"success": False, "message": f"上传失败: {start_errors[index]}"}
+                continue
+
+            driver.switch_to.window(tabs[index % len(tabs)])
+            try:
+                upload_metrics = fill_and_submit(
+                    driver,
+                    post["title"],
+                    post["content"],
+                    post.get("topics"),
+                    post_offset_hours(post),
+                    is_video=post.get("is_video", False),
+                    image_count=0 if post.get("is_video", False) else upload_counts[index],
+                )
+                results[index] = {"success": True, "message": "发布成功", "upload": upload_metrics}
+                print(f"[{index + 1}/{len(posts)}] 发布完成: {post['title']}")
+            except Exception as e:
+                traceback.print_exc()
+                results[index] = {"success": False, "message": f"发布失败: {e}"}
+    finally:
+        for handle in tabs[1:]:
+            try:
+                driver.switch_to.window(handle)
+                driver.close()
+            except Exception:
+                traceback.print_exc()
+        driver.switch_to.window(tabs[0])
+
+    return results
+
+
+def account_cookie_path(account=DEFAULT_ACCOUNT):
+    """账号的 cookie 文件；default 账号沿用原来的 xiaohongshu.json"""
+    if account == DEFAULT_ACCOUNT:
+        return XIAOHONGSHU_COOKING
+    if not re.fullmatch(r"[\w\-]+", account):
+        raise ValueError(f"账号名只能包含字母、数字、下划线和横线: {account}")
+    return os.path.join(XIAOHONGSHU_ACCOUNTS_PATH, f"{account}.json")
+
+
+def account_profile_dir(account=DEFAULT_ACCOUNT):
+    account_cookie_path(account)  # 校验账号名
+    return os.path.join(PROFILES_PATH, "xiaohongshu", account)
+
+
+def list_accounts():
+    """已保存登录 cookie 的账号列表"""
+    accounts = [DEFAULT_ACCOUNT] if os.path.exists(XIAOHONGSHU_COOKING) else []
+    if os.path.isdir(XIAOHONGSHU_ACCOUNTS_PATH):
+        accounts += sorted(name[:-len(".json")] for name in os.listdir(XIAOHONGSHU_ACCOUNTS_PATH) if name.endswith(".json"))
+    return accounts
+
+
+def account_login_error(account, headless=True):
+    """
+    发布前校验账号：账号名不合法，或无头模式下 cookie 不存在/HTTP 探测已失效时返回错误信息，否则返回 None
+    （无头进程无法扫码，不必为这些账号启动浏览器；有界面时由工作进程进入扫码登录）
+    """
+    try:
+        cookie_path = account_cookie_path(account)
+    except ValueError as e:
+        return str(e)
+    if headless and check_cookie_session(cookie_path, XIAOHONGSHU_SESSION_PROBE_URL) is False:
+        return f"账号 {account} 登录已失效，请先执行 --login {account}"
+    return None
+
+
+def account_platform(account):
+    """发布队列中按账号区分的平台名，每个账号的限速与进度互不影响"""
+    return f"xiaohongshu:{account}"
+
+
+def _publish_account_worker(account, db_path, max_per_hour, min_interval, headless=True):
+    """在独立子进程中运行：为一个账号启动隔离的浏览器，登录一次后依次发布该账号队列中的笔记"""
+    from .publish_queue import PublishQueue
+
+    queue = PublishQueue(db_path)
+    driver = get_driver(user_data_dir=account_profile_dir(account), headless=headless)
+    try:
+        xiaohongshu_login(driver, cookie_path=account_cookie_path(account), interactive=not headless)
+
+        def handle(item):
+            post = item.payload
+            driver.get(XIAOHONGSHU_PUBLISH_URL)
+            wait_page_ready(driver)
+            publish = publish_single_post if post.get("is_video") else publish_image_post
+            file_path = prepare_video(item.file_path) if post.get("is_video") else post.get("image_paths") or item.file_path
+            offset_hours = post_offset_hours(post)
+            publish(driver, file_path, post["title"], post["content"], post.get("topics"), offset_hours)
+            return offset_hours > 0
+
+        return queue.drain(account_platform(account), handle, pace_seconds=min_interval, max_per_hour=max_per_hour)
+    finally:
+        queue.close()
+        driver.quit()
+
+
+def publish_multi_account(posts_by_account, max_per_hour=ACCOUNT_MAX_PER_HOUR, min_interval=ACCOUNT_MIN_INTERVAL, headless=True):
+    """
+    多账号并行发布：每个账号一个工作进程（独立浏览器配置与 cookie），账号内串行并限速
+
+    参数:
+        posts_by_account: {账号: [{"file_path", "image_paths", "title", "content", "topics", "date_offset_hours", "is_video"}]}
+        max_per_hour: 单账号每小时最多发布条数
+        min_interval: 单账号两次发布之间的最小间隔（秒）
+        headless: 工作进程使用无头精简浏览器（账号需已有 cookie）
+
+    返回:
+        {账号: 该账号队列的状态统计，或 {"error": 错误信息}}；
+        每个 post 字典会被补充 "state"（published/scheduled/failed/pending/needs_check）与 "error"
+    """
+    from .publish_queue import PublishQueue
+
+    # 先校验账号，登录失效的账号不入队：否则它们的笔记会带着过期排期留在 pending，之后某次发布时意外发出
+    results = {}
+    accounts = []
+    for account, posts in posts_by_account.items():
+        if not posts:
             continue
-            
-    if title_input:
-        title_input.send_keys(Keys.CONTROL, "a")
-        title_input.send_keys(Keys.DELETE)
-        title_input.send_keys(title)
-    else:
-        raise Exception("Could not find title input.")
+        error = account_login_error(account, headless)
+        if error:
+            results[account] = {"error": error}
+            for post in posts:
+                post["state"], post["error"] = None, error
+            continue
+        accounts.append(account)
 
-    time.sleep(FAST_WAIT)
-    
-    # Content
-    content_selectors = [
-        '//*[@placeholder="输入正文描述，真诚有价值的分享予人温暖"]',
-        '//*[@placeholder="填写更全面的描述信息，让更多的人看到你吧！"]',
-        '//*[@id="post-textarea"]',
-        '//div[@contenteditable="true"]'
-    ]
-    
-    content_input = None
-    for xpath in content_selectors:
-        try:
-            content_input = WebDriverWait(driver, 3).until(
-                EC.presence_of_element_located((By.XPATH, xpath))
-            )
-            break
-        except:
-             continue
-    
-    if content_input:
-        content_input.send_keys(content)
+    queue = PublishQueue(PUBLISH_QUEUE_DB)
+    keys = []
+    try:
+        for account in accounts:
+            platform = account_platform(account)
+            queue.recover(platform)
+            for post in posts_by_account[account]:
+                # 重新提交的批次里，之前失败（已放弃）的笔记重新排队
+                keys.append((account, post, queue.enqueue(
+                    platform, post["file_path"], post, image_paths=post.get("image_paths"), retry_failed=True,
+                )))
+    finally:
+        queue.close()
+
+    if accounts:
+        with ProcessPoolExecutor(max_workers=len(accounts)) as pool:
+            futures = {
+                account: pool.submit(_publish_account_worker, account, PUBLISH_QUEUE_DB, max_per_hour, min_interval, headless)
+                for account in accounts
+            }
+            for account, future in futures.items():
+                try:
+                    results[account] = future.result()
+                except Exception as e:
+                    traceback.print_exc()
+                    results[account] = {"error": str(e)}
+
+    queue = PublishQueue(PUBLISH_QUEUE_DB)
+    try:
+        for account, post, key in keys:
+            item = queue.get(key) or {}
+            post["state"] = item.get("state")
+            # 工作进程整体失败（如登录、启动浏览器出错）时，条目本身没有错误记录，使用账号级错误
+            post["error"] = item.get("last_error") or results[account].get("error")
+    finally:
+        queue.close()
+    return results
 
-    time.sleep(MEDIUM_WAIT)
-    
-    # Topics
-    # if content_input and topics:
-    #     for label in topics:
-    #         label = remove_non_bmp(label)
-    #         content_input.send_keys(label)
-    #         time.sleep(FAST_WAIT)
-    #         try:
-    #             data_indexs = driver.find_elements("class name", "publish-topic-item")
-    #             for data_index in data_indexs:
-    #                 if label in data_index.text:
-    #                     data_index.click()
-    #                     break
-    #         except:
-    #             pass
-    #         time.sleep(FAST_WAIT)
 
-    # Schedule publish
-    dingshi = driver.find_elements("xpath", '//*[@class="css-1v54vzp"]')
-    
-    if len(dingshi) > 3:
-        time.sleep(MEDIUM_WAIT)
-        print("点击定时发布")
-        dingshi[3].click()
-        time.sleep(MEDIUM_WAIT)
-        input_data = driver.find_element("xpath", '//*[@placeholder="请选择日期"]')
-        input_data.send_keys(Keys.CONTROL,'a')
-        
-        from datetime import datetime, timedelta
-        publish_time = (datetime.now() + timedelta(hours=date_offset_hours)).strftime("%Y-%m-%d %H:%M")
-        input_data.send_keys(publish_time)    
-        time.sleep(MEDIUM_WAIT)
-    
-    print("上传完成！")
-    time.sleep(MEDIUM_WAIT)
-    driver.find_element("xpath", '//*[text()="发布"]').click()
-    print("图文发布完成！")
-    time.sleep(SLOW_WAIT)
+def login_account(account):
+    """首次为账号手动扫码登录并保存 cookie（使用该账号的独立浏览器配置，需要有界面的窗口）"""
+    driver = get_driver(user_data_dir=account_profile_dir(account), headless=False, network_log=False)
+    try:
+        xiaohongshu_login(driver, cookie_path=account_cookie_path(account))
+    finally:
+        driver.quit()
 
 
 def run(driver):
-    xiaohongshu_login(driver=driver)
-    mp4s = get_map4()
-    for index, mp4 in enumerate(mp4s):
-        publish_xiaohongshu(driver, mp4, index)
-        time.sleep(10)
+    from .publish_queue import PublishQueue
+    from .publish_scheduler import ensure_publish_at
 
-if __name__ == "__main__":
+    queue = PublishQueue(PUBLISH_QUEUE_DB)
     try:
-        driver = get_driver()
         xiaohongshu_login(driver=driver)
-        mp4s = get_map4()
-        for index, mp4 in enumerate(mp4s):
-            publish_xiaohongshu(driver, mp4, index)
-            time.sleep(10)
+        queue.recover("xiaohongshu")
+        enqueue_map4(queue, "xiaohongshu")
+
+        def handle(item):
+            publish_at = ensure_publish_at(queue, item, "xiaohongshu")
+            publish_xiaohongshu(driver, (item.file_path, item.payload["name"]), item.payload["index"], publish_at)
+            return True  # publish_xiaohongshu 总是定时发布
+
+        stats = queue.drain("xiaohongshu", handle, pace_seconds=10)
+        print("发布队列状态:", stats)
     finally:
-        driver.quit()
+        queue.close()
+
+if __name__ == "__main__":
+    import sys
+
+    if "--login" in sys.argv:
+        # python -m middleware.upload_utils --login 账号名
+        login_account(sys.argv[sys.argv.index("--login") + 1])
+    else:
+        try:
+            driver = get_driver()
+            run(driver)
+        finally:
+            driver.quit()
@@ -0,0 +1,188 @@
+"""
+发布前的视频预处理（本地 ffmpeg）
+把分辨率、码率限制在平台上限以内，并以 faststart（moov 前置）重新封装，缩小需要上传的体积；
+已经符合要求的视频只做无损重封装。转码在进程池中提前进行，与浏览器上传上一条视频重叠。
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+VIDEO_TRANSCODE = os.getenv("VIDEO_TRANSCODE", "0") == "1"  # 默认关闭，本机装有 ffmpeg 时设为 1
+FFMPEG_PATH = os.getenv("FFMPEG_PATH") or shutil.which("ffmpeg")
+FFPROBE_PATH = os.getenv("FFPROBE_PATH") or shutil.which("ffprobe")
+VIDEO_MAX_LONG_SIDE = int(os.getenv("VIDEO_MAX_LONG_SIDE", "1920"))
+VIDEO_MAX_SHORT_SIDE = int(os.getenv("VIDEO_MAX_SHORT_SIDE", "1080"))
+VIDEO_MAX_BITRATE_KBPS = int(os.getenv("VIDEO_MAX_BITRATE_KBPS", "6000"))
+VIDEO_AUDIO_BITRATE_KBPS = int(os.getenv("VIDEO_AUDIO_BITRATE_KBPS", "128"))
+VIDEO_TRANSCODE_PRESET = os.getenv("VIDEO_TRANSCODE_PRESET", "veryfast")
+VIDEO_TRANSCODE_WORKERS = int(os.getenv("VIDEO_TRANSCODE_WORKERS", "1"))  # ffmpeg 自身多线程，1 个进程即可与上传重叠
+TRANSCODE_PATH = os.path.join(
+    os.getenv("ROOT_PATH", os.path.join(os.getcwd(), "data_storage")), "transcoded"
+)
+TRANSCODE_CACHE_MAX_BYTES = int(float(os.getenv("TRANSCODE_CACHE_MAX_MB", "4096")) * 1024 * 1024)  # transcoded 目录容量上限
+
+_transcode_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_transcode_pool() -> ProcessPoolExecutor:
+    global _transcode_pool
+    if _transcode_pool is None:
+        _transcode_pool = ProcessPoolExecutor(max_workers=VIDEO_TRANSCODE_WORKERS)
+    return _transcode_pool
+
+
+def probe_video(path: str) -> Dict[str, Any]:
+    """ffprobe 读取首个视频流/音频流的编码、分辨率和整体码率（kbps）"""
+    output = subprocess.run(
+        [FFPROBE_PATH, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    info = json.loads(output)
+    video = next((s for s in info.get("streams", []) if s.get("codec_type") == "video"), {})
+    audio = next((s for s in info.get("streams", []) if s.get("codec_type") == "audio"), {})
+    bit_rate = info.get("format", {}).get("bit_rate") or video.get("bit_rate") or 0
+    return {
+        "width": int(video.get("width") or 0),
+        "height": int(video.get("height") or 0),
+        "video_codec": video.get("codec_name"),
+        "audio_codec": audio.get("codec_name"),
+        "bitrate_kbps": int(bit_rate) // 1000,
+    }
+
+
+def _target_size(width: int, height: int):
+    """按横竖屏取上限框（长边/短边），等比缩小到框内，宽高取偶数；不需要缩小时返回 None"""
+    if not width or not height:
+        return None
+    max_w, max_h = (
+        (VIDEO_MAX_LONG_SIDE, VIDEO_MAX_SHORT_SIDE) if width >= height else (VIDEO_MAX_SHORT_SIDE, VIDEO_MAX_LONG_SIDE)
+    )
+    scale = min(max_w / width, max_h / height)
+    if scale >= 1:
+        return None
+    return int(width * scale) // 2 * 2, int(height * scale) // 2 * 2
+
+
+def transcoded_path(src: str) -> str:
+    """输出文件名包含源文件大小和修改时间，源文件变化后自动重新转码"""
+    stat = os.stat(src)
+    stem = os.path.splitext(os.path.basename(src))[0]
+    return os.path.join(TRANSCODE_PATH, f"{stem}.{stat.st_size:x}-{int(stat.st_mtime):x}.publish.mp4")
+
+
+def evict_transcoded(max_bytes: int = TRANSCODE_CACHE_MAX_BYTES, keep: Optional[str] = None) -> List[str]:
+    """按最近使用时间（mtime）淘汰 transcoded 下的旧文件（含“使用原文件”标记），使总大小不超过上限"""
+    if not os.path.isdir(TRANSCODE_PATH):
+        return []
+
+    entries = []
+    total = 0
+    for name in os.listdir(TRANSCODE_PATH):
+        if not name.endswith((".publish.mp4", ".publish.mp4.orig")):
+            continue
+        path = os.path.join(TRANSCODE_PATH, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    removed = []
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed.append(path)
+    return removed
+
+
+def transcode_video(src: str) -> str:
+    """
+    生成适合上传的视频并返回其路径（在进程池中运行）
+    超出分辨率/码率上限或编码不是 H.264/AAC 时用 libx264 重新编码（限制最大码率），
+    否则只做 -c copy 重封装；两种情况都加 +faststart。ffmpeg 不可用、失败或结果不比原文件小时返回原文件
+    """
+    if not FFMPEG_PATH or not FFPROBE_PATH:
+        print("未找到 ffmpeg/ffprobe，跳过视频预处理", file=sys.stderr)
+        return src
+    dest = transcoded_path(src)
+    marker = dest + ".orig"  # 空文件：上次处理结果不比原文件小，直接上传原文件
+    for cached in (dest, marker):
+        if os.path.exists(cached):
+            os.utime(cached)  # 刷新最近使用时间，用于 LRU 淘汰
+            return dest if cached == dest else src
+    os.makedirs(TRANSCODE_PATH, exist_ok=True)
+
+    try:
+        info = probe_video(src)
+    except (subprocess.CalledProcessError, ValueError) as e:
+        print(f"读取视频信息失败，跳过预处理: {src}: {e}", file=sys.stderr)
+        return src
+
+    size = _target_size(info["width"], info["height"])
+    needs_encode = (
+        size is not None
+        or info["bitrate_kbps"] > VIDEO_MAX_BITRATE_KBPS
+        or info["video_codec"] != "h264"
+        or info["audio_codec"] not in (None, "aac")
+    )
+    cmd = [FFMPEG_PATH, "-y", "-v", "error", "-i", src]
+    if needs_encode:
+        if size:
+            cmd += ["-vf", f"scale={size[0]}:{size[1]}"]
+        cmd += [
+            "-c:v", "libx264", "-preset", VIDEO_TRANSCODE_PRESET, "-crf", "23",
+            "-maxrate", f"{VIDEO_MAX_BITRATE_KBPS}k", "-bufsize", f"{VIDEO_MAX_BITRATE_KBPS * 2}k",
+            "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", f"{VIDEO_AUDIO_BITRATE_KBPS}k",
+        ]
+    else:
+        cmd += ["-c", "copy"]
+    part_path = dest + ".part.mp4"
+    cmd += ["-movflags", "+faststart", part_path]
+
+    try:
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        print(f"视频预处理失败，上传原文件: {src}: {e.stderr.strip()[-500:]}", file=sys.stderr)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return src
+    os.replace(part_path, dest)
+    src_bytes, dest_bytes = os.path.getsize(src), os.path.getsize(dest)
+    print(
+        f"视频预处理完成（{'转码' if needs_encode else '重封装'}）: "
+        f"{src_bytes / 1024 / 1024:.1f}MB → {dest_bytes / 1024 / 1024:.1f}MB",
+        file=sys.stderr,
+    )
+    if dest_bytes >= src_bytes:
+        print("预处理后不比原文件小，上传原文件", file=sys.stderr)
+        os.remove(dest)
+        open(marker, "w").close()
+        dest = src
+    evict_transcoded(keep=dest)
+    return dest
+
+
+def submit_transcode(src: str) -> Future:
+    """提交到转码进程池，立即返回 Future（结果为待上传的文件路径）"""
+    return get_transcode_pool().submit(transcode_video, src)
+
+
+def prepare_video(src: str) -> str:
+    """同步版本：开启 VIDEO_TRANSCODE 时返回预处理后的路径，否则原样返回"""
+    if not VIDEO_TRANSCODE:
+        return src
+    return submit_transcode(src).result()
@@ -17,11 +17,40 @@ import json
 import os
 import shutil
 from selenium.webdriver.chromium.remote_connection import ChromiumRemoteConnection
+import httpx
 
 ROOT_PATH = os.getenv("ROOT_PATH", os.path.join(os.getcwd(), "data_storage"))
 VIDEO_PATH = os.path.join(ROOT_PATH, "output")
 COOKING_PATH = os.path.join(ROOT_PATH, "cookies")
 COOKING_TXT = os.path.join(COOKING_PATH, "douyin.txt")
+DOUYIN_ORIGIN = "https://creator.douyin.com"
+DOUYIN_SESSION_PROBE_URL = os.getenv("DOUYIN_SESSION_PROBE_URL", "https://creator.douyin.com/web/api/media/user/info/")
+SESSION_CHECK_TTL = float(os.getenv("SESSION_CHECK_TTL", "600"))  # 会话探测结果在元数据中的有效期（秒）
+SESSION_PROBE_TIMEOUT = float(os.getenv("SESSION_PROBE_TIMEOUT", "5"))
+PUBLISH_QUEUE_DB = os.path.join(ROOT_PATH, "publish_queue.db")  # 持久化发布队列，崩溃重启后从断点继续
+PROFILES_PATH = os.path.join(ROOT_PATH, "profiles")  # 每个账号独立的 Chrome 配置目录
+CHROME_CACHE_PATH = os.path.join(ROOT_PATH, "chrome_cache")  # 所有浏览器共享的磁盘缓存
+
+# 无头发布模式（服务器上运行发布进程时设置 CHROME_HEADLESS=1）
+CHROME_HEADLESS = os.getenv("CHROME_HEADLESS", "0") == "1"
+CHROME_WINDOW_SIZE = os.getenv("CHROME_WINDOW_SIZE", "1920,1080")  # 固定视口，代替 maximize_window
+# 发布页面用不到的资源：远程字体和音视频（本地上传的预览走 blob:，不受影响）
+BLOCKED_URL_PATTERNS = ["*.woff", "*.woff2", "*.ttf", "*.otf", "*.mp3", "*.m4a", "*.mp4", "*.webm"]
+HEADLESS_ARGS = [
+    '--headless=new',
+    '--disable-gpu',
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-background-timer-throttling',  # 流水线发布时后台标签页的上传进度仍需及时更新
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--disable-features=Translate,MediaRouter,OptimizationHints,AutofillServerCommunication',
+    '--mute-audio',
+    '--no-first-run',
+    '--hide-scrollbars',
+    '--autoplay-policy=user-gesture-required',
+]
 
 os.makedirs(COOKING_PATH, exist_ok=True)
 os.makedirs(VIDEO_PATH, exist_ok=True)
@@ -30,8 +59,28 @@ agent = 'Mozilla/5.0 (Macintosh; Linux) AppleWebKit/537.36 (KHTML, like Gecko) C
 isDingShi = os.getenv("IS_DINGSHI", True)
 
 
-def get_driver():
+def get_driver(user_data_dir=None, headless=None, network_log=True):
+    """
+    启动 Chrome
+    user_data_dir: 独立的浏览器配置目录（多账号互相隔离）
+    headless: 无头精简模式（默认取 CHROME_HEADLESS）：无 GPU/扩展/后台服务，固定视口，共享磁盘缓存，屏蔽字体和音视频
+    network_log: 记录 CDP Network 事件供上传跟踪读取；不读取日志的流程应关闭，避免日志在 chromedriver 中堆积
+    """
+    if headless is None:
+        headless = CHROME_HEADLESS
     chrome_options = webdriver.ChromeOptions()
+    if headless:
+        for arg in HEADLESS_ARGS:
+            chrome_options.add_argument(arg)
+        chrome_options.add_argument(f'--window-size={CHROME_WINDOW_SIZE}')
+        chrome_options.add_argument(f'--disk-cache-dir={CHROME_CACHE_PATH}')
+    if user_data_dir:
+        os.makedirs(user_data_dir, exist_ok=True)
+        chrome_options.add_argument(f'--user-data-dir={user_data_dir}')
+    if network_log:
+        # 记录 CDP Network 事件，供上传进度跟踪读取（driver.get_log("performance")）
+        chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+        chrome_options.add_experimental_option('perfLoggingPrefs', {'enableNetwork': True, 'enablePage': False})
     chrome_options.add_argument('--no-sandbox')  # 解决DevToolsActivePort文件不存在的报错
     chrome_options.add_argument('--disable-dev-shm-usage')
     chrome_options.add_experimental_option(
@@ -54,7 +103,11 @@ def get_driver():
     else:
         # Fallback to Selenium Manager (Selenium 4.6+) to resolve driver automatically.
         driver = webdriver.Chrome(options=chrome_options)
-    driver.maximize_window()
+    if headless:
+        driver.blocked_url_patterns = BLOCKED_URL_PATTERNS
+        block_resources(driver)
+    else:
+        driver.maximize_window()
     # driver = webdriver.Remote(
     #   command_executor= ChromiumRemoteConnection(remote_server_addr='http://101.43.210.78:50000',vendor_prefix='-webkit-',browser_name="CHROME"),
     #   desired_capabilities=chrome_options.to_capabilities()
@@ -69,6 +122,66 @@ def get_driver():
     return driver
 
 
+def block_resources(driver):
+    """
+    对当前标签页屏蔽字体和音视频（仅无头模式的浏览器）
+    CDP 的 setBlockedURLs 只作用于当前标签页，新开的标签页切换过去后需要再调用一次
+    """
+    patterns = getattr(driver, "blocked_url_patterns", None)
+    if not patterns:
+        return
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+    except Exception as e:
+        print("屏蔽资源失败:", e)
+
+
+def browser_memory_mb(driver):
+    """浏览器进程树（chromedriver + Chrome 全部子进程）占用的内存（MB），优先用 USS 避免共享页重复计算"""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    root = psutil.Process(driver.service.process.pid)
+    total = 0
+    for proc in [root] + root.children(recursive=True):
+        try:
+            try:
+                total += proc.memory_full_info().uss
+            except psutil.AccessDenied:
+                total += proc.memory_info().rss
+        except psutil.NoSuchProcess:
+            continue
+    return total / 1024 / 1024
+
+
+def benchmark_driver(rounds=3, url="https://creator.xiaohongshu.com/publish/publish"):
+    """对比窗口模式与无头精简模式：启动耗时、页面加载耗时、内存占用"""
+    results = {}
+    for mode, headless in (("windowed", False), ("headless", True)):
+        startups, loads, memories = [], [], []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            driver = get_driver(headless=headless, network_log=False)
+            startups.append(time.perf_counter() - start)
+            try:
+                start = time.perf_counter()
+                driver.get(url)
+                loads.append(time.perf_counter() - start)
+                memory = browser_memory_mb(driver)
+                if memory is not None:
+                    memories.append(memory)
+            finally:
+                driver.quit()
+        results[mode] = {
+            "startup_seconds": sum(startups) / len(startups),
+            "load_seconds": sum(loads) / len(loads),
+            "memory_mb": sum(memories) / len(memories) if memories else None,
+        }
+    return results
+
+
 def wait_login(driver):
     driver.get("https://creator.douyin.com/")
     time.sleep(2)
@@ -100,12 +213,12 @@ def wait_login(driver):
     # 读取cook
     cook = driver.get_cookies()
     # 保存cook，我是写到txt文件的，后期可以写成http的，收集大量的，然后就可以*****（你懂的）***
-    with open(COOKING_TXT, 'w') as f:
-        f.write(json.dumps(cook, ensure_ascii=True))  # 格式转化，这不管你是学的那种语言都必须要知道的
+    save_cookies(COOKING_TXT, cook)
 
 
 def login(driver):
-    if os.path.exists(COOKING_TXT):
+    # 探测不可用（None）时仍按原流程加载 cookie
+    if check_cookie_session(COOKING_TXT, DOUYIN_SESSION_PROBE_URL) is not False:
         get_cookie(driver)
     else:
         try:
@@ -153,53 +266,162 @@ def get_map4():
 
 
 def get_cookie(driver):
-    with open(COOKING_TXT) as f:
-        data = json.loads(f.read())
-    # 打开浏览器
-    time.sleep(2)
-    # 打开网址
+    data = load_cookies(COOKING_TXT)
+    print("加载cookie")
+    inject_cookies(driver, data, DOUYIN_ORIGIN)
+    # cookie 已在打开页面前写入，首次加载即为登录状态，无需刷新
     driver.get("https://creator.douyin.com/creator-micro/home")
     driver.implicitly_wait(10)
-    # 清楚cook
-    driver.delete_all_cookies()
-    time.sleep(8)
-    # 遍历cook
-    print("加载cookie")
-    for cookie in data:
-        if 'expiry' in cookie:
-            del cookie["expiry"]
-        # 添加cook
+
+
+def cookie_meta_path(cookie_path):
+    """cookie 新鲜度元数据与 cookie 文件放在一起：<cookie 文件>.meta.json"""
+    return cookie_path + ".meta.json"
+
+
+def load_cookie_meta(cookie_path):
+    try:
+        with open(cookie_meta_path(cookie_path)) as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cookie_meta(cookie_path, **fields):
+    meta = load_cookie_meta(cookie_path)
+    meta.update(fields)
+    tmp_path = cookie_meta_path(cookie_path) + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(meta))
+    os.replace(tmp_path, cookie_meta_path(cookie_path))
+
+
+def load_cookies(cookie_path):
+    """读取 cookie 文件，丢弃已过期的条目"""
+    with open(cookie_path) as f:
+        cookies = json.loads(f.read())
+    now = time.time()
+    return [cookie for cookie in cookies if not cookie.get("expiry") or cookie["expiry"] > now]
+
+
+def save_cookies(cookie_path, cookies):
+    """保存登录后的 cookie，并记录保存时间、最晚过期时间（此后整个会话必然失效）"""
+    os.makedirs(os.path.dirname(cookie_path), exist_ok=True)
+    with open(cookie_path, "w") as f:
+        f.write(json.dumps(cookies, ensure_ascii=True))
+    now = time.time()
+    expiries = [cookie["expiry"] for cookie in cookies if cookie.get("expiry")]
+    save_cookie_meta(cookie_path, saved_at=now, validated_at=now, valid=True,
+                     expires_at=max(expiries) if expiries else None)
+
+
+def probe_cookie_session(cookies, probe_url, timeout=SESSION_PROBE_TIMEOUT):
+    """
+    不启动浏览器，带着 cookie 直接请求一个需要登录的轻量接口
+    返回 True（已登录）/ False（未登录或已过期）/ None（网络异常或响应无法判断）
+    """
+    jar = {cookie["name"]: cookie["value"] for cookie in cookies}
+    try:
+        resp = httpx.get(probe_url, cookies=jar, headers={"User-Agent": agent},
+                         timeout=timeout, follow_redirects=True)
+    except httpx.HTTPError as e:
+        print("会话探测失败:", e)
+        return None
+    if resp.status_code in (401, 403) or "login" in str(resp.url):
+        return False
+    if resp.status_code != 200:
+        return None
+    try:
+        body = resp.json()
+    except ValueError:
+        return None
+    if not isinstance(body, dict):
+        return None
+    if "success" in body:
+        return bool(body["success"])
+    for key in ("code", "status_code"):
+        if key in body:
+            return body[key] == 0
+    return None
+
+
+def check_cookie_session(cookie_path, probe_url, ttl=SESSION_CHECK_TTL):
+    """
+    判断保存的 cookie 是否仍有效：ttl 秒内验证过的直接采信元数据，否则 HTTP 探测一次并写回元数据
+    返回 True / False / None（无法探测，由调用方在浏览器里确认）
+    """
+    if not os.path.exists(cookie_path):
+        return False
+    meta = load_cookie_meta(cookie_path)
+    now = time.time()
+    if meta.get("expires_at") and meta["expires_at"] <= now:
+        return False
+    if "valid" in meta and now - meta.get("validated_at", 0) < ttl:
+        return meta["valid"]
+    cookies = load_cookies(cookie_path)
+    if not cookies:
+        return False
+    valid = probe_cookie_session(cookies, probe_url)
+    if valid is not None:
+        save_cookie_meta(cookie_path, validated_at=now, valid=valid)
+    return valid
+
+
+def inject_cookies(driver, cookies, origin):
+    """
+    把 cookie 写入浏览器：优先用 CDP Network.setCookies，不需要先打开页面；
+    不支持 CDP 时退回到打开站点的轻量资源后逐个 add_cookie
+    """
+    params = []
+    for cookie in cookies:
+        param = {
+            "name": cookie["name"],
+            "value": cookie["value"],
+            "path": cookie.get("path", "/"),
+            "secure": cookie.get("secure", False),
+            "httpOnly": cookie.get("httpOnly", False),
+        }
+        if cookie.get("domain"):
+            param["domain"] = cookie["domain"]
+        else:
+            param["url"] = origin
+        if cookie.get("sameSite") in ("Strict", "Lax", "None"):
+            param["sameSite"] = cookie["sameSite"]
+        if cookie.get("expiry"):
+            param["expires"] = cookie["expiry"]
+        params.append(param)
+    try:
+        driver.execute_cdp_cmd("Network.setCookies", {"cookies": params})
+        return
+    except Exception as e:
+        print("CDP 写入cookie失败，改用 add_cookie:", e)
+    driver.get(origin + "/favicon.ico")
+    for cookie in cookies:
+        cookie = dict(cookie)
+        cookie.pop("expiry", None)
         driver.add_cookie(cookie)
-    time.sleep(5)
-    # 刷新
-    print("开始刷新")
-    driver.refresh()
-
-
-def get_publish_date(title, index):
-    # 代表的是 加一天时间
-    time_long = int(index/3) * 24
-    now = datetime.datetime.today()
-    if(now.hour > 20):
-        time_long = 24
-    tomorrowemp = now + datetime.timedelta(hours=time_long)
-    print("title:", title)
-    # 暂时注释掉+ datetime.timedelta(hours = 24)
-    if title.find("(1)") > 0 or title.find("(4)") > 0 or title.find("(7)") > 0:
-        tomorrow = tomorrowemp.replace(hour=8, minute=0, second=0)
-    elif title.find("(2)") > 0 or title.find("(5)") > 0:
-        tomorrow = tomorrowemp.replace(hour=12, minute=0, second=0)
-    elif title.find("(3)") > 0 or title.find("(6)") > 0:
-        tomorrow = tomorrowemp.replace(hour=18, minute=0, second=0)
-    print("准备写入的时间是:", tomorrow)
-    if(tomorrow <= now):
-        tomorrow = now + \
-            datetime.timedelta(hours=2) + datetime.timedelta(hours=1*index)
-    print("输出的时间是:", tomorrow.strftime("%Y-%m-%d %H:%M"))
+
+
+def get_publish_date(title, index, publish_at=None):
+    """
+    定时发布时间（"%Y-%m-%d %H:%M"）
+    publish_at: 调度器为该条目分配的时间戳（队列发布时由 ensure_publish_at 保证仍然有效）；
+    不经过队列单独调用、没有排期时，取默认发布窗口内最早的时段
+    """
+    try:
+        from .publish_scheduler import SlotScheduler
+    except ImportError:  # 作为脚本直接运行时
+        from publish_scheduler import SlotScheduler
+
+    if publish_at:
+        tomorrow = datetime.datetime.fromtimestamp(publish_at)
+    else:
+        tomorrow = SlotScheduler().assign(1)[0]
+    print("title:", title, "输出的时间是:", tomorrow.strftime("%Y-%m-%d %H:%M"))
     return tomorrow.strftime("%Y-%m-%d %H:%M")
 
 
-def publish_douyin(driver, mp4, index):
+def publish_douyin(driver, mp4, index, publish_at=None):
     ''' 
      作用：发布抖音视频 
     '''
@@ -303,7 +525,7 @@ def publish_douyin(driver, mp4, index):
         input_data.send_keys(Keys.CONTROL, 'a')  # 全选
         # input_data.send_keys(Keys.DELETE)
         time.sleep(3)
-        input_data.send_keys(get_publish_date(title, index))
+        input_data.send_keys(get_publish_date(title, index, publish_at))
 
     # 等待视频上传完成,放到最后,这一步是最慢的.
     times = 10
@@ -333,42 +555,53 @@ def publish_douyin(driver, mp4, index):
 # publish_douyin(driver=driver)
 
 
+def enqueue_map4(queue, platform):
+    """
+    把输出目录里的视频加入发布队列（已入队/已发布的文件按内容哈希自动跳过），
+    并一次性为尚未排期的条目分配发布时间（避开队列中已占用的时间）
+    """
+    try:
+        from .publish_scheduler import schedule_queue
+    except ImportError:  # 作为脚本直接运行时
+        from publish_scheduler import schedule_queue
+
+    for index, mp4 in enumerate(get_map4()):
+        queue.enqueue(platform, mp4[0], {"name": mp4[1], "index": index})
+    schedule_queue(queue, platform)
+
+
 def run(driver):
+    try:
+        from .publish_queue import PublishQueue
+        from .publish_scheduler import ensure_publish_at
+    except ImportError:  # 作为脚本直接运行时
+        from publish_queue import PublishQueue
+        from publish_scheduler import ensure_publish_at
+
+    queue = PublishQueue(PUBLISH_QUEUE_DB)
     try:
         login(driver=driver)
-        mp4s = get_map4()
-        mp4s_len = len(mp4s)
-        index = 0
-        while index < mp4s_len:
-            try:
-                publish_douyin(driver, mp4s[index], index)
-            except Exception as e:
-                traceback.print_exc()
-                index -= 1
-            finally:
-                print(f"mp4长度是{mp4s_len},当前是:{index}")
-                index += 1
-            time.sleep(10)
+        queue.recover("douyin")
+        enqueue_map4(queue, "douyin")
+
+        def handle(item):
+            publish_at = ensure_publish_at(queue, item, "douyin")
+            publish_douyin(driver, (item.file_path, item.payload["name"]), item.payload["index"], publish_at)
+            return bool(isDingShi)
+
+        stats = queue.drain("douyin", handle, pace_seconds=10)
+        print("发布队列状态:", stats)
     finally:
+        queue.close()
         driver.quit()
 
 
 if __name__ == "__main__":
-    try:
-        driver = get_driver()
-        login(driver=driver)
-        mp4s = get_map4()
-        mp4s_len = len(mp4s)
-        index = 0
-        while index < mp4s_len:
-            try:
-                publish_douyin(driver, mp4s[index], index)
-            except Exception as e:
-                traceback.print_exc()
-                index -= 1
-            finally:
-                index += 1
-                print(f"mp4长度是{mp4s_len},当前是:{index}")
-            time.sleep(10)
-    finally:
-        driver.quit()
+    import sys
+
+    if "--bench" in sys.argv:
+        for mode, stats in benchmark_driver().items():
+            memory = f"{stats['memory_mb']:.0f} MB" if stats["memory_mb"] is not None else "未知（需安装 psutil）"
+            print(f"{mode}: 启动 {stats['startup_seconds']:.2f}s, 加载发布页 {stats['load_seconds']:.2f}s, 内存 {memory}")
+    else:
+        run(get_driver(network_log=False))  # 抖音发布流程不读取网络日志
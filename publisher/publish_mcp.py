@@ -1,7 +1,9 @@
 from mcp.server.fastmcp import FastMCP
 import os
 import sys
-from typing import List, Dict, Any
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple
 
 # Ensure repo root is on sys.path (supports `python publisher/publish_mcp.py`)
 _REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -10,13 +12,55 @@ if _REPO_ROOT not in sys.path:
 
 # 导入旅游数据工具
 try:
-    from crawler.places_read_mcp import get_spots_by_city
+    from crawler.places_read_mcp import DATA_ROOT, get_spots_by_city
 except ImportError:
     # Fallback for package execution contexts
-    from crawler.places_read_mcp import get_spots_by_city
+    from crawler.places_read_mcp import DATA_ROOT, get_spots_by_city
 
 mcp = FastMCP("Xiaohongshu Publisher")
 
+# 笔记内容缓存：键为 (省份, 城市, 景点, 风格, 数据快照版本)，景点数据变化后版本随之变化，旧结果自然失效
+CONTENT_CACHE_SIZE = int(os.getenv("XHS_CONTENT_CACHE_SIZE", "256"))
+# 两次检查数据版本的最小间隔（秒）：间隔内（例如同一批量任务中）直接复用版本，不访问文件系统
+DATA_VERSION_CHECK_INTERVAL = float(os.getenv("PLACES_DATA_CHECK_INTERVAL", "2"))
+_content_cache: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+_data_versions: Dict[Tuple[str, str], Tuple[int, float]] = {}
+
+
+def _city_data_version(province: str, city: str) -> int:
+    """
+    城市景点数据的快照版本：目录下所有 JSON 文件的（相对路径、修改时间、大小）摘要
+    只做 stat 不读取内容；文件新增、删除或修改都会改变版本
+    """
+    now = time.monotonic()
+    cached = _data_versions.get((province, city))
+    if cached and now - cached[1] < DATA_VERSION_CHECK_INTERVAL:
+        return cached[0]
+    
+    path = os.path.join(DATA_ROOT, province, city)
+    entries = []
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            if f.lower().endswith(".json"):
+                fp = os.path.join(root, f)
+                try:
+                    st = os.stat(fp)
+                except OSError:
+                    continue
+                entries.append((os.path.relpath(fp, path), st.st_mtime_ns, st.st_size))
+    version = hash(tuple(sorted(entries)))
+    _data_versions[(province, city)] = (version, now)
+    return version
+
+
+def _copy_content_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """返回缓存结果的副本，调用方修改列表不会污染缓存"""
+    copied = dict(result)
+    for key in ("topics", "spots_included"):
+        if key in copied:
+            copied[key] = list(copied[key])
+    return copied
+
 
 @mcp.tool(
     name='validate_xiaohongshu_content',
@@ -109,7 +153,8 @@ def publish_xiaohongshu_video(
     """
     try:
         # Import locally to avoid requiring selenium if not used
-        from middleware.upload_utils import publish_single_post, get_driver, xiaohongshu_login
+        from middleware.upload_utils import publish_single_post, get_session_pool
+        from middleware.video_transcode import prepare_video
         
         if topics is None:
             topics = ["#旅游", "#攻略", "#景点推荐"]
@@ -120,12 +165,14 @@ def publish_xiaohongshu_video(
                 "message": f"文件不存在: {file_path}"
             }
         
-        driver = get_driver()
-        try:
-            xiaohongshu_login(driver)
+        # 开启 VIDEO_TRANSCODE 时先压缩到平台上限（在借用浏览器之前完成，不占用会话）
+        upload_path = prepare_video(file_path)
+        
+        # 复用会话池中已登录的浏览器，连续发布无需重新启动和登录
+        with get_session_pool().session() as driver:
             publish_single_post(
                 driver=driver,
-                file_path=file_path,
+                file_path=upload_path,
                 title=title,
                 content=content,
                 topics=topics,
@@ -142,8 +189,6 @@ def publish_xiaohongshu_video(
                     "schedule_hours": schedule_hours
                 }
             }
-        finally:
-            driver.quit()
             
     except ImportError as e:
         return {
@@ -182,23 +227,29 @@ def publish_xiaohongshu_images(
         发布结果信息
     """
     try:
-        from middleware.upload_utils import publish_image_post, get_driver, xiaohongshu_login
+        from middleware.upload_utils import IMAGE_MAX_COUNT, publish_image_post, get_session_pool, split_image_paths
         
         if topics is None:
             topics = ["#旅游", "#风景", "#打卡"]
         
-        if not os.path.exists(file_path):
+        image_paths = split_image_paths(file_path)
+        missing = [p for p in image_paths if not os.path.exists(p)]
+        if not image_paths or missing:
             return {
                 "success": False,
-                "message": f"文件不存在: {file_path}"
+                "message": f"文件不存在: {', '.join(missing) or file_path}"
+            }
+        if len(image_paths) > IMAGE_MAX_COUNT:
+            return {
+                "success": False,
+                "message": f"图片数量超过上限 {IMAGE_MAX_COUNT}: {len(image_paths)}"
             }
         
-        driver = get_driver()
-        try:
-            xiaohongshu_login(driver)
+        # 复用会话池中已登录的浏览器，连续发布无需重新启动和登录
+        with get_session_pool().session() as driver:
             publish_image_post(
                 driver=driver,
-                file_path=file_path,
+                file_path=image_paths,
                 title=title,
                 content=content,
                 topics=topics,
@@ -210,13 +261,12 @@ def publish_xiaohongshu_images(
                 "message": "图文笔记发布成功",
                 "details": {
                     "file_path": file_path,
+                    "image_count": len(image_paths),
                     "title": title,
                     "topics": topics,
                     "schedule_hours": schedule_hours
                 }
             }
-        finally:
-            driver.quit()
             
     except ImportError as e:
         return {
@@ -252,6 +302,27 @@ def generate_xiaohongshu_content(
     返回:
         生成的标题、内容和推荐话题
     """
+    # 同一份景点数据、同样参数的结果直接取缓存，批量任务中重复的城市不再遍历和解析数据目录
+    key = (province, city, spot_name, style, _city_data_version(province, city))
+    cached = _content_cache.get(key)
+    if cached is not None:
+        _content_cache.move_to_end(key)
+        return _copy_content_result(cached)
+    
+    result = _build_xiaohongshu_content(province, city, spot_name, style)
+    _content_cache[key] = result
+    while len(_content_cache) > CONTENT_CACHE_SIZE:
+        _content_cache.popitem(last=False)
+    return _copy_content_result(result)
+
+
+def _build_xiaohongshu_content(
+    province: str,
+    city: str,
+    spot_name: str,
+    style: str
+) -> Dict[str, Any]:
+    """读取城市景点数据并生成笔记内容（未缓存时调用）"""
     data = get_spots_by_city(province, city)
     spots = data.get("spots", [])
     
@@ -352,9 +423,118 @@ def generate_xiaohongshu_content(
     }
 
 
+def _prepare_batch_posts(
+    province: str,
+    cities: List[str],
+    file_paths: List[str],
+    style: str
+):
+    """
+    为每个城市生成笔记内容并检查文件（发布时间由 _schedule_posts 统一排期）
+
+    返回:
+        (results, posts, post_indexes)：results 与 cities 一一对应（待发布的项尚无 success/message），
+        posts 为待发布笔记，post_indexes 为其在 cities 中的下标
+    """
+    results = [None] * len(cities)
+    posts = []
+    post_indexes = []
+    for i, (city, file_path) in enumerate(zip(cities, file_paths)):
+        content_result = generate_xiaohongshu_content(province, city, style=style)
+        
+        if not content_result.get("success"):
+            results[i] = {
+                "city": city,
+                "success": False,
+                "message": content_result.get("message")
+            }
+            continue
+        
+        # 判断文件类型；图文笔记可以是逗号分隔的多张图片，视频路径不拆分
+        is_video = file_path.lower().endswith(('.mp4', '.mov', '.avi'))
+        paths = [file_path] if is_video else [p.strip() for p in file_path.split(",") if p.strip()]
+        missing = [p for p in paths if not os.path.exists(p)]
+        if missing:
+            results[i] = {
+                "city": city,
+                "success": False,
+                "title": content_result["title"],
+                "message": f"文件不存在: {', '.join(missing)}"
+            }
+            continue
+        
+        post = {
+            "file_path": file_path,
+            "title": content_result["title"],
+            "content": content_result["content"],
+            "topics": content_result["topics"],
+            "is_video": is_video,
+        }
+        if not is_video:
+            post["image_paths"] = paths
+        posts.append(post)
+        post_indexes.append(i)
+        results[i] = {
+            "city": city,
+            "title": content_result["title"],
+        }
+    
+    return results, posts, post_indexes
+
+
+def _schedule_posts(
+    results: List[Dict[str, Any]],
+    posts: List[Dict[str, Any]],
+    post_indexes: List[int],
+    platform: str,
+    schedule_interval_hours: int
+):
+    """
+    一次性为一个账号的待发布笔记排期：落在该账号的发布窗口内（publish_calendar.json 或 PUBLISH_WINDOWS），
+    避开发布队列中已占用的时间，且相邻两篇至少间隔 schedule_interval_hours 小时
+    """
+    import time
+    from middleware.publish_queue import PublishQueue
+    from middleware.publish_scheduler import SlotScheduler, queue_busy_times, windows_for
+    from middleware.web_utils import PUBLISH_QUEUE_DB
+    
+    if not posts:
+        return
+    scheduler = SlotScheduler(windows_for(platform), min_gap_minutes=schedule_interval_hours * 60)
+    queue = PublishQueue(PUBLISH_QUEUE_DB)
+    try:
+        slots = scheduler.assign(len(posts), busy=queue_busy_times(queue, platform))
+    finally:
+        queue.close()
+    
+    now = time.time()
+    for i, post, slot in zip(post_indexes, posts, slots):
+        post["publish_at"] = slot.timestamp()
+        post["date_offset_hours"] = (post["publish_at"] - now) / 3600
+        results[i]["publish_time"] = slot.strftime("%Y-%m-%d %H:%M")
+        results[i]["schedule_hours"] = round(post["date_offset_hours"], 2)
+
+
+def _record_scheduled(platform: str, posts: List[Dict[str, Any]], publish_results: List[Dict[str, Any]]):
+    """把直接发布成功的定时笔记写入发布队列，后续排期会避开这些时间"""
+    from middleware.publish_queue import PublishQueue
+    from middleware.web_utils import PUBLISH_QUEUE_DB
+    
+    queue = PublishQueue(PUBLISH_QUEUE_DB)
+    try:
+        for post, publish_result in zip(posts, publish_results):
+            if not publish_result.get("success"):
+                continue
+            key = queue.enqueue(platform, post["file_path"], post, image_paths=post.get("image_paths"))
+            queue.set_publish_times({key: post["publish_at"]})
+            queue.mark_done(key, scheduled=True)
+    finally:
+        queue.close()
+
+
 @mcp.tool(
     name='batch_publish_xiaohongshu',
-    description='批量发布小红书笔记（支持多个城市的景点内容）'
+    description='批量发布小红书笔记（支持多个城市的景点内容；先生成全部内容，只登录一次，在同一浏览器中流水线发布）'
 )
 def batch_publish_xiaohongshu(
     province: str,
@@ -364,14 +544,14 @@ def batch_publish_xiaohongshu(
     schedule_interval_hours: int = 24
 ) -> Dict[str, Any]:
     """
-    批量生成并发布小红书笔记
+    批量生成并发布小红书笔记（先生成全部内容，再登录一次流水线发布）
     
     参数:
         province: 省份名称
         cities: 城市列表
         file_paths: 对应每个城市的媒体文件路径列表
         style: 内容风格
-        schedule_interval_hours: 每篇笔记之间的发布间隔（小时）
+        schedule_interval_hours: 相邻两篇笔记的最小发布间隔（小时），发布时间落在账号的发布窗口内
     
     返回:
         批量发布结果
@@ -382,51 +562,32 @@ def batch_publish_xiaohongshu(
             "message": "城市数量与文件数量不匹配"
         }
     
-    results = []
+    # 1. 先生成全部内容（纯本地计算），失败的城市不占用浏览器
+    results, posts, post_indexes = _prepare_batch_posts(province, cities, file_paths, style)
     
-    for i, (city, file_path) in enumerate(zip(cities, file_paths)):
-        # 生成内容
-        content_result = generate_xiaohongshu_content(province, city, style=style)
-        
-        if not content_result.get("success"):
-            results.append({
-                "city": city,
-                "success": False,
-                "message": content_result.get("message")
-            })
-            continue
-        
-        # 计算发布时间
-        schedule_hours = schedule_interval_hours * (i + 1)
-        
-        # 判断文件类型
-        is_video = file_path.lower().endswith(('.mp4', '.mov', '.avi'))
-        
-        # 发布
-        if is_video:
-            publish_result = publish_xiaohongshu_video(
-                file_path=file_path,
-                title=content_result["title"],
-                content=content_result["content"],
-                topics=content_result["topics"],
-                schedule_hours=schedule_hours
-            )
+    # 2. 一次性排期，只登录一次，在同一会话中流水线发布（下一篇上传与当前篇填写重叠）
+    if posts:
+        try:
+            from middleware.upload_utils import DEFAULT_ACCOUNT, account_platform, get_session_pool, publish_posts_pipelined
+            
+            platform = account_platform(DEFAULT_ACCOUNT)
+            _schedule_posts(results, posts, post_indexes, platform, schedule_interval_hours)
+            with get_session_pool().session() as driver:
+                publish_results = publish_posts_pipelined(driver, posts)
+        except ImportError as e:
+            publish_results = [{"success": False, "message": f"缺少依赖: {str(e)}，请确保已安装 selenium"}] * len(posts)
+        except Exception as e:
+            publish_results = [{"success": False, "message": f"发布失败: {str(e)}"}] * len(posts)
         else:
-            publish_result = publish_xiaohongshu_images(
-                file_path=file_path,
-                title=content_result["title"],
-                content=content_result["content"],
-                topics=content_result["topics"],
-                schedule_hours=schedule_hours
-            )
+            # 笔记已经发出，记录排期失败只影响之后的避让，不改变本次发布结果
+            try:
+                _record_scheduled(platform, posts, publish_results)
+            except Exception as e:
+                print(f"记录发布排期失败: {e}", file=sys.stderr)
         
-        results.append({
-            "city": city,
-            "success": publish_result.get("success"),
-            "title": content_result["title"],
-            "schedule_hours": schedule_hours,
-            "message": publish_result.get("message")
-        })
+        for i, publish_result in zip(post_indexes, publish_results):
+            results[i]["success"] = publish_result.get("success")
+            results[i]["message"] = publish_result.get("message")
     
     success_count = sum(1 for r in results if r.get("success"))
     
@@ -439,13 +600,183 @@ def batch_publish_xiaohongshu(
     }
 
 
+@mcp.tool(
+    name='batch_publish_multi_account',
+    description='多账号并行批量发布小红书笔记：城市轮流分配给各账号，每个账号在独立进程和独立浏览器配置中登录一次并按频率上限发布（账号需先用 `python -m middleware.upload_utils --login 账号名` 登录）'
+)
+def batch_publish_multi_account(
+    province: str,
+    cities: List[str],
+    file_paths: List[str],
+    accounts: List[str] = None,
+    style: str = "旅游攻略",
+    schedule_interval_hours: int = 24
+) -> Dict[str, Any]:
+    """
+    多账号并行批量发布
+    
+    参数:
+        province: 省份名称
+        cities: 城市列表
+        file_paths: 对应每个城市的媒体文件路径列表
+        accounts: 发布账号列表（默认使用所有已登录账号）
+        style: 内容风格
+        schedule_interval_hours: 同一账号相邻两篇笔记的最小发布间隔（小时），发布时间落在各账号的发布窗口内
+    
+    返回:
+        每个城市的发布结果（含分配的账号）和各账号的队列统计
+    """
+    if len(cities) != len(file_paths):
+        return {
+            "success": False,
+            "message": "城市数量与文件数量不匹配"
+        }
+    
+    try:
+        from middleware.upload_utils import account_login_error, account_platform, list_accounts, publish_multi_account
+    except ImportError as e:
+        return {
+            "success": False,
+            "message": f"缺少依赖: {str(e)}，请确保已安装 selenium"
+        }
+    
+    accounts = accounts or list_accounts()
+    if not accounts:
+        return {
+            "success": False,
+            "message": "没有已登录的账号，请先运行 python -m middleware.upload_utils --login 账号名"
+        }
+    
+    # 先剔除登录已失效的账号，笔记只分配给可用账号，不会以失效账号的名义留在队列里
+    account_errors = {account: account_login_error(account) for account in accounts}
+    account_errors = {account: error for account, error in account_errors.items() if error}
+    accounts = [account for account in accounts if account not in account_errors]
+    if not accounts:
+        return {
+            "success": False,
+            "message": "没有可用的账号：" + "；".join(account_errors.values()),
+            "accounts": {account: {"error": error} for account, error in account_errors.items()}
+        }
+    
+    results, posts, post_indexes = _prepare_batch_posts(province, cities, file_paths, style)
+    
+    # 轮流分配给各账号，总吞吐随账号数增长；每个账号按自己的发布窗口排期
+    posts_by_account = {account: [] for account in accounts}
+    indexes_by_account = {account: [] for account in accounts}
+    for n, (i, post) in enumerate(zip(post_indexes, posts)):
+        account = accounts[n % len(accounts)]
+        posts_by_account[account].append(post)
+        indexes_by_account[account].append(i)
+        results[i]["account"] = account
+    for account in accounts:
+        _schedule_posts(results, posts_by_account[account], indexes_by_account[account], account_platform(account), schedule_interval_hours)
+    
+    try:
+        account_stats = publish_multi_account(posts_by_account)
+    except Exception as e:
+        account_stats = {account: {"error": str(e)} for account in accounts}
+    account_stats.update({account: {"error": error} for account, error in account_errors.items()})
+    
+    for i, post in zip(post_indexes, posts):
+        state = post.get("state")
+        account_error = account_stats.get(results[i]["account"], {}).get("error")
+        results[i]["success"] = state in ("published", "scheduled")
+        results[i]["state"] = state
+        results[i]["message"] = "发布成功" if results[i]["success"] else (
+            post.get("error") or account_error or f"发布失败: {state}"
+        )
+    
+    success_count = sum(1 for r in results if r.get("success"))
+    
+    return {
+        "success": True,
+        "total": len(results),
+        "success_count": success_count,
+        "failed_count": len(results) - success_count,
+        "accounts": account_stats,
+        "results": results
+    }
+
+
+@mcp.tool(
+    name='list_publish_checks',
+    description='列出发布途中被中断、需要人工确认是否已发出的笔记（needs_check）；确认后用 resolve_publish_check 处理'
+)
+def list_publish_checks(platform: str = "") -> Dict[str, Any]:
+    """
+    列出待确认的中断发布
+    
+    参数:
+        platform: 只看某个平台/账号（如 "xiaohongshu"、"xiaohongshu:账号"），为空时列出全部
+    
+    返回:
+        待确认条目列表（key、平台、文件、标题、定时发布时间、中断原因）
+    """
+    from middleware.publish_queue import NEEDS_CHECK, PublishQueue
+    from middleware.web_utils import PUBLISH_QUEUE_DB
+    
+    queue = PublishQueue(PUBLISH_QUEUE_DB)
+    try:
+        items = queue.items(NEEDS_CHECK, platform or None)
+    finally:
+        queue.close()
+    
+    return {
+        "success": True,
+        "count": len(items),
+        "items": [
+            {
+                "key": item.key,
+                "platform": item.platform,
+                "file_path": item.file_path,
+                "title": item.payload.get("title") or item.payload.get("name"),
+                "publish_at": item.payload.get("publish_at"),
+                "message": item.last_error,
+            }
+            for item in items
+        ],
+    }
+
+
+@mcp.tool(
+    name='resolve_publish_check',
+    description='处理一条待确认的中断发布：published=true 表示已在创作者中心看到该笔记（记为已发布），false 表示未发出（重新排队，下次发布时继续）'
+)
+def resolve_publish_check(key: str, published: bool) -> Dict[str, Any]:
+    """
+    处理待确认的中断发布
+    
+    参数:
+        key: list_publish_checks 返回的 key
+        published: 是否已经发出
+    
+    返回:
+        处理结果
+    """
+    from middleware.publish_queue import NEEDS_CHECK, PublishQueue
+    from middleware.web_utils import PUBLISH_QUEUE_DB
+    
+    queue = PublishQueue(PUBLISH_QUEUE_DB)
+    try:
+        item = next((i for i in queue.items(NEEDS_CHECK) if i.key == key), None)
+        if item is None:
+            return {"success": False, "message": f"没有待确认的条目: {key}"}
+        if published:
+            queue.mark_done(key, scheduled=bool(item.payload.get("publish_at")))
+            return {"success": True, "message": "已记为发布成功"}
+        queue.requeue(key)
+        return {"success": True, "message": "已重新排队，下次发布该平台时继续"}
+    finally:
+        queue.close()
+
+
 if __name__ == "__main__":
     import sys
     
     if "--sse" in sys.argv or os.getenv("MCP_TRANSPORT") == "sse":
         print("🚀 启动 Xiaohongshu Publisher MCP 服务器 (SSE模式)")
         print("   服务名称: Xiaohongshu Publisher")
-        print("   工具数量: 5")
+        print("   工具数量: 8")
         print("   传输协议: Server-Sent Events (SSE)")
         mcp.run(transport="sse")
     else: